@@ -1,11 +1,18 @@
 import os
-import tempfile
+import time
 import re
+import hmac
+import requests
 from datetime import datetime
 from typing import List, Dict
 from dotenv import load_dotenv
-from flask import Flask, request, abort
+
+# 各モジュールは読み込み時に環境変数を参照するため、ローカルのモジュールより先に .env を読み込む
+load_dotenv()
+
+from flask import Flask, request, abort, Response
 from linebot.v3 import WebhookHandler
+from linebot.v3.webhook import SignatureValidator
 from linebot.v3.exceptions import InvalidSignatureError
 from linebot.v3.messaging import (
     Configuration, ApiClient, MessagingApi, MessagingApiBlob,
@@ -20,11 +27,27 @@ import os
 # 親ディレクトリをパスに追加
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from google_sheets_handler import append_row_to_sheet, get_sheet_service, refresh_sold_items_formatting
+from google_sheets_handler import (
+    append_row_to_sheet, get_sheet_service,
+    migrate_sold_formatting_to_conditional, SOLD_HIGHLIGHT_MODE,
+    WRITE_BEHIND, get_write_buffer, flush_write_buffer, rebuild_item_index, refresh_all_sheets,
+    setup_profit_formulas_for_existing_sheet, PROFIT_FORMULA_MODE, disable_write_behind_without_persistent_journal
+)
+from item_index import format_item_for_reply
 from chatgpt_handler import ChatGPTHandler
+from tracing import span, trace_context, render_prometheus
+from usage_tracker import get_usage_tracker, format_usage_report
+from image_hash import get_image_hash_index, DUPLICATE_CHECK
+from listing_retrieval import record_listing
+from sales_report import build_sales_reply, build_stock_reply
+from spreadsheet_router import get_spreadsheet_router
+from sheet_archive import archive_sheets, archive_storage_error, lookup_item, ARCHIVE_MIN_AGE_DAYS
+from session_store import get_session_store, MULTI_ITEM_SESSIONS
+from batch_backend import BatchBackend, batch_storage_error, choose_generation_mode, format_batch_status, BATCH_MODE
+from resource_manager import get_resource_manager, current_rss_bytes, SESSION_MAX_IMAGE_MB
+from image_validation import validate_image, IMAGE_VALIDATION, MAX_IMAGES_PER_ITEM
 
 app = Flask(__name__)
-load_dotenv()
 
 LINE_CHANNEL_SECRET = os.getenv('LINE_CHANNEL_SECRET')
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
@@ -32,14 +55,64 @@ LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
 if not LINE_CHANNEL_SECRET or not LINE_CHANNEL_ACCESS_TOKEN:
     raise ValueError("LINE APIトークンが設定されていません")
 
-configuration = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN)
+# /metrics を取得するためのトークン（Authorization: Bearer <トークン>）。未設定の場合は /metrics を公開しない
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# LINE APIの接続先（ベンチマーク用のローカルサーバーに向ける場合のみ設定）
+LINE_API_ENDPOINT = os.getenv('LINE_API_ENDPOINT')
+LINE_DATA_API_ENDPOINT = os.getenv('LINE_DATA_API_ENDPOINT')
+
+configuration = Configuration(access_token=LINE_CHANNEL_ACCESS_TOKEN, host=LINE_API_ENDPOINT)
 handler = WebhookHandler(LINE_CHANNEL_SECRET)
 
+class TracedSignatureValidator(SignatureValidator):
+    """handler.handle が行う署名検証の所要時間を記録する（検証は1回のみ）"""
+
+    def validate(self, body, signature):
+        with span('line.signature_verification'):
+            return super().validate(body, signature)
+
+handler.parser.signature_validator = TracedSignatureValidator(LINE_CHANNEL_SECRET)
+
 chatgpt_handler = ChatGPTHandler()
 
-temp_image_paths: List[str] = []
-temp_image_urls: List[str] = []
-temp_features: str = ""
+# 急がない商品をまとめて生成するBatch APIの待ち行列（結果は保存してからユーザーごとにまとめて送る）
+batch_backend = BatchBackend(
+    chatgpt_handler,
+    save_listing=lambda item, product_info: save_listing(item, product_info),
+    notify=lambda user_id, results: push_listing_results(user_id, results, batch=True)
+)
+
+# 商品情報をストリーミングで生成し、商品名と出品価格が確定した時点で先に送信するか（プッシュメッセージを1通追加で使う）
+EARLY_TITLE_PUSH = os.getenv('EARLY_TITLE_PUSH', '0') == '1'
+
+# #更新 の進捗をプッシュで送る間隔（秒）。これより早く終わる場合は結果のみ送る
+REFRESH_PROGRESS_INTERVAL = float(os.getenv('REFRESH_PROGRESS_INTERVAL', '20'))
+
+# Vercelではジャーナルが /tmp にあり、返信した後の行がインスタンスの入れ替えで消える可能性があるため、
+# 保存先が永続的でない場合はライトビハインドを使わず、商品ごとにシートへ直接書き込む
+if disable_write_behind_without_persistent_journal():
+    WRITE_BEHIND = False
+
+# ライトビハインドの場合、起動時に前回反映されなかった行をジャーナルから再反映する
+if WRITE_BEHIND:
+    get_write_buffer()
+
+# Vercelでは応答後のスレッドが止められ、生成待ちの商品の生成と結果の送信が止まるため、1商品ずつリクエスト内で生成する
+if MULTI_ITEM_SESSIONS:
+    print("MULTI_ITEM_SESSIONS はVercelでは使えないため無効にしました（常駐するサーバーの main.py で使ってください）")
+    MULTI_ITEM_SESSIONS = False
+
+# Vercelでは待ち行列（LOCAL_STATE_DIR）が /tmp にあり、インスタンスの入れ替えで送信待ちの商品と送信済みのバッチIDが消えるため、
+# 保存先が永続的な場合のみバッチ生成を使う。応答後のスレッドも止められるため、送信と結果の確認は #バッチ でも行う
+BATCH_STORAGE_ERROR = batch_storage_error() if BATCH_MODE != 'off' else None
+if BATCH_STORAGE_ERROR:
+    print(f"OPENAI_BATCH_MODE={BATCH_MODE} を無効にしました: {BATCH_STORAGE_ERROR}")
+    BATCH_MODE = 'off'
+
+# バッチ生成を使う場合、起動時に送信待ち・送信済みのバッチの確認を再開する
+if BATCH_MODE != 'off':
+    batch_backend.start()
 
 def is_management_number(text: str) -> bool:
     """6桁の数字（管理番号）かどうかを判定する"""
@@ -68,107 +141,361 @@ def modify_product_title_with_number(title: str, management_number: str) -> str:
 def callback():
     signature = request.headers['X-Line-Signature']
     body = request.get_data(as_text=True)
+    # 放置されたセッションの画像を削除する（前回の確認から一定時間が経っている場合のみ）
+    get_resource_manager().maybe_reap()
     try:
-        handler.handle(body, signature)
+        with span('line.webhook') as tags:
+            handler.handle(body, signature)
+            tags['rss_bytes'] = current_rss_bytes()
     except InvalidSignatureError:
         abort(400)
     return 'OK'
 
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    """処理ごとの所要時間のヒストグラムをPrometheus形式で返す（METRICS_TOKEN を設定した場合のみ）"""
+    if not METRICS_TOKEN:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}"):
+        abort(401)
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @handler.add(MessageEvent, message=TextMessageContent)
 def handle_text_message(event):
-    global temp_features
+    with trace_context(user=event.source.user_id):
+        _handle_text_message(event)
+
+def _handle_text_message(event):
     user_text = event.message.text
 
-    # 売れた商品の色を更新するコマンド
-    if user_text == "#更新":
+    # 売れた商品の色を修復するコマンド（「#更新 全体」で全行を再判定）
+    # シート数が多いと返信の期限に間に合わないため、先に返信してから並列に処理し、進捗と結果をプッシュで送る
+    # Vercelでは応答を返した後のスレッドが止められるため、バックグラウンドにせずこのリクエスト内で処理する
+    # （vercel.json の maxDuration 以内に終わらない場合は、残りのシートは次の #更新 で処理される）
+    if user_text in ("#更新", "#更新 全体"):
+        incremental = user_text == "#更新"
+        user_id = event.source.user_id
+        reply_text(event.reply_token, "🔄 シートの更新を開始しました。完了したらお知らせします。")
+
+        def run_refresh():
+            last_push = time.monotonic()
+
+            def on_progress(done: int, total: int):
+                nonlocal last_push
+                # プッシュメッセージの通数を抑えるため、REFRESH_PROGRESS_INTERVAL 秒ごとにまとめて送る
+                if done < total and time.monotonic() - last_push >= REFRESH_PROGRESS_INTERVAL:
+                    last_push = time.monotonic()
+                    push_text(user_id, f"🔄 {done}/{total} シート完了")
+
+            try:
+                result = refresh_all_sheets(incremental=incremental, on_progress=on_progress)
+                failed = f"\n失敗したシート: {result['failed']}件" if result['failed'] else ""
+                if SOLD_HIGHLIGHT_MODE == 'conditional':
+                    push_text(user_id, f"✅ 売れた商品の色設定を確認しました（{result['sheets']}シート）。\n修復したシート: {result['updated']}件{failed}")
+                else:
+                    push_text(user_id, f"✅ 売れた商品の色を更新しました（{result['sheets']}シート）。\n更新件数: {result['updated']}件{failed}")
+            except Exception as e:
+                push_text(user_id, f"❌ 更新に失敗しました: {str(e)}")
+
+        run_refresh()
+        return
+
+    # 行ごとの色付けを条件付き書式に移行するコマンド
+    if user_text == "#色移行":
         try:
             sheet = get_sheet_service()
-            # すべてのシートを取得
-            spreadsheet = sheet.get(spreadsheetId='1r9gAZZlWw40bURXOE2-BJB9OAZPEoPuN8-GZ7iD0yBA').execute()
-            total_updated = 0
-            
-            for worksheet in spreadsheet['sheets']:
-                sheet_name = worksheet['properties']['title']
-                updated_count = refresh_sold_items_formatting(sheet, sheet_name)
-                total_updated += updated_count
-            
-            reply_text(event.reply_token, f"✅ 売れた商品の色を更新しました。\n更新件数: {total_updated}件")
+            migrated_count = 0
+
+            for sheet_name in get_spreadsheet_router().list_sheet_names(sheet):
+                if migrate_sold_formatting_to_conditional(sheet, sheet_name):
+                    migrated_count += 1
+
+            reply_text(event.reply_token, f"✅ 売れた商品の色を条件付き書式に移行しました。\n移行したシート: {migrated_count}件")
+        except Exception as e:
+            reply_text(event.reply_token, f"❌ 移行に失敗しました: {str(e)}")
+        return
+
+    # 利益列を PROFIT_FORMULA_MODE の方式に移行するコマンド（手数料・固定費を変更した場合も実行）
+    if user_text == "#利益移行":
+        try:
+            sheet = get_sheet_service()
+            migrated_count = 0
+
+            for sheet_name in get_spreadsheet_router().list_sheet_names(sheet):
+                if setup_profit_formulas_for_existing_sheet(sheet, sheet_name):
+                    migrated_count += 1
+
+            reply_text(event.reply_token, f"✅ 利益列を設定し直しました（方式: {PROFIT_FORMULA_MODE}）。\n設定したシート: {migrated_count}件")
+        except Exception as e:
+            reply_text(event.reply_token, f"❌ 利益列の設定に失敗しました: {str(e)}")
+        return
+
+    # ライトビハインドで未反映の行をすぐにスプレッドシートへ反映するコマンド
+    if user_text == "#反映":
+        try:
+            flushed_count = flush_write_buffer()
+            reply_text(event.reply_token, f"✅ スプレッドシートに反映しました。\n反映件数: {flushed_count}件")
+        except Exception as e:
+            reply_text(event.reply_token, f"❌ 反映に失敗しました: {str(e)}")
+        return
+
+    # 管理番号で商品を検索するコマンド（例：#検索 123456）
+    if user_text.startswith("#検索"):
+        query = user_text[len("#検索"):].strip()
+        if not is_management_number(query):
+            reply_text(event.reply_token, "❌ 「#検索 123456」の形式で管理番号を指定してください。")
+            return
+        item = lookup_item(query)
+        if item:
+            reply_text(event.reply_token, format_item_for_reply(item))
+        else:
+            reply_text(event.reply_token, f"❌ 管理番号 {query} の商品が見つかりませんでした。\n（#索引更新 でスプレッドシートから索引を作り直せます）")
+        return
+
+    # スプレッドシートから商品の索引を作り直すコマンド
+    if user_text == "#索引更新":
+        try:
+            count = rebuild_item_index(get_sheet_service())
+            reply_text(event.reply_token, f"✅ 商品の索引を更新しました。\n登録件数: {count}件")
+        except Exception as e:
+            reply_text(event.reply_token, f"❌ 索引の更新に失敗しました: {str(e)}")
+        return
+
+    # OpenAIの利用額を表示するコマンド（例：#コスト、#コスト 2025-07-01）
+    if user_text.startswith("#コスト"):
+        day = user_text[len("#コスト"):].strip() or None
+        try:
+            reply_text(event.reply_token, format_usage_report(get_usage_tracker().summarize(day)))
+        except Exception as e:
+            reply_text(event.reply_token, f"❌ 利用額の集計に失敗しました: {str(e)}")
+        return
+
+    # 売上を集計するコマンド（例：#売上、#売上 2025-07、#売上 月別）
+    if user_text.startswith("#売上"):
+        try:
+            reply_text(event.reply_token, build_sales_reply(user_text[len("#売上"):]))
+        except Exception as e:
+            reply_text(event.reply_token, f"❌ 売上の集計に失敗しました: {str(e)}")
+        return
+
+    # 売れていない商品を集計するコマンド
+    if user_text == "#在庫":
+        try:
+            reply_text(event.reply_token, build_stock_reply())
         except Exception as e:
-            reply_text(event.reply_token, f"❌ 更新に失敗しました: {str(e)}")
+            reply_text(event.reply_token, f"❌ 在庫の集計に失敗しました: {str(e)}")
+        return
+
+    # すべて売れた古いシートをローカルにアーカイブするコマンド
+    # （#アーカイブ: 対象のシートを表示、#アーカイブ 実行: 保存してスプレッドシートから削除）
+    if user_text.startswith("#アーカイブ"):
+        execute = user_text[len("#アーカイブ"):].strip() == "実行"
+        try:
+            sheet_names = archive_sheets(get_sheet_service(), dry_run=not execute)
+            if not sheet_names:
+                reply_text(event.reply_token, f"アーカイブできるシートはありません。\n（すべて売れていて、{ARCHIVE_MIN_AGE_DAYS}日以上更新のないシートが対象です）")
+            elif execute:
+                reply_text(event.reply_token, f"✅ {len(sheet_names)}件のシートをアーカイブし、スプレッドシートから削除しました。\n{', '.join(sheet_names)}")
+            elif archive_storage_error():
+                reply_text(event.reply_token, f"📦 アーカイブできるシート（{len(sheet_names)}件）:\n{', '.join(sheet_names)}\n\n⚠️ {archive_storage_error()}。永続的な保存先を設定するまでシートは削除できません。")
+            else:
+                reply_text(event.reply_token, f"📦 アーカイブできるシート（{len(sheet_names)}件）:\n{', '.join(sheet_names)}\n\n「#アーカイブ 実行」でローカルに保存し、スプレッドシートから削除します。")
+        except Exception as e:
+            reply_text(event.reply_token, f"❌ アーカイブに失敗しました: {str(e)}")
+        return
+
+    session = get_session_store().get(event.source.user_id)
+
+    # 次の商品を急がない商品としてBatch APIで生成するコマンド
+    if user_text == "#後で":
+        if BATCH_MODE == 'off':
+            reply_text(event.reply_token, f"❌ バッチ生成は無効です（{BATCH_STORAGE_ERROR or 'OPENAI_BATCH_MODE を設定してください'}）。")
+            return
+        session.defer_next_item()
+        reply_text(event.reply_token, "🌙 次の商品はバッチで生成します（料金は半額、結果は完了後にまとめてお知らせします）。")
+        return
+
+    # バッチ生成の状況を表示するコマンド（「#バッチ 送信」で送信待ちの商品をすぐに送信）
+    if user_text in ("#バッチ", "#バッチ 送信"):
+        try:
+            batch_backend.submit_pending(force=user_text == "#バッチ 送信")
+            # 応答後は確認用のスレッドが止められるため、完了したバッチの結果の保存もこのリクエスト内で行う
+            batch_backend.poll()
+            reply_text(event.reply_token, format_batch_status(batch_backend.status()))
+        except Exception as e:
+            reply_text(event.reply_token, f"❌ バッチの送信に失敗しました: {str(e)}")
         return
 
     if is_management_number(user_text):
-        if not temp_image_paths:
+        if not session.image_paths:
             reply_text(event.reply_token, "❌ 先に商品の画像を送信してください。")
             return
 
+        # 出品済みの商品と同じ画像でないかをOpenAIの呼び出し前に確認する
+        if DUPLICATE_CHECK and session.pending_duplicate_number != user_text:
+            duplicate = get_image_hash_index().find_duplicate(session.image_paths, exclude=user_text)
+            if duplicate:
+                duplicate_number, distance = duplicate
+                item = lookup_item(duplicate_number)
+                session.pending_duplicate_number = user_text
+                reply_text(event.reply_token, (
+                    f"⚠️ 出品済みの商品（{duplicate_number}"
+                    f"{'：' + item['title'] if item and item.get('title') else ''}）と同じ商品の可能性があります。\n"
+                    f"（画像の差: {distance}/64）\n\n"
+                    f"このまま生成する場合は、もう一度「{user_text}」を送信してください。"
+                ))
+                return
+
+        item = session.take_item(user_text)
+
+        # 急がない商品（#後で）と、生成中の商品が多い場合はBatch APIに回す
+        if choose_generation_mode(item['deferred'], get_session_store().in_flight(), BATCH_MODE) == 'batch':
+            pending = batch_backend.enqueue(item, event.source.user_id)
+            reply_text(event.reply_token, f"🌙 {user_text} をバッチ生成に回しました（送信待ち: {pending}件）。\n結果は完了後にまとめてお知らせします。")
+            return
+
+        # 生成待ちに入れてすぐに返信し、続けて次の商品を受け付ける（結果は生成待ちがなくなった時点でまとめて送る）
+        if MULTI_ITEM_SESSIONS:
+            user_id = event.source.user_id
+
+            def generate(item: Dict) -> Dict:
+                with trace_context(user=user_id):
+                    return create_listing(item)
+
+            in_flight = get_session_store().submit(
+                session, item, generate, lambda session, results: push_listing_results(session.user_id, results))
+            reply_text(event.reply_token, f"📥 {user_text} を受け付けました（生成中: {in_flight}件）。\n続けて次の商品の画像を送信できます。")
+            return
+
+        on_preview = None
+        if EARLY_TITLE_PUSH:
+            user_id = event.source.user_id
+            management_number = user_text
+
+            def on_preview(preview: dict):
+                # 説明文の生成を待たずに、管理番号入りの商品名と出品価格を先に送信
+                title = modify_product_title_with_number(preview['title'], management_number)
+                push_text(user_id, f"{title}\n\n{preview['start_price']}円\n\n（説明文を作成中です…）")
+
+        result = create_listing(item, on_preview)
+        if 'error' in result:
+            reply_text(event.reply_token, f"❌ {result['error']}")
+            return
+
+        messages = format_listing_messages(result['product_info'])
+        reply_text(event.reply_token, messages[0])
+        # LINE Messaging APIの制限（5,000文字）を超えて分割した場合は残りをプッシュで送信
+        for message in messages[1:]:
+            push_text(event.source.user_id, message)
+    else:
+        session.set_features(user_text)
+        # 返信メッセージを削除して、LINE画面をすっきりさせる
+
+def create_listing(item: Dict, on_preview=None) -> Dict:
+    """1商品分の商品情報を生成してスプレッドシートに保存し、結果（product_info または error）を返す
+
+    処理が終わったら一時保存した画像を削除する。
+    """
+    management_number = item['management_number']
+    image_paths = item['image_paths']
+    with trace_context(management_number=management_number):
         try:
             # テキスト特徴がある場合は従来の処理、ない場合は画像のみの処理
-            if temp_features:
+            if item['features']:
                 # ChatGPTのVision APIを使用して商品情報を生成（テキスト特徴あり）
-                product_info = chatgpt_handler.generate_product_info(temp_image_paths, temp_features)
+                product_info = chatgpt_handler.generate_product_info(image_paths, item['features'], on_preview)
             else:
                 # 画像のみから商品情報を生成
-                product_info = chatgpt_handler.generate_product_info_from_images_only(temp_image_paths)
-            
+                product_info = chatgpt_handler.generate_product_info_from_images_only(image_paths, on_preview)
+
             if not product_info:
-                reply_text(event.reply_token, "❌ 商品情報の生成に失敗しました。")
-                return
+                return {'management_number': management_number, 'error': "商品情報の生成に失敗しました。"}
+            return save_listing(item, product_info)
+        finally:
+            get_resource_manager().release(image_paths)
 
-            # 商品名の最後6文字を管理番号に置き換え
-            original_title = product_info['title']
-            modified_title = modify_product_title_with_number(original_title, user_text)
-            product_info['title'] = modified_title
+def save_listing(item: Dict, product_info: Dict) -> Dict:
+    """生成した商品情報の商品名に管理番号を付けてスプレッドシートに保存し、結果（product_info または error）を返す"""
+    management_number = item['management_number']
 
-            sheet = get_sheet_service()
-            success = append_row_to_sheet(sheet, temp_image_paths, product_info, user_text)
-
-            if success:
-                # 商品名、商品説明テンプレート、価格を1つのメッセージにまとめる
-                combined_message = f"{product_info['title']}\n\n{product_info['template']}\n\n{product_info['start_price']}円"
-                
-                # LINE Messaging APIの制限（5,000文字）をチェック
-                if len(combined_message) <= 5000:
-                    # 1つのメッセージとして送信
-                    reply_text(event.reply_token, combined_message)
-                else:
-                    # 制限を超える場合は分割して送信
-                    reply_text(event.reply_token, product_info['title'])
-                    push_text(event.source.user_id, product_info['template'])
-                    push_text(event.source.user_id, f"{product_info['start_price']}円")
-            else:
-                reply_text(event.reply_token, "❌ スプレッドシートへの保存に失敗しました。")
+    # 商品名の最後6文字を管理番号に置き換え
+    product_info['title'] = modify_product_title_with_number(product_info['title'], management_number)
 
-        finally:
-            for path in temp_image_paths:
-                try:
-                    os.unlink(path)
-                except:
-                    pass
-            temp_image_paths.clear()
-            temp_image_urls.clear()
-            temp_features = ""
-    else:
-        temp_features = user_text
-        # 返信メッセージを削除して、LINE画面をすっきりさせる
+    sheet = get_sheet_service()
+    if not append_row_to_sheet(sheet, item['image_paths'], product_info, management_number):
+        return {'management_number': management_number, 'error': "スプレッドシートへの保存に失敗しました。"}
+
+    # 次回以降の生成で似た商品の出品例として使う
+    record_listing(management_number, product_info, item['features'], item['image_paths'])
+    return {'management_number': management_number, 'product_info': product_info}
+
+def format_listing_messages(product_info: Dict) -> List[str]:
+    """商品名、商品説明テンプレート、価格を1つのメッセージにまとめる（5,000文字を超える場合は3つに分ける）"""
+    combined_message = f"{product_info['title']}\n\n{product_info['template']}\n\n{product_info['start_price']}円"
+    if len(combined_message) <= 5000:
+        return [combined_message]
+    return [product_info['title'], product_info['template'], f"{product_info['start_price']}円"]
+
+def push_listing_results(user_id: str, results: List[Dict], batch: bool = False):
+    """生成待ちがなくなった（またはバッチが完了した）ユーザーに、生成した商品の結果をまとめて送る"""
+    succeeded = [result for result in results if 'product_info' in result]
+    failed = [result for result in results if 'error' in result]
+    summary = f"✅ {len(succeeded)}件の商品情報を{'バッチで' if batch else ''}作成しました。"
+    if failed:
+        summary += "\n" + "\n".join(f"❌ {result['management_number']}: {result['error']}" for result in failed)
+    messages = [summary]
+    for result in succeeded:
+        messages.extend(format_listing_messages(result['product_info']))
+    push_messages(user_id, messages)
 
 @handler.add(MessageEvent, message=ImageMessageContent)
 def handle_image_message(event):
-    global temp_image_paths, temp_image_urls
-    with ApiClient(configuration) as api_client:
-        blob_api = MessagingApiBlob(api_client)
-        content = blob_api.get_message_content(event.message.id)
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as f:
-            f.write(content)
-            path = f.name
-            temp_image_paths.append(path)
-        
-        # LINEの画像URLを取得（実際のURLは取得できないため、メッセージIDを保存）
-        image_url = f"https://api-data.line.me/v2/bot/message/{event.message.id}/content"
-        temp_image_urls.append(image_url)
+    session = get_session_store().get(event.source.user_id)
+    # 1商品の画像の枚数が上限に達している場合はダウンロードしない（画像のチェックを無効にした場合は制限しない）
+    if IMAGE_VALIDATION and len(session.image_paths) >= MAX_IMAGES_PER_ITEM:
+        reply_text(event.reply_token, f"❌ 1商品の画像は{MAX_IMAGES_PER_ITEM}枚までです。この画像は保存しませんでした。")
+        return
 
-        # 返信メッセージを削除して、LINE画面をすっきりさせる
+    with trace_context(user=event.source.user_id):
+        with span('line.image_download'):
+            content = get_message_content(event.message.id)
+
+    # 生成前の画像の合計サイズが上限を超える場合は保存しない
+    if not get_resource_manager().accepts_image(session, len(content)):
+        reply_text(event.reply_token, f"❌ 画像の合計サイズが上限（{SESSION_MAX_IMAGE_MB:g}MB）を超えるため、この画像は保存しませんでした。管理番号を送信して生成してから、次の画像を送信してください。")
+        return
+
+    # 壊れた画像・小さすぎる画像・ピンボケ・暗すぎる画像・同じ商品のほぼ同じ写真はOpenAIに送らない
+    image_hash = None
+    if IMAGE_VALIDATION:
+        with trace_context(user=event.source.user_id):
+            checked = validate_image(content, session.image_hashes)
+        if checked['reason']:
+            reply_text(event.reply_token, f"❌ {checked['reason']}。この画像は保存しませんでした。")
+            return
+        image_hash = checked['hash']
+
+    path = get_resource_manager().create_temp_image(content)
+
+    # LINEの画像URLを取得（実際のURLは取得できないため、メッセージIDを保存）
+    image_url = f"https://api-data.line.me/v2/bot/message/{event.message.id}/content"
+    session.add_image(path, image_url, image_hash)
+
+    # 返信メッセージを削除して、LINE画面をすっきりさせる
+
+def get_message_content(message_id: str) -> bytes:
+    """LINEから画像などのメッセージコンテンツを取得する"""
+    if LINE_DATA_API_ENDPOINT:
+        # SDKのコンテンツ取得APIは接続先が固定のため、接続先を変える場合は直接取得する
+        response = requests.get(
+            f"{LINE_DATA_API_ENDPOINT}/v2/bot/message/{message_id}/content",
+            headers={'Authorization': f'Bearer {LINE_CHANNEL_ACCESS_TOKEN}'},
+            timeout=30
+        )
+        response.raise_for_status()
+        return response.content
+    with ApiClient(configuration) as api_client:
+        return MessagingApiBlob(api_client).get_message_content(message_id)
 
 def reply_text(token: str, message: str):
     with ApiClient(configuration) as api_client:
@@ -180,13 +507,18 @@ def reply_text(token: str, message: str):
         )
 
 def push_text(user_id: str, message: str):
+    push_messages(user_id, [message])
+
+def push_messages(user_id: str, messages: List[str]):
+    """複数のメッセージをプッシュで送信する（1回の送信に5件までまとめる）"""
     with ApiClient(configuration) as api_client:
-        MessagingApi(api_client).push_message_with_http_info(
-            PushMessageRequest(
-                to=user_id,
-                messages=[TextMessage(text=message)]
+        for start in range(0, len(messages), 5):
+            MessagingApi(api_client).push_message_with_http_info(
+                PushMessageRequest(
+                    to=user_id,
+                    messages=[TextMessage(text=message) for message in messages[start:start + 5]]
+                )
             )
-        )
 
 # Vercel用のエクスポート
 if __name__ == "__main__":
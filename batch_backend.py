@@ -0,0 +1,366 @@
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import shutil
+import threading
+from typing import Callable, Dict, List, Optional
+from local_store import connect_sqlite, get_state_path, persistent_storage_error
+from tracing import span, trace_context
+from resource_manager import get_resource_manager
+
+# 急がない商品をOpenAIのBatch APIでまとめて生成するか（料金は通常の半額、結果は最大24時間後）
+# off: 使わない / manual: #後で を送信した商品のみ / auto: 生成中の商品が多い場合もバッチに回す
+BATCH_MODE = os.getenv('OPENAI_BATCH_MODE', 'off')
+
+# auto の場合に、生成中の商品がこの件数以上ならバッチに回す
+BATCH_QUEUE_DEPTH = int(os.getenv('OPENAI_BATCH_QUEUE_DEPTH', '4'))
+
+# バッチを送信する件数（この件数に達するか、最も古い商品が BATCH_MAX_WAIT 秒待った時点で送信する）
+BATCH_MIN_ITEMS = int(os.getenv('OPENAI_BATCH_MIN_ITEMS', '20'))
+BATCH_MAX_WAIT = float(os.getenv('OPENAI_BATCH_MAX_WAIT', '1800'))
+
+# 送信待ちの確認とバッチの状態の確認の間隔（秒）
+BATCH_POLL_INTERVAL = float(os.getenv('OPENAI_BATCH_POLL_INTERVAL', '60'))
+
+# バッチの待ち行列を保存するSQLiteのファイル名と、生成が終わるまで画像を保存するディレクトリ
+BATCH_FILE = os.getenv('OPENAI_BATCH_FILE', 'openai_batch.sqlite3')
+BATCH_IMAGE_DIR = 'batch_images'
+
+# 送信中（submitting）のまま、この秒数が過ぎた商品は送信が中断したとみなして送信待ちに戻す
+SUBMIT_STALE_SEC = 600
+
+# 結果が確定したバッチの状態（completed 以外は失敗として扱う）
+FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+def batch_storage_error() -> Optional[str]:
+    """バッチの待ち行列と画像の保存先が永続的でない場合にその理由を返す"""
+    return persistent_storage_error(os.path.dirname(get_state_path(BATCH_FILE)), 'LOCAL_STATE_DIR')
+
+def choose_generation_mode(deferred: bool, queue_depth: int, mode: str = BATCH_MODE) -> str:
+    """商品を今すぐ生成するか（'interactive'）、Batch APIに回すか（'batch'）を決める
+
+    #後で を送信した商品と、auto の場合に生成中の商品が BATCH_QUEUE_DEPTH 件以上ある場合はバッチに回す。
+    """
+    if mode not in ('manual', 'auto'):
+        return 'interactive'
+    if deferred:
+        return 'batch'
+    if mode == 'auto' and queue_depth >= BATCH_QUEUE_DEPTH:
+        return 'batch'
+    return 'interactive'
+
+class BatchBackend:
+    """急がない商品をためておき、Batch APIにまとめて送信して、完了した結果をスプレッドシートに保存する
+
+    待ち行列と画像はローカルに保存するため、再起動しても送信済みのバッチの確認を続けられる。
+    save_listing(item, product_info) は生成した商品情報を保存して結果（product_info または error）を返し、
+    notify(user_id, results) はバッチの結果をユーザーごとにまとめて受け取る。
+    """
+
+    def __init__(self, chatgpt_handler, save_listing: Callable[[Dict, dict], Dict],
+                 notify: Callable[[str, List[Dict]], None], batch_file: str = BATCH_FILE):
+        self._handler = chatgpt_handler
+        self._save_listing = save_listing
+        self._notify = notify
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(batch_file)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS batch_items (
+                management_number TEXT PRIMARY KEY,
+                user_id TEXT,
+                features TEXT,
+                image_paths TEXT,
+                status TEXT NOT NULL,
+                batch_id TEXT,
+                context TEXT,
+                error TEXT,
+                created_at REAL,
+                updated_at REAL
+            )
+        """)
+        self._conn.commit()
+        self._worker: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+    def enqueue(self, item: Dict, user_id: str) -> int:
+        """商品（take_item の結果）を送信待ちに追加し、送信待ちの件数を返す
+
+        一時保存した画像は生成が終わるまでローカルの保存先に移す。
+        """
+        management_number = item['management_number']
+        image_dir = get_state_path(BATCH_IMAGE_DIR)
+        os.makedirs(image_dir, exist_ok=True)
+        image_paths = []
+        for i, path in enumerate(item['image_paths']):
+            destination = os.path.join(image_dir, f"{management_number}_{i}.jpg")
+            shutil.move(path, destination)
+            image_paths.append(destination)
+        get_resource_manager().release(item['image_paths'])
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute("""
+                INSERT OR REPLACE INTO batch_items (management_number, user_id, features, image_paths, status,
+                                                    created_at, updated_at)
+                VALUES (?, ?, ?, ?, 'pending', ?, ?)
+            """, (management_number, user_id, item['features'], json.dumps(image_paths), now, now))
+            self._conn.commit()
+        self.start()
+        self._wakeup.set()
+        return self.status()['pending']
+
+    def status(self) -> Dict[str, int]:
+        """状態ごとの件数（pending: 送信待ち / submitted: 生成中 / failed: 失敗）"""
+        with self._lock:
+            rows = self._conn.execute('SELECT status, COUNT(*) FROM batch_items GROUP BY status').fetchall()
+        counts = {'pending': 0, 'submitted': 0, 'failed': 0}
+        for status, count in rows:
+            # 送信中の商品は生成中として数える
+            key = 'submitted' if status == 'submitting' else status
+            counts[key] = counts.get(key, 0) + count
+        return counts
+
+    def _items(self, where: str, params: tuple = ()) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(f'SELECT * FROM batch_items WHERE {where} ORDER BY created_at', params).fetchall()
+        return [{
+            'management_number': row['management_number'],
+            'user_id': row['user_id'],
+            'features': row['features'] or '',
+            'image_paths': json.loads(row['image_paths'] or '[]'),
+            'batch_id': row['batch_id'],
+            'context': json.loads(row['context'] or '{}'),
+            'created_at': row['created_at']
+        } for row in rows]
+
+    def _update(self, management_numbers: List[str], status: str, batch_id: Optional[str] = None,
+                contexts: Optional[Dict[str, dict]] = None, error: Optional[str] = None):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("""
+                UPDATE batch_items SET status = ?, batch_id = COALESCE(?, batch_id), context = COALESCE(?, context),
+                                       error = ?, updated_at = ?
+                WHERE management_number = ?
+            """, [(status, batch_id, json.dumps(contexts[number]) if contexts else None, error, now, number)
+                  for number in management_numbers])
+            self._conn.commit()
+
+    def _claim_pending(self, force: bool) -> List[Dict]:
+        """送信する商品を送信中（submitting）にして返す（送信の条件を満たさない場合は空のリスト）
+
+        バックグラウンドのスレッドと #バッチ 送信 が同時に送信しても同じ商品を2回送らないよう、
+        1回のUPDATEで送信待ちの商品に送信ごとのIDを付け、IDが付いた商品だけでバッチを作る。
+        """
+        claim_id = f"claim-{uuid.uuid4().hex}"
+        now = time.time()
+        with self._lock:
+            self._conn.execute("""
+                UPDATE batch_items SET status = 'pending', batch_id = NULL, updated_at = ?
+                WHERE status = 'submitting' AND updated_at < ?
+            """, (now, now - SUBMIT_STALE_SEC))
+            row = self._conn.execute(
+                "SELECT COUNT(*), MIN(created_at) FROM batch_items WHERE status = 'pending'").fetchone()
+            count, oldest = row[0], row[1]
+            if not count or (not force and count < BATCH_MIN_ITEMS and now - oldest < BATCH_MAX_WAIT):
+                self._conn.commit()
+                return []
+            self._conn.execute("""
+                UPDATE batch_items SET status = 'submitting', batch_id = ?, updated_at = ?
+                WHERE status = 'pending'
+            """, (claim_id, now))
+            self._conn.commit()
+        return self._items("status = 'submitting' AND batch_id = ?", (claim_id,))
+
+    def submit_pending(self, force: bool = False) -> Optional[str]:
+        """送信待ちの商品が BATCH_MIN_ITEMS 件に達したか、最も古い商品が BATCH_MAX_WAIT 秒待った場合
+        （force=True の場合は常に）1つのバッチとして送信し、バッチIDを返す"""
+        items = self._claim_pending(force)
+        if not items:
+            return None
+
+        lines = []
+        contexts = {}
+        for item in items:
+            number = item['management_number']
+            try:
+                with trace_context(management_number=number, user=item['user_id']):
+                    request, contexts[number] = self._handler.build_listing_batch_request(
+                        number, item['image_paths'], item['features'])
+                lines.append(json.dumps(request, ensure_ascii=False))
+            except Exception as e:
+                print(f"バッチの入力作成エラー ({number}): {e}")
+                self._fail([item], f"商品情報の生成に失敗しました（{e}）")
+        if not lines:
+            return None
+
+        try:
+            with span('openai.batch_submit', items=len(lines)):
+                input_file = self._handler.client.files.create(
+                    file=('listing_batch.jsonl', io.BytesIO('\n'.join(lines).encode('utf-8'))),
+                    purpose='batch'
+                )
+                batch = self._handler.client.batches.create(
+                    input_file_id=input_file.id,
+                    endpoint='/v1/chat/completions',
+                    completion_window='24h'
+                )
+        except Exception:
+            # 送信できなかった商品は送信待ちに戻して次の確認で送り直す
+            self._update(list(contexts), 'pending')
+            raise
+        self._update(list(contexts), 'submitted', batch_id=batch.id, contexts=contexts)
+        print(f"{len(lines)} 件の商品をバッチ {batch.id} で送信しました")
+        return batch.id
+
+    def poll(self) -> int:
+        """送信済みのバッチの状態を確認し、完了したバッチの結果を保存して、処理した商品数を返す"""
+        submitted = self._items("status = 'submitted'")
+        batch_ids = list(dict.fromkeys(item['batch_id'] for item in submitted))
+        processed = 0
+        for batch_id in batch_ids:
+            items = [item for item in submitted if item['batch_id'] == batch_id]
+            with span('openai.batch_poll'):
+                batch = self._handler.client.batches.retrieve(batch_id)
+            if batch.status not in FINAL_STATUSES:
+                continue
+            if batch.status == 'expired' and not batch.output_file_id:
+                # 期限内に生成されなかった場合は送信待ちに戻して次のバッチで送り直す
+                self._update([item['management_number'] for item in items], 'pending')
+                continue
+            processed += self._process_batch(batch, items)
+        return processed
+
+    def _read_results(self, file_id: Optional[str]) -> Dict[str, dict]:
+        if not file_id:
+            return {}
+        text = self._handler.client.files.content(file_id).text
+        results = {}
+        for line in text.splitlines():
+            if line.strip():
+                result = json.loads(line)
+                results[result['custom_id']] = result
+        return results
+
+    def _process_batch(self, batch, items: List[Dict]) -> int:
+        """完了したバッチの結果を商品ごとに保存し、ユーザーごとにまとめて通知する"""
+        with span('openai.batch_results', items=len(items)):
+            results = self._read_results(batch.output_file_id)
+            results.update(self._read_results(batch.error_file_id))
+
+        by_user: Dict[str, List[Dict]] = {}
+        requeued = []
+        for item in items:
+            number = item['management_number']
+            if batch.status == 'expired' and number not in results:
+                # 期限切れのバッチで生成されなかった商品は、送信待ちに戻して次のバッチで送り直す
+                requeued.append(number)
+                continue
+            with trace_context(management_number=number, user=item['user_id']):
+                result = self._finish_item(item, results.get(number), batch.status)
+            by_user.setdefault(item['user_id'], []).append(result)
+        if requeued:
+            self._update(requeued, 'pending')
+            print(f"期限切れのバッチ {batch.id} の {len(requeued)} 件を送信待ちに戻しました")
+
+        for user_id, user_results in by_user.items():
+            try:
+                self._notify(user_id, user_results)
+            except Exception as e:
+                print(f"バッチの結果の送信エラー: {e}")
+        return len(items) - len(requeued)
+
+    def _finish_item(self, item: Dict, output: Optional[dict], batch_status: str) -> Dict:
+        number = item['management_number']
+        response = (output or {}).get('response') or {}
+        if response.get('status_code') != 200:
+            error = ((output or {}).get('error') or {}).get('message') or f"バッチが完了しませんでした（{batch_status}）"
+            self._fail([item], f"商品情報の生成に失敗しました（{error}）")
+            return {'management_number': number, 'error': f"商品情報の生成に失敗しました（{error}）"}
+        try:
+            product_info = self._handler.parse_listing_batch_result(response['body'], item['image_paths'],
+                                                                     item['context'])
+            result = self._save_listing(item, product_info)
+        except Exception as e:
+            print(f"バッチの結果の保存エラー ({number}): {e}")
+            result = {'management_number': number, 'error': str(e)}
+        if 'error' in result:
+            self._fail([item], result['error'])
+            return result
+        self._remove(item)
+        return result
+
+    def _fail(self, items: List[Dict], error: str):
+        """生成できなかった商品を失敗として記録し、画像を削除する"""
+        self._update([item['management_number'] for item in items], 'failed', error=error)
+        for item in items:
+            self._delete_images(item)
+
+    def _remove(self, item: Dict):
+        with self._lock:
+            self._conn.execute('DELETE FROM batch_items WHERE management_number = ?', (item['management_number'],))
+            self._conn.commit()
+        self._delete_images(item)
+
+    def _delete_images(self, item: Dict):
+        for path in item['image_paths']:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def run_once(self, force: bool = False) -> int:
+        """送信待ちの商品を送信し、送信済みのバッチを確認する（処理した商品数を返す）"""
+        try:
+            self.submit_pending(force)
+        except Exception as e:
+            print(f"バッチの送信エラー: {e}")
+        try:
+            return self.poll()
+        except Exception as e:
+            print(f"バッチの確認エラー: {e}")
+            return 0
+
+    def start(self):
+        """バックグラウンドで定期的に送信・確認するスレッドを起動する（起動済みの場合は何もしない）"""
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._worker = threading.Thread(target=self._run, name='openai-batch', daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._wakeup.wait(BATCH_POLL_INTERVAL)
+            self._wakeup.clear()
+
+def format_batch_status(status: Dict[str, int]) -> str:
+    """#バッチ コマンドの返信"""
+    lines = [
+        f"🌙 バッチ生成（{BATCH_MODE}）",
+        f"送信待ち: {status['pending']}件",
+        f"生成中: {status['submitted']}件"
+    ]
+    if status['failed']:
+        lines.append(f"失敗: {status['failed']}件")
+    lines.append("")
+    lines.append(f"{BATCH_MIN_ITEMS}件たまるか、最も古い商品が{int(BATCH_MAX_WAIT // 60)}分待つと送信します。"
+                 f"「#バッチ 送信」ですぐに送信します。")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    # 使い方: python batch_backend.py status
+    if len(sys.argv) > 1 and sys.argv[1] == 'status':
+        from chatgpt_handler import ChatGPTHandler
+        backend = BatchBackend(ChatGPTHandler(), save_listing=lambda item, info: {}, notify=lambda user_id, results: None)
+        print(format_batch_status(backend.status()))
+    else:
+        print("使い方: python batch_backend.py status")
@@ -0,0 +1,252 @@
+"""
+出品処理全体のベンチマーク
+
+LINE・OpenAI・Google Sheets・Supabaseをローカルの代替サーバーに置き換え、
+記録したWebhookの操作（benchmarks/webhooks/*.json）を callback() に再生して、
+1商品あたりのレイテンシ（p50/p95/p99）・API呼び出し回数・同時実行数ごとのスループットを計測する。
+
+--early-title-push を付けると商品情報をストリーミングで生成し、商品名と出品価格を先に送信する。
+--openai-generation-time と組み合わせると、最初のメッセージが届くまでの時間の短縮を確認できる。
+
+同時実行数を2以上にした場合は、ユーザーごとに別々の管理番号で操作を並行して送信する。
+（画像・特徴の一時保存はユーザーごとのセッションに分かれているため、同時実行しても互いに影響しない）
+
+--items-per-user N を付けると、1ユーザーがN商品分の操作を続けて送信する。
+--multi-item-sessions と組み合わせると、商品を生成待ちに入れて続けて送信し、
+まとめて送られる結果が届くまでを1ユーザー分として計測する（出品が多い日の1人あたりのスループットの確認用）。
+
+使い方:
+    python benchmarks/e2e_benchmark.py --items 20 --concurrency 1,2,4 --openai-latency 2.0
+    python benchmarks/e2e_benchmark.py --items 8 --items-per-user 8 --multi-item-sessions --openai-latency 2.0
+"""
+import os
+import sys
+import json
+import hmac
+import time
+import base64
+import hashlib
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import (  # noqa: E402
+    make_test_jpeg, create_line_service, create_openai_service,
+    create_sheets_service, create_supabase_service
+)
+
+CHANNEL_SECRET = 'benchmark-channel-secret'
+DEFAULT_SEQUENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'webhooks', 'listing_session.json')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='出品処理全体のベンチマーク')
+    parser.add_argument('--sequence', default=DEFAULT_SEQUENCE, help='再生するWebhookの操作ファイル')
+    parser.add_argument('--items', type=int, default=10, help='同時実行数ごとに処理する商品数')
+    parser.add_argument('--concurrency', default='1', help='同時実行数（カンマ区切りで複数指定）')
+    parser.add_argument('--image-size', default='1200x1600', help='ダウンロードされる画像のサイズ')
+    parser.add_argument('--openai-generation-time', type=float, default=0.0,
+                        help='OpenAIの応答の生成にかかる時間（秒、ストリーミングの場合は少しずつ届く）')
+    parser.add_argument('--duplicate-check', action='store_true',
+                        help='生成前の重複チェックを有効にする（画像はリクエストごとに別々に作るため遅くなる）')
+    parser.add_argument('--early-title-push', action='store_true',
+                        help='商品名と出品価格を先に送信する（EARLY_TITLE_PUSH=1）')
+    parser.add_argument('--multi-item-sessions', action='store_true',
+                        help='商品を生成待ちに入れてバックグラウンドで生成する（MULTI_ITEM_SESSIONS=1）')
+    parser.add_argument('--items-per-user', type=int, default=1, help='1ユーザーが続けて送信する商品数')
+    for service, latency in [('line', 0.05), ('openai', 1.0), ('sheets', 0.1), ('supabase', 0.1)]:
+        parser.add_argument(f'--{service}-latency', type=float, default=latency, help=f'{service}の応答遅延（秒）')
+        parser.add_argument(f'--{service}-error-rate', type=float, default=0.0, help=f'{service}のエラー発生率')
+    return parser.parse_args()
+
+def start_services(args) -> Dict[str, object]:
+    """代替サーバーを起動する"""
+    width, height = (int(value) for value in args.image_size.split('x'))
+    image_bytes = make_test_jpeg(width, height)
+    factories = {
+        'line': lambda **options: create_line_service(
+            image_bytes,
+            image_factory=(lambda seed: make_test_jpeg(width, height, seed=seed)) if args.duplicate_check else None,
+            **options),
+        'openai': lambda **options: create_openai_service(args.openai_generation_time, **options),
+        'sheets': create_sheets_service,
+        'supabase': create_supabase_service
+    }
+    return {
+        name: factory(latency=getattr(args, f'{name}_latency'),
+                      error_rate=getattr(args, f'{name}_error_rate'), seed=0).start()
+        for name, factory in factories.items()
+    }
+
+def configure_environment(services: Dict[str, object], state_dir: str, early_title_push: bool = False,
+                          duplicate_check: bool = False, multi_item_sessions: bool = False):
+    """アプリケーションの接続先を代替サーバーに向ける（アプリケーションの読み込み前に呼ぶ）"""
+    os.environ.update({
+        # 同じ画像を使い回す場合は重複チェックで止まるため無効にする
+        'DUPLICATE_CHECK': '1' if duplicate_check else '0',
+        'IMAGE_NEAR_DUPLICATE_DISTANCE': '3' if duplicate_check else '-1',
+        'EARLY_TITLE_PUSH': '1' if early_title_push else '0',
+        'MULTI_ITEM_SESSIONS': '1' if multi_item_sessions else '0',
+        'LINE_CHANNEL_SECRET': CHANNEL_SECRET,
+        'LINE_CHANNEL_ACCESS_TOKEN': 'benchmark-access-token',
+        'LINE_API_ENDPOINT': services['line'].url,
+        'LINE_DATA_API_ENDPOINT': services['line'].url,
+        'OPENAI_API_KEY': 'sk-benchmark',
+        'OPENAI_BASE_URL': f"{services['openai'].url}/v1",
+        'GOOGLE_SHEETS_API_ENDPOINT': services['sheets'].url,
+        'SUPABASE_URL': services['supabase'].url,
+        'SUPABASE_KEY': 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.benchmark',
+        'LOCAL_STATE_DIR': state_dir
+    })
+
+def load_sequence(path: str) -> List[dict]:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['events']
+
+class WebhookReplayer:
+    """記録したWebhookの操作をユーザー・管理番号ごとに組み立てて callback() に送信する"""
+
+    def __init__(self, app, events: List[dict], deliveries: Dict[str, float], session_store=None):
+        self._app = app
+        self._session_store = session_store
+        self._events = events
+        self._deliveries = deliveries
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def _next_id(self) -> str:
+        with self._lock:
+            self._counter += 1
+            return f"{self._counter:012d}"
+
+    def _build_body(self, event: dict, user_id: str, management_number: str) -> Tuple[str, str]:
+        """Webhookのボディと返信トークンを返す"""
+        text = json.dumps(event, ensure_ascii=False)
+        reply_token = self._next_id()
+        for key, value in [('{user_id}', user_id), ('{management_number}', management_number),
+                           ('{event_id}', self._next_id()), ('{reply_token}', reply_token),
+                           ('{message_id}', self._next_id())]:
+            text = text.replace(key, value)
+        return json.dumps({'destination': 'Ubenchmark', 'events': [json.loads(text)]}, ensure_ascii=False), reply_token
+
+    def replay_item(self, user_id: str, management_numbers: List[str]) -> dict:
+        """1ユーザー分（1商品以上）の操作を順に送信し、全体と最後のWebhook（商品情報生成）のレイテンシ、
+        最後のWebhookから最初のメッセージ（返信・プッシュ）が届くまでの時間を返す
+
+        セッションで生成する場合は、まとめて送られる結果が届くまでを全体のレイテンシに含める。
+        """
+        client = self._app.test_client()
+        errors = 0
+        started = time.perf_counter()
+        last_latency = 0.0
+        sent = started
+        reply_token = ''
+        for management_number in management_numbers:
+            for event in self._events:
+                body, reply_token = self._build_body(event, user_id, management_number)
+                signature = base64.b64encode(
+                    hmac.new(CHANNEL_SECRET.encode(), body.encode('utf-8'), hashlib.sha256).digest()
+                ).decode()
+                sent = time.perf_counter()
+                response = client.post('/callback', data=body.encode('utf-8'), headers={
+                    'X-Line-Signature': signature, 'Content-Type': 'application/json'
+                })
+                last_latency = time.perf_counter() - sent
+                if response.status_code != 200:
+                    errors += 1
+        if self._session_store is not None and not self._session_store.get(user_id).wait_idle(600):
+            errors += 1
+        delivered = [self._deliveries[key] for key in (reply_token, user_id) if key in self._deliveries]
+        first_message = min(delivered) - sent if delivered else last_latency
+        return {'latency': time.perf_counter() - started, 'final_latency': last_latency,
+                'first_message_latency': first_message, 'errors': errors}
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def run_level(replayer: WebhookReplayer, services: Dict[str, object], concurrency: int, items: int, offset: int,
+              items_per_user: int = 1) -> dict:
+    """指定した同時実行数で商品を処理し、集計結果を返す（レイテンシは1ユーザー分の値）"""
+    for service in services.values():
+        service.reset_counts()
+
+    def run(k: int) -> dict:
+        numbers = [offset + k + i for i in range(min(items_per_user, items - k))]
+        management_numbers = [f"01{number // 100 + 1:02d}{number % 100:02d}" for number in numbers]
+        return replayer.replay_item(f"Ubench{numbers[0]:06d}", management_numbers)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(run, range(0, items, items_per_user)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [result['latency'] for result in results]
+    final_latencies = [result['final_latency'] for result in results]
+    first_message_latencies = [result['first_message_latency'] for result in results]
+    calls = Counter()
+    for name, service in services.items():
+        for endpoint, count in service.calls.items():
+            calls[f"{name}.{endpoint}"] += count
+
+    return {
+        'concurrency': concurrency,
+        'items': items,
+        'items_per_user': items_per_user,
+        'errors': sum(result['errors'] for result in results),
+        'throughput_items_per_sec': items / elapsed if elapsed else 0.0,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p95': percentile(latencies, 95),
+        'latency_p99': percentile(latencies, 99),
+        'generation_p50': percentile(final_latencies, 50),
+        'generation_p95': percentile(final_latencies, 95),
+        'generation_p99': percentile(final_latencies, 99),
+        'first_message_p50': percentile(first_message_latencies, 50),
+        'first_message_p95': percentile(first_message_latencies, 95),
+        'calls_per_item': {endpoint: count / items for endpoint, count in sorted(calls.items())}
+    }
+
+def print_report(result: dict):
+    print(f"\n=== 同時実行数 {result['concurrency']}（{result['items']} 商品） ===")
+    print(f"エラー: {result['errors']} 件")
+    print(f"スループット: {result['throughput_items_per_sec']:.2f} 商品/秒")
+    if result['items_per_user'] > 1:
+        print(f"（1ユーザーあたり {result['items_per_user']} 商品。レイテンシは1ユーザー分の値）")
+    print(f"1商品全体: p50 {result['latency_p50']:.3f}s / p95 {result['latency_p95']:.3f}s / p99 {result['latency_p99']:.3f}s")
+    print(f"商品情報生成: p50 {result['generation_p50']:.3f}s / p95 {result['generation_p95']:.3f}s / p99 {result['generation_p99']:.3f}s")
+    print(f"最初のメッセージまで: p50 {result['first_message_p50']:.3f}s / p95 {result['first_message_p95']:.3f}s")
+    print("1商品あたりのAPI呼び出し回数:")
+    for endpoint, count in result['calls_per_item'].items():
+        print(f"  {endpoint}: {count:.2f}")
+
+def main():
+    args = parse_args()
+    services = start_services(args)
+    state_dir = tempfile.mkdtemp(prefix='shuppin_benchmark_')
+    configure_environment(services, state_dir, args.early_title_push, args.duplicate_check, args.multi_item_sessions)
+
+    # 接続先の設定後にアプリケーションを読み込む
+    import main as app_module
+
+    session_store = app_module.get_session_store() if args.multi_item_sessions else None
+    replayer = WebhookReplayer(app_module.app, load_sequence(args.sequence), services['line'].deliveries, session_store)
+    offset = 0
+    try:
+        for concurrency in [int(value) for value in args.concurrency.split(',')]:
+            print_report(run_level(replayer, services, concurrency, args.items, offset, args.items_per_user))
+            offset += args.items
+    finally:
+        for service in services.values():
+            service.stop()
+
+if __name__ == "__main__":
+    main()
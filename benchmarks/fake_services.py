@@ -0,0 +1,536 @@
+"""
+ベンチマーク用のローカル代替サーバー（LINE Messaging API / OpenAI / Google Sheets API / Supabase Storage）
+
+各サーバーは応答の遅延とエラーの発生率を設定でき、受け付けたAPI呼び出しの回数を記録する。
+"""
+import io
+import re
+import json
+import time
+import random
+import itertools
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs, unquote
+
+# ルートの処理関数：(メソッド, パスのマッチ結果, クエリ, ボディ) → (ステータス, Content-Type, ボディ)
+Route = Tuple[str, re.Pattern, str, Callable]
+
+class FakeService:
+    """遅延とエラー注入を設定できるローカルHTTPサーバー"""
+
+    def __init__(self, name: str, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 500, seed: Optional[int] = None):
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.calls: Counter = Counter()
+        self._routes: List[Route] = []
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def route(self, method: str, pattern: str, endpoint: str, func: Callable):
+        """ルートを登録する（endpointは呼び出し回数の集計に使う名前）"""
+        self._routes.append((method, re.compile(pattern), endpoint, func))
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'FakeService':
+        """バックグラウンドのスレッドでサーバーを起動する"""
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _handle(self):
+                service._dispatch(self)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def reset_counts(self):
+        with self._lock:
+            self.calls.clear()
+
+    def _dispatch(self, handler: BaseHTTPRequestHandler):
+        parsed = urlparse(handler.path)
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+
+        for method, pattern, endpoint, func in self._routes:
+            match = pattern.fullmatch(parsed.path)
+            if method != handler.command or not match:
+                continue
+            with self._lock:
+                self.calls[endpoint] += 1
+                inject_error = self._random.random() < self.error_rate
+                delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            if delay:
+                time.sleep(delay)
+            if inject_error:
+                self._send(handler, self.error_status, 'application/json',
+                           json.dumps({'error': {'message': 'injected error', 'code': self.error_status}}).encode())
+                return
+            status, content_type, payload = func(handler, match, parse_qs(parsed.query), body)
+            self._send(handler, status, content_type, payload)
+            return
+
+        with self._lock:
+            self.calls['unmatched'] += 1
+        self._send(handler, 404, 'application/json', json.dumps({'error': parsed.path}).encode())
+
+    @staticmethod
+    def _send(handler: BaseHTTPRequestHandler, status: int, content_type: str, payload):
+        if isinstance(payload, (bytes, bytearray)):
+            handler.send_response(status)
+            handler.send_header('Content-Type', content_type)
+            handler.send_header('Content-Length', str(len(payload)))
+            handler.end_headers()
+            handler.wfile.write(payload)
+            return
+        # イテレーターの場合はチャンク形式で送信（ストリーミング応答用）
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.end_headers()
+        for chunk in payload:
+            handler.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            handler.wfile.flush()
+        handler.wfile.write(b"0\r\n\r\n")
+
+def _json(data, status: int = 200):
+    return status, 'application/json', json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+def make_test_jpeg(width: int = 1200, height: int = 1600, seed: int = 0) -> bytes:
+    """ダウンロード用のJPEG画像を作成する
+
+    実際の写真に近いサイズになるようノイズを入れ、seedごとに異なる色の格子模様を重ねる
+    （seedが違えば画像ハッシュも異なる）。
+    """
+    from PIL import Image
+    rng = random.Random(seed)
+    noise = Image.effect_noise((width, height), 40 + rng.random() * 20).convert('RGB')
+    grid = Image.new('RGB', (4, 4))
+    grid.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(16)])
+    image = Image.blend(grid.resize((width, height), Image.BICUBIC), noise, 0.5)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+def make_product_photo(kind: str, seed: int = 0, tag_lines: Tuple[str, ...] = ('BRAND', 'SIZE M'),
+                       width: int = 1200, height: int = 1600) -> bytes:
+    """出品写真に似せたJPEG画像を作成する（画像の選択の計測用）
+
+    kind は front（無地の背景に服の正面）、back（背面）、tag（白いタグに tag_lines の文字）、detail（生地の接写）。
+    """
+    import numpy as np
+    from PIL import Image, ImageDraw, ImageFont
+
+    def font(size: int):
+        try:
+            return ImageFont.load_default(size=size)
+        except TypeError:
+            # Pillow 10.1より前は大きさを指定できない
+            return ImageFont.load_default()
+
+    rng = random.Random(f"{kind}-{seed}")
+    background = tuple(rng.randrange(180, 240) for _ in range(3))
+    color = tuple(rng.randrange(20, 160) for _ in range(3))
+    image = Image.new('RGB', (width, height), color if kind in ('tag', 'detail') else background)
+    draw = ImageDraw.Draw(image)
+    if kind in ('front', 'back'):
+        outline = [(0.25, 0.2), (0.75, 0.2), (0.92, 0.38), (0.8, 0.44), (0.76, 0.36), (0.76, 0.88),
+                   (0.24, 0.88), (0.24, 0.36), (0.2, 0.44), (0.08, 0.38)]
+        draw.polygon([(x * width, y * height) for x, y in outline], fill=color)
+        if kind == 'front':
+            draw.ellipse([0.42 * width, 0.17 * height, 0.58 * width, 0.26 * height], fill=background)
+            for i in range(5):
+                x, y = 0.495 * width, (0.3 + 0.1 * i) * height
+                draw.ellipse([x - 8, y - 8, x + 8, y + 8], fill=(230, 230, 230))
+    elif kind == 'tag':
+        draw.rectangle([0.15 * width, 0.2 * height, 0.85 * width, 0.8 * height], fill=(245, 245, 240))
+        for i, line in enumerate(tag_lines):
+            draw.text((0.2 * width, (0.26 + 0.12 * i) * height), line, fill=(15, 15, 15), font=font(int(width * 0.09)))
+        for i in range(3):
+            draw.text((0.2 * width, (0.64 + 0.04 * i) * height), "COTTON 100% / MADE IN JAPAN",
+                      fill=(40, 40, 40), font=font(int(width * 0.035)))
+
+    pixels = np.asarray(image, dtype=np.float32)
+    if kind == 'detail':
+        # 生地の織り目
+        y, x = np.mgrid[0:height, 0:width]
+        pixels = pixels + (12 * np.sin(x / 3.0) * np.sin(y / 3.0))[..., None]
+    pixels = pixels + np.random.default_rng(rng.randrange(2 ** 32)).normal(0, 6, pixels.shape)
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+def create_line_service(image_bytes: bytes, image_factory: Optional[Callable[[int], bytes]] = None,
+                        **options) -> FakeService:
+    """LINE Messaging API（返信・プッシュ）とコンテンツ取得APIの代替サーバー
+
+    image_factory を指定した場合は、コンテンツ取得のたびに通し番号から別々の画像を作って返す
+    （重複チェックに引っかからない画像が必要な場合）。
+
+    返信・プッシュを最初に受け付けた時刻（time.perf_counter()）を、返信トークン・送信先ユーザーIDごとに
+    service.deliveries に記録する（ユーザーが最初のメッセージを受け取るまでの時間の計測用）。
+    """
+    service = FakeService('line', **options)
+    service.deliveries = {}
+
+    def deliver(key_name: str):
+        def func(handler, match, query, body):
+            key = json.loads(body or b'{}').get(key_name)
+            if key:
+                service.deliveries.setdefault(key, time.perf_counter())
+            return _json({'sentMessages': [{'id': '1', 'quoteToken': 'q'}]})
+        return func
+
+    service.route('POST', r'/v2/bot/message/reply', 'reply', deliver('replyToken'))
+    service.route('POST', r'/v2/bot/message/push', 'push', deliver('to'))
+    counter = itertools.count()
+    service.route('GET', r'/v2/bot/message/[^/]+/content', 'content',
+                  lambda h, m, q, b: (200, 'image/jpeg',
+                                      image_factory(next(counter)) if image_factory else image_bytes))
+    return service
+
+# 商品情報生成の応答として返すJSON
+FAKE_LISTING = {
+    'title': 'NIKE　半袖Tシャツ　グリーン　綿　迷彩柄　L　ストリート',
+    'start_price': 2980,
+    'description': '迷彩柄が映える半袖Tシャツです。普段使いにおすすめの一枚です。',
+    'hashtags': '#NIKE #ナイキ #Tシャツ #半袖 #迷彩 #グリーン #古着 #ストリート #ミリタリー #メンズ'
+}
+
+# 商品名の修正・ハッシュタグの補完の応答（システムプロンプトで呼び出しの用途を見分ける）
+FAKE_TEXT_ROUTES = {
+    '商品名を編集': '半袖Tシャツ　グリーン　迷彩柄　L',
+    'ハッシュタグを作成': FAKE_LISTING['hashtags']
+}
+
+# ストリーミング応答で1チャンクに入れる文字数
+STREAM_CHUNK_CHARS = 8
+
+def _chat_completion(handler, match, query, body, generation_time: float = 0.0):
+    request = json.loads(body or b'{}')
+    messages = request.get('messages', [])
+    system_prompt = messages[0].get('content', '') if messages and messages[0].get('role') == 'system' else ''
+    text_route = next((reply for marker, reply in FAKE_TEXT_ROUTES.items() if marker in system_prompt), None)
+    if text_route is not None:
+        content = text_route
+    # 商品種類の判定（max_tokensが小さい呼び出し）にはカテゴリー名のみを返す
+    elif request.get('max_tokens', 1000) <= 50:
+        content = 'tops'
+    else:
+        content = json.dumps(FAKE_LISTING, ensure_ascii=False)
+    # 画像は高解像度（1200×1600）が765トークン、低解像度が85トークン
+    image_tokens = sum(
+        85 if part['image_url'].get('detail') == 'low' else 765
+        for message in messages if isinstance(message.get('content'), list)
+        for part in message['content'] if part.get('type') == 'image_url'
+    )
+    usage = {'prompt_tokens': 1500 + image_tokens, 'completion_tokens': 200,
+             'total_tokens': 1700 + image_tokens}
+    base = {'id': 'chatcmpl-fake', 'created': int(time.time()), 'model': request.get('model', 'gpt-4o')}
+
+    if request.get('stream'):
+        include_usage = (request.get('stream_options') or {}).get('include_usage', False)
+        return 200, 'text/event-stream', _stream_chunks(content, base, usage if include_usage else None, generation_time)
+
+    # 生成にかかる時間（ストリーミングの場合はチャンクごとに分けて待つ）
+    if generation_time:
+        time.sleep(generation_time)
+    return _json({
+        **base,
+        'object': 'chat.completion',
+        'choices': [{'index': 0, 'finish_reason': 'stop',
+                     'message': {'role': 'assistant', 'content': content}}],
+        'usage': usage
+    })
+
+def _stream_chunks(content: str, base: dict, usage: Optional[dict], generation_time: float):
+    """Chat Completions APIのストリーミング応答（Server-Sent Events）を生成する"""
+    pieces = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)] or ['']
+    interval = generation_time / len(pieces)
+
+    def event(data: dict) -> bytes:
+        return f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', **data}, ensure_ascii=False)}\n\n".encode('utf-8')
+
+    yield event({'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': ''}, 'finish_reason': None}]})
+    for piece in pieces:
+        if interval:
+            time.sleep(interval)
+        yield event({'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]})
+    yield event({'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+    if usage is not None:
+        yield event({'choices': [], 'usage': usage})
+    yield b"data: [DONE]\n\n"
+
+def _multipart_fields(handler, body: bytes) -> Dict[str, bytes]:
+    """multipart/form-data のボディをフィールド名 → 値にする"""
+    from email.parser import BytesParser
+    header = f"Content-Type: {handler.headers.get('Content-Type')}\r\n\r\n".encode()
+    message = BytesParser().parsebytes(header + body)
+    return {part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+            for part in message.get_payload()}
+
+def create_openai_service(generation_time: float = 0.0, batch_completion_time: float = 0.0,
+                          batch_final_status: str = 'completed', batch_output_limit: Optional[int] = None,
+                          **options) -> FakeService:
+    """OpenAI Chat Completions API・Files API・Batch APIの代替サーバー
+
+    generation_time は応答の生成にかかる時間。バッチは作成から batch_completion_time 秒後に完了し、
+    入力の各行を Chat Completions API と同じ応答で処理した結果ファイルを返す。
+    batch_final_status に 'expired' などを指定すると完了せずにその状態になり、batch_output_limit を指定すると
+    結果ファイルには先頭の batch_output_limit 件のみを入れる（期限切れで一部だけ生成された場合の確認用）。
+    """
+    service = FakeService('openai', **options)
+    service.route('POST', r'/v1/chat/completions', 'chat.completions',
+                  lambda h, m, q, b: _chat_completion(h, m, q, b, generation_time))
+
+    files: Dict[str, dict] = {}
+    batches: Dict[str, dict] = {}
+    ids = itertools.count(1)
+
+    def add_file(content: bytes, filename: str, purpose: str) -> dict:
+        file = {'id': f"file-{next(ids)}", 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                'filename': filename, 'purpose': purpose, 'status': 'processed'}
+        files[file['id']] = {**file, 'content': content}
+        return file
+
+    def upload_file(handler, match, query, body):
+        fields = _multipart_fields(handler, body)
+        return _json(add_file(fields.get('file') or b'', 'upload.jsonl', (fields.get('purpose') or b'').decode()))
+
+    def file_content(handler, match, query, body):
+        file = files.get(match.group(1))
+        if file is None:
+            return _json({'error': {'message': 'file not found'}}, status=404)
+        return 200, 'application/octet-stream', file['content']
+
+    def create_batch(handler, match, query, body):
+        request = json.loads(body or b'{}')
+        input_file = files.get(request.get('input_file_id'))
+        if input_file is None:
+            return _json({'error': {'message': 'input file not found'}}, status=400)
+        outputs = []
+        for line in input_file['content'].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            status, _, payload = _chat_completion(None, None, {}, json.dumps(entry['body']).encode())
+            outputs.append(json.dumps({
+                'id': f"batch_req_{next(ids)}", 'custom_id': entry['custom_id'],
+                'response': {'status_code': status, 'request_id': 'req', 'body': json.loads(payload)},
+                'error': None
+            }, ensure_ascii=False))
+        batch_id = f"batch_{next(ids)}"
+        batches[batch_id] = {
+            'id': batch_id, 'object': 'batch', 'endpoint': request.get('endpoint'),
+            'input_file_id': input_file['id'], 'completion_window': request.get('completion_window', '24h'),
+            'created_at': int(time.time()), 'status': 'in_progress',
+            'ready_at': time.time() + batch_completion_time,
+            'output': '\n'.join(outputs).encode('utf-8'),
+            'request_counts': {'total': len(outputs), 'completed': 0, 'failed': 0}
+        }
+        return get_batch(handler, re.match(r'(.*)', batch_id), query, b'')
+
+    def get_batch(handler, match, query, body):
+        batch = batches.get(match.group(1))
+        if batch is None:
+            return _json({'error': {'message': 'batch not found'}}, status=404)
+        if batch['status'] == 'in_progress' and time.time() >= batch['ready_at']:
+            outputs = batch['output'].splitlines()[:batch_output_limit]
+            batch['status'] = batch_final_status
+            batch[f"{batch_final_status}_at"] = int(time.time())
+            if outputs:
+                batch['output_file_id'] = add_file(b'\n'.join(outputs), 'output.jsonl', 'batch_output')['id']
+            batch['request_counts']['completed'] = len(outputs)
+        return _json({key: value for key, value in batch.items() if key not in ('ready_at', 'output')})
+
+    service.route('POST', r'/v1/files', 'files.create', upload_file)
+    service.route('GET', r'/v1/files/([^/]+)/content', 'files.content', file_content)
+    service.route('POST', r'/v1/batches', 'batches.create', create_batch)
+    service.route('GET', r'/v1/batches/([^/]+)', 'batches.retrieve', get_batch)
+    return service
+
+_A1_PATTERN = re.compile(r"^(?:'?(?P<sheet>[^!']+)'?!)?(?P<c1>[A-Z]+)?(?P<r1>\d+)?(?::(?P<c2>[A-Z]+)?(?P<r2>\d+)?)?$")
+
+def _column_index(letters: Optional[str], default: int) -> int:
+    if not letters:
+        return default
+    index = 0
+    for letter in letters:
+        index = index * 26 + (ord(letter) - ord('A') + 1)
+    return index - 1
+
+def _parse_a1(range_name: str):
+    """A1形式の範囲を (シート名, 開始行, 開始列, 終了行, 終了列) に変換（行・列は0ベース、終了はNoneで末尾まで）"""
+    range_name = unquote(range_name)
+    match = _A1_PATTERN.match(range_name)
+    if not match:
+        raise ValueError(f"unsupported range: {range_name}")
+    sheet = match.group('sheet')
+    start_col = _column_index(match.group('c1'), 0)
+    start_row = int(match.group('r1')) - 1 if match.group('r1') else 0
+    if ':' in range_name:
+        end_col = _column_index(match.group('c2'), 25) + 1
+        end_row = int(match.group('r2')) if match.group('r2') else None
+    else:
+        end_col = start_col + 1
+        end_row = start_row + 1 if match.group('r1') else None
+    return sheet, start_row, start_col, end_row, end_col
+
+class FakeSpreadsheet:
+    """Google Sheets API v4 の代替サーバーが保持するスプレッドシートの状態"""
+
+    def __init__(self):
+        self.sheets: Dict[str, dict] = {}
+        self._next_sheet_id = 1
+        self._lock = threading.Lock()
+
+    def add_sheet(self, title: str) -> dict:
+        sheet = {'properties': {'title': title, 'sheetId': self._next_sheet_id},
+                 'conditionalFormats': [], 'rows': []}
+        self._next_sheet_id += 1
+        self.sheets[title] = sheet
+        return sheet
+
+    def read(self, range_name: str) -> dict:
+        title, start_row, start_col, end_row, end_col = _parse_a1(range_name)
+        rows = self.sheets.get(title, {}).get('rows', [])
+        values = [row[start_col:end_col] for row in rows[start_row:end_row]]
+        # 末尾の空セル・空行はAPIと同様に省略する
+        values = [list(row) for row in values]
+        for row in values:
+            while row and row[-1] == '':
+                row.pop()
+        while values and not values[-1]:
+            values.pop()
+        return {'range': range_name, 'majorDimension': 'ROWS', 'values': values}
+
+    def write(self, range_name: str, values: List[List]) -> dict:
+        title, start_row, start_col, _, _ = _parse_a1(range_name)
+        sheet = self.sheets.get(title) or self.add_sheet(title)
+        rows = sheet['rows']
+        for i, row_values in enumerate(values):
+            while len(rows) <= start_row + i:
+                rows.append([])
+            row = rows[start_row + i]
+            while len(row) < start_col + len(row_values):
+                row.append('')
+            for j, value in enumerate(row_values):
+                row[start_col + j] = '' if value is None else str(value)
+        return {'updatedRange': range_name, 'updatedRows': len(values)}
+
+    def append(self, range_name: str, values: List[List]) -> dict:
+        title = _parse_a1(range_name)[0]
+        sheet = self.sheets.get(title) or self.add_sheet(title)
+        start = len(sheet['rows']) + 1
+        end = start + len(values) - 1
+        self.write(f"{title}!A{start}", values)
+        return {'updates': {'updatedRange': f"{title}!A{start}:F{end}", 'updatedRows': len(values)}}
+
+    def clear(self, range_name: str):
+        title, start_row, start_col, end_row, end_col = _parse_a1(range_name)
+        rows = self.sheets.get(title, {}).get('rows', [])
+        for row in rows[start_row:end_row]:
+            for j in range(start_col, min(end_col, len(row))):
+                row[j] = ''
+
+    def batch_update(self, requests: List[dict]) -> dict:
+        replies = []
+        for request in requests:
+            if 'addSheet' in request:
+                sheet = self.add_sheet(request['addSheet']['properties']['title'])
+                replies.append({'addSheet': {'properties': sheet['properties']}})
+                continue
+            if 'addConditionalFormatRule' in request:
+                rule = request['addConditionalFormatRule']['rule']
+                sheet_id = rule['ranges'][0]['sheetId']
+                for sheet in self.sheets.values():
+                    if sheet['properties']['sheetId'] == sheet_id:
+                        sheet['conditionalFormats'].append(rule)
+            if 'deleteSheet' in request:
+                sheet_id = request['deleteSheet']['sheetId']
+                self.sheets = {title: sheet for title, sheet in self.sheets.items()
+                               if sheet['properties']['sheetId'] != sheet_id}
+            replies.append({})
+        return {'replies': replies}
+
+    def metadata(self) -> dict:
+        return {'spreadsheetId': 'fake', 'sheets': [
+            {'properties': sheet['properties'], 'conditionalFormats': sheet['conditionalFormats']}
+            for sheet in self.sheets.values()
+        ]}
+
+def create_sheets_service(spreadsheet: Optional[FakeSpreadsheet] = None, **options) -> FakeService:
+    """Google Sheets API v4 の代替サーバー
+
+    spreadsheet を指定した場合はすべてのスプレッドシートIDで同じ内容を使い、
+    指定しない場合はスプレッドシートIDごとに別の内容を持つ（service.spreadsheets）。
+    """
+    service = FakeService('sheets', **options)
+    service.spreadsheets = {}
+    prefix = r'/v4/spreadsheets/(?P<id>[^/:]+)'
+
+    def book(match) -> FakeSpreadsheet:
+        if spreadsheet is not None:
+            return spreadsheet
+        with service._lock:
+            return service.spreadsheets.setdefault(match.group('id'), FakeSpreadsheet())
+
+    def locked(func):
+        def wrapper(handler, match, query, body):
+            target = book(match)
+            with target._lock:
+                return func(target, match, query, json.loads(body) if body else {})
+        return wrapper
+
+    service.route('GET', prefix, 'spreadsheets.get',
+                  locked(lambda s, m, q, b: _json(s.metadata())))
+    service.route('POST', prefix + r':batchUpdate', 'spreadsheets.batchUpdate',
+                  locked(lambda s, m, q, b: _json(s.batch_update(b.get('requests', [])))))
+    service.route('GET', prefix + r'/values:batchGet', 'values.batchGet',
+                  locked(lambda s, m, q, b: _json({'valueRanges': [s.read(r) for r in q.get('ranges', [])]})))
+    service.route('POST', prefix + r'/values:batchUpdate', 'values.batchUpdate',
+                  locked(lambda s, m, q, b: _json({'responses': [s.write(d['range'], d['values'])
+                                                                  for d in b.get('data', [])]})))
+    service.route('POST', prefix + r'/values/(?P<range>[^:]+):append', 'values.append',
+                  locked(lambda s, m, q, b: _json(s.append(m.group('range'), b.get('values', [])))))
+    service.route('POST', prefix + r'/values/(?P<range>[^:]+):clear', 'values.clear',
+                  locked(lambda s, m, q, b: (s.clear(m.group('range')), _json({}))[1]))
+    service.route('GET', prefix + r'/values/(?P<range>.+)', 'values.get',
+                  locked(lambda s, m, q, b: _json(s.read(m.group('range')))))
+    service.route('PUT', prefix + r'/values/(?P<range>.+)', 'values.update',
+                  locked(lambda s, m, q, b: _json(s.write(m.group('range'), b.get('values', [])))))
+    return service
+
+def create_supabase_service(**options) -> FakeService:
+    """Supabase Storageの代替サーバー（アップロードのみ）"""
+    service = FakeService('supabase', **options)
+    service.route('POST', r'/storage/v1/object/(?P<path>.+)', 'storage.upload',
+                  lambda h, m, q, b: _json({'Key': m.group('path'), 'Id': 'fake'}))
+    service.route('PUT', r'/storage/v1/object/(?P<path>.+)', 'storage.update',
+                  lambda h, m, q, b: _json({'Key': m.group('path'), 'Id': 'fake'}))
+    return service
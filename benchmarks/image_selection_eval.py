@@ -0,0 +1,173 @@
+"""
+商品情報の生成に送る画像の選択（image_selection.py）の計測
+
+ラベル付きの商品（benchmarks/fixtures/image_selection.jsonl）ごとに、
+- 選択の正解率（商品全体 front とタグ tag の写真が高解像度に選ばれたか）
+- 画像の入力トークン数の見積もり（すべて高解像度で送る場合との比較）
+- 画像の選択あり・なしで生成した商品名の正解率（タグの文字 required がすべて商品名に含まれるか）と入力トークン数
+- 選択の所要時間（p50/p95）
+を表示する。
+
+写真は "images"（fixturesからの相対パス、"photos" と同じ順）があればそれを使い、ない場合は "photos" の種類ごとに
+合成した写真（fake_services.make_product_photo）を使う。
+--fake を付けるとOpenAIをローカルの代替サーバーに置き換える（商品名の正解率は参考値）。
+付けない場合は実際のOpenAI APIを1商品につき2回（選択あり・なし）呼び出すため、OPENAI_API_KEYと利用料金が必要になる。
+
+使い方:
+    python benchmarks/image_selection_eval.py --fake
+    python benchmarks/image_selection_eval.py --fake --high 1 --low 2
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import make_product_photo, create_openai_service  # noqa: E402
+from e2e_benchmark import percentile  # noqa: E402
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'image_selection.jsonl')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='商品情報の生成に送る画像の選択の計測')
+    parser.add_argument('--fixtures', default=DEFAULT_FIXTURES, help='ラベル付きの商品ファイル（JSON Lines）')
+    parser.add_argument('--high', type=int, default=None, help='高解像度で送る画像の枚数（既定は IMAGE_HIGH_DETAIL_COUNT）')
+    parser.add_argument('--low', type=int, default=None, help='低解像度で送る画像の枚数（既定は IMAGE_LOW_DETAIL_COUNT）')
+    parser.add_argument('--fake', action='store_true', help='OpenAIをローカルの代替サーバーに置き換える')
+    parser.add_argument('--openai-latency', type=float, default=0.1, help='代替サーバーの応答遅延（秒）')
+    return parser.parse_args()
+
+def load_fixtures(path: str) -> List[dict]:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def prepare_photos(fixtures: List[dict], fixture_dir: str, photo_dir: str) -> List[List[str]]:
+    """商品ごとの写真のパス（"images" がない商品は合成した写真を保存する）"""
+    photos = []
+    for i, fixture in enumerate(fixtures):
+        if fixture.get('images'):
+            photos.append([os.path.join(fixture_dir, path) for path in fixture['images']])
+            continue
+        paths = []
+        for j, kind in enumerate(fixture['photos']):
+            path = os.path.join(photo_dir, f"{i}_{j}_{kind}.jpg")
+            with open(path, 'wb') as f:
+                f.write(make_product_photo(kind, seed=i * 100 + j, tag_lines=tuple(fixture['tag'])))
+            paths.append(path)
+        photos.append(paths)
+    return photos
+
+def evaluate_selection(fixtures: List[dict], photos: List[List[str]], high: int, low: int) -> Dict:
+    """選択の正解率・画像の入力トークン数の見積もり・所要時間"""
+    from image_selection import select_image_details
+    from usage_tracker import estimate_image_tokens
+
+    correct = 0
+    baseline_tokens = selected_tokens = sent = total = 0
+    latencies = []
+    for fixture, paths in zip(fixtures, photos):
+        started = time.perf_counter()
+        details = select_image_details(paths, 'high', high, low)
+        latencies.append(time.perf_counter() - started)
+
+        chosen = {kind for kind, detail in zip(fixture['photos'], details) if detail == 'high'}
+        expected = {'front', 'tag'} & set(fixture['photos'])
+        correct += 1 if len(chosen & expected) >= min(high, len(expected)) else 0
+        baseline_tokens += estimate_image_tokens(paths, 'high')
+        selected_tokens += estimate_image_tokens(paths, details)
+        sent += len(paths) - details.count('none')
+        total += len(paths)
+        print(f"  {' '.join(f'{kind}:{detail}' for kind, detail in zip(fixture['photos'], details))}")
+    return {
+        'accuracy': correct / len(fixtures) if fixtures else 0.0,
+        'correct': correct,
+        'baseline_tokens': baseline_tokens,
+        'selected_tokens': selected_tokens,
+        'sent': sent,
+        'total': total,
+        'latencies': latencies
+    }
+
+def evaluate_titles(handler, fixtures: List[dict], photos: List[List[str]], selection: bool) -> Dict:
+    """画像の選択あり・なしで商品情報を生成し、商品名の正解率と入力トークン数を返す"""
+    import chatgpt_handler
+    from usage_tracker import get_usage_tracker
+
+    tracker = get_usage_tracker()
+    before = tracker.summarize()
+    original = chatgpt_handler.IMAGE_SELECTION
+    chatgpt_handler.IMAGE_SELECTION = selection
+    correct = 0
+    try:
+        for fixture, paths in zip(fixtures, photos):
+            if fixture['features']:
+                product_info = handler.generate_product_info(paths, fixture['features'])
+            else:
+                product_info = handler.generate_product_info_from_images_only(paths)
+            title = (product_info or {}).get('title', '').upper()
+            correct += 1 if all(word.upper() in title for word in fixture['required']) else 0
+    finally:
+        chatgpt_handler.IMAGE_SELECTION = original
+    after = tracker.summarize()
+    return {
+        'correct': correct,
+        'prompt_tokens': after['prompt_tokens'] - before['prompt_tokens'],
+        'cost_usd': after['cost_usd'] - before['cost_usd']
+    }
+
+def main():
+    args = parse_args()
+    state_dir = tempfile.mkdtemp(prefix='shuppin_image_selection_')
+    # 商品名の比較のみを行うため、過去の出品例と価格の調整（スプレッドシートの読み込み）は使わない
+    os.environ.update({'LOCAL_STATE_DIR': state_dir, 'LISTING_RETRIEVAL': '0', 'PRICE_ENGINE': '0'})
+    if args.high is not None:
+        os.environ['IMAGE_HIGH_DETAIL_COUNT'] = str(args.high)
+    if args.low is not None:
+        os.environ['IMAGE_LOW_DETAIL_COUNT'] = str(args.low)
+
+    service = None
+    if args.fake:
+        service = create_openai_service(latency=args.openai_latency, seed=0).start()
+        os.environ.update({
+            'OPENAI_API_KEY': 'sk-image-selection-eval',
+            'OPENAI_BASE_URL': f"{service.url}/v1"
+        })
+
+    # 接続先の設定後に読み込む
+    from chatgpt_handler import ChatGPTHandler
+    from image_selection import IMAGE_HIGH_DETAIL_COUNT as high, IMAGE_LOW_DETAIL_COUNT as low
+
+    fixtures = load_fixtures(args.fixtures)
+    photo_dir = os.path.join(state_dir, 'photos')
+    os.makedirs(photo_dir, exist_ok=True)
+    photos = prepare_photos(fixtures, os.path.dirname(os.path.abspath(args.fixtures)), photo_dir)
+
+    try:
+        print(f"\n=== 画像の選択（{len(fixtures)} 商品、高解像度 {high} 枚・低解像度 {low} 枚） ===")
+        selection = evaluate_selection(fixtures, photos, high, low)
+        reduction = 1 - selection['selected_tokens'] / selection['baseline_tokens'] if selection['baseline_tokens'] else 0.0
+        print(f"選択の正解率（全体・タグが高解像度）: {selection['accuracy']:.0%}（{selection['correct']}/{len(fixtures)}）")
+        print(f"送信する画像: {selection['sent']}/{selection['total']} 枚")
+        print(f"画像の入力トークン数（見積もり）: {selection['baseline_tokens']} → {selection['selected_tokens']}"
+              f"（{reduction:.0%} 削減）")
+        print(f"選択の所要時間: p50 {percentile(selection['latencies'], 50) * 1000:.1f}ms"
+              f" / p95 {percentile(selection['latencies'], 95) * 1000:.1f}ms")
+
+        print(f"\n=== 商品名の正解率（タグの文字を含むか{'、代替サーバーのため参考値' if args.fake else ''}） ===")
+        handler = ChatGPTHandler()
+        for name, enabled in [('すべて送信', False), ('画像を選択', True)]:
+            result = evaluate_titles(handler, fixtures, photos, enabled)
+            print(f"{name}: 正解率 {result['correct'] / len(fixtures):.0%}（{result['correct']}/{len(fixtures)}）"
+                  f" / 入力 {result['prompt_tokens']} トークン / ${result['cost_usd']:.4f}")
+    finally:
+        if service is not None:
+            service.stop()
+
+if __name__ == "__main__":
+    main()
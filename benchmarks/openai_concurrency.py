@@ -0,0 +1,106 @@
+"""
+OpenAIクライアントの同時実行の計測
+
+ローカルの代替サーバーに対して、同じ商品数の商品情報生成を
+同期版（1件ずつ）と非同期版（1つのイベントループで同時に実行、スレッドなし）で実行し、
+全体の所要時間と1商品あたりのレイテンシ（p50/p95）を比較する。
+
+使い方:
+    python benchmarks/openai_concurrency.py --items 20 --concurrency 8 --openai-latency 1.0
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from typing import List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import make_test_jpeg, create_openai_service  # noqa: E402
+from e2e_benchmark import percentile  # noqa: E402
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='OpenAIクライアントの同時実行の計測')
+    parser.add_argument('--items', type=int, default=10, help='生成する商品数')
+    parser.add_argument('--concurrency', type=int, default=8, help='非同期版で同時に実行する商品数')
+    parser.add_argument('--images', type=int, default=3, help='1商品あたりの画像の枚数')
+    parser.add_argument('--openai-latency', type=float, default=1.0, help='代替サーバーの応答遅延（秒）')
+    parser.add_argument('--features', default='', help='特徴テキスト（空の場合は画像のみから生成し、種類の判定もモデルで行う）')
+    return parser.parse_args()
+
+def report(name: str, elapsed: float, latencies: List[float], failures: int):
+    print(f"\n=== {name} ===")
+    print(f"全体: {elapsed:.3f}s（{len(latencies) / elapsed if elapsed else 0:.2f} 商品/秒）/ 失敗 {failures} 件")
+    print(f"1商品: p50 {percentile(latencies, 50):.3f}s / p95 {percentile(latencies, 95):.3f}s")
+
+def run_sync(handler, image_paths: List[str], features: str, items: int):
+    latencies, failures = [], 0
+    started = time.perf_counter()
+    for _ in range(items):
+        item_started = time.perf_counter()
+        if features:
+            result = handler.generate_product_info(image_paths, features)
+        else:
+            result = handler.generate_product_info_from_images_only(image_paths)
+        latencies.append(time.perf_counter() - item_started)
+        failures += result is None
+    report('同期版（1件ずつ）', time.perf_counter() - started, latencies, failures)
+
+async def run_async(handler, image_paths: List[str], features: str, items: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    async def generate():
+        nonlocal failures
+        async with semaphore:
+            item_started = time.perf_counter()
+            if features:
+                result = await handler.agenerate_product_info(image_paths, features)
+            else:
+                result = await handler.agenerate_product_info_from_images_only(image_paths)
+            latencies.append(time.perf_counter() - item_started)
+            failures += result is None
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(generate() for _ in range(items)))
+    finally:
+        await handler.aclose()
+    report(f'非同期版（同時 {concurrency} 件）', time.perf_counter() - started, latencies, failures)
+
+def main():
+    args = parse_args()
+    state_dir = tempfile.mkdtemp(prefix='shuppin_openai_concurrency_')
+    service = create_openai_service(latency=args.openai_latency, seed=0).start()
+    os.environ.update({
+        'LOCAL_STATE_DIR': state_dir,
+        'TRACE_LOG_FILE': '',
+        'OPENAI_API_KEY': 'sk-benchmark',
+        'OPENAI_BASE_URL': f"{service.url}/v1"
+    })
+
+    # 接続先の設定後に読み込む
+    from chatgpt_handler import ChatGPTHandler
+
+    image_paths = []
+    for i in range(args.images):
+        path = os.path.join(state_dir, f'image_{i}.jpg')
+        with open(path, 'wb') as f:
+            f.write(make_test_jpeg(800, 1000, seed=i))
+        image_paths.append(path)
+
+    handler = ChatGPTHandler()
+    try:
+        run_sync(handler, image_paths, args.features, args.items)
+        asyncio.run(run_async(handler, image_paths, args.features, args.items, args.concurrency))
+        print(f"\nOpenAI呼び出し回数: {sum(service.calls.values())}")
+    finally:
+        handler.close()
+        service.stop()
+
+if __name__ == "__main__":
+    main()
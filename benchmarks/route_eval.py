@@ -0,0 +1,175 @@
+"""
+モデルの振り分け（商品種類の判定・商品名の修正・ハッシュタグの補完）の精度と所要時間の計測
+
+ラベル付きの入力（benchmarks/fixtures/routes.jsonl）を用途ごとの処理に通し、
+振り分け先（キーワード判定・ローカルの短縮・各モデル）ごとに正解率とレイテンシ（p50/p95）を表示する。
+
+--fake を付けるとOpenAIをローカルの代替サーバーに置き換える（正解率は参考値、所要時間は振り分けの処理分のみ）。
+付けない場合は実際のOpenAI APIを呼び出すため、OPENAI_API_KEYと利用料金が必要になる。
+商品種類のモデル判定は画像から行うため、入力に "images" がない場合は無地のテスト画像を使う（正解率は参考値）。
+
+使い方:
+    python benchmarks/route_eval.py --fake
+    OPENAI_MODEL_CATEGORY=gpt-4o python benchmarks/route_eval.py --routes category
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from typing import Callable, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import make_test_jpeg, create_openai_service  # noqa: E402
+from e2e_benchmark import percentile  # noqa: E402
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'routes.jsonl')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='モデルの振り分けの精度と所要時間の計測')
+    parser.add_argument('--fixtures', default=DEFAULT_FIXTURES, help='ラベル付きの入力ファイル（JSON Lines）')
+    parser.add_argument('--routes', default='category,title_repair,hashtags', help='計測する用途（カンマ区切り）')
+    parser.add_argument('--fake', action='store_true', help='OpenAIをローカルの代替サーバーに置き換える')
+    parser.add_argument('--openai-latency', type=float, default=0.3, help='代替サーバーの応答遅延（秒）')
+    return parser.parse_args()
+
+def load_fixtures(path: str) -> List[dict]:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+class RouteResult:
+    """振り分け先ごとの正解数・判定できなかった件数・所要時間"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.correct = 0
+        self.total = 0
+        self.skipped = 0
+        self.latencies: List[float] = []
+
+    def measure(self, func: Callable[[], Optional[bool]]):
+        """1件を処理する（Noneを返した場合は判定できなかったものとして数える）"""
+        started = time.perf_counter()
+        try:
+            ok = func()
+        except Exception as e:
+            print(f"  {self.name}: エラー {e}")
+            ok = False
+        self.latencies.append(time.perf_counter() - started)
+        if ok is None:
+            self.skipped += 1
+            return
+        self.total += 1
+        self.correct += 1 if ok else 0
+
+    def report(self) -> str:
+        accuracy = self.correct / self.total if self.total else 0.0
+        coverage = self.total / (self.total + self.skipped) if self.total + self.skipped else 0.0
+        return (f"{self.name}: 正解率 {accuracy:.0%}（{self.correct}/{self.total}）"
+                f" / 判定率 {coverage:.0%}"
+                f" / p50 {percentile(self.latencies, 50) * 1000:.2f}ms"
+                f" / p95 {percentile(self.latencies, 95) * 1000:.2f}ms")
+
+def evaluate_category(handler, fixtures: List[dict], fixture_dir: str, test_image: str) -> List[RouteResult]:
+    import chatgpt_handler
+    from template_engine import get_template_engine
+
+    engine = get_template_engine()
+    heuristic = RouteResult('category.heuristic')
+    model = RouteResult(f"category.model ({chatgpt_handler.MODEL_ROUTES['category']})")
+
+    # モデルの判定を計測する間はキーワード判定を使わない
+    classifier = chatgpt_handler.CATEGORY_CLASSIFIER
+    chatgpt_handler.CATEGORY_CLASSIFIER = 'model'
+    try:
+        for fixture in fixtures:
+            label = fixture['label']
+
+            def run_heuristic():
+                category = engine.classify_text(fixture['features'])
+                return None if category is None else category == label
+
+            images = [os.path.join(fixture_dir, path) for path in fixture.get('images', [])] or [test_image]
+            heuristic.measure(run_heuristic)
+            model.measure(lambda: handler._determine_product_type(images, fixture['features']) == label)
+    finally:
+        chatgpt_handler.CATEGORY_CLASSIFIER = classifier
+    return [heuristic, model]
+
+def evaluate_title_repair(handler, fixtures: List[dict]) -> List[RouteResult]:
+    import chatgpt_handler
+    from title_optimizer import shorten_title, MAX_TITLE_LENGTH
+
+    def is_valid(title: str, fixture: dict) -> bool:
+        return 0 < len(title) <= MAX_TITLE_LENGTH and all(word in title for word in fixture['required'])
+
+    local = RouteResult('title_repair.local')
+    model = RouteResult(f"title_repair.model ({chatgpt_handler.MODEL_ROUTES['title_repair']})")
+    for fixture in fixtures:
+        local.measure(lambda: is_valid(shorten_title(fixture['title']), fixture))
+        model.measure(lambda: is_valid(handler._repair_title(fixture['title']), fixture))
+    return [local, model]
+
+def evaluate_hashtags(handler, fixtures: List[dict]) -> List[RouteResult]:
+    import chatgpt_handler
+
+    def run(fixture: dict) -> bool:
+        hashtags = handler._fix_hashtags(dict(fixture)).split()
+        original = fixture['hashtags'].split()[:chatgpt_handler.HASHTAG_COUNT]
+        return (len(hashtags) == chatgpt_handler.HASHTAG_COUNT
+                and all(tag.startswith('#') for tag in hashtags)
+                and all(tag in hashtags for tag in original))
+
+    model = RouteResult(f"hashtags.model ({chatgpt_handler.MODEL_ROUTES['hashtags']})")
+    for fixture in fixtures:
+        model.measure(lambda: run(fixture))
+    return [model]
+
+def main():
+    args = parse_args()
+    state_dir = tempfile.mkdtemp(prefix='shuppin_route_eval_')
+    os.environ['LOCAL_STATE_DIR'] = state_dir
+
+    service = None
+    if args.fake:
+        service = create_openai_service(latency=args.openai_latency, seed=0).start()
+        os.environ.update({
+            'OPENAI_API_KEY': 'sk-route-eval',
+            'OPENAI_BASE_URL': f"{service.url}/v1"
+        })
+
+    # 接続先の設定後に読み込む
+    from chatgpt_handler import ChatGPTHandler
+
+    test_image = os.path.join(state_dir, 'test.jpg')
+    with open(test_image, 'wb') as f:
+        f.write(make_test_jpeg(512, 512))
+
+    fixtures = load_fixtures(args.fixtures)
+    fixture_dir = os.path.dirname(os.path.abspath(args.fixtures))
+    by_route: Dict[str, List[dict]] = {}
+    for fixture in fixtures:
+        by_route.setdefault(fixture['route'], []).append(fixture)
+
+    handler = ChatGPTHandler()
+    evaluators = {
+        'category': lambda items: evaluate_category(handler, items, fixture_dir, test_image),
+        'title_repair': lambda items: evaluate_title_repair(handler, items),
+        'hashtags': lambda items: evaluate_hashtags(handler, items)
+    }
+    try:
+        for route in args.routes.split(','):
+            items = by_route.get(route, [])
+            print(f"\n=== {route}（{len(items)} 件） ===")
+            for result in evaluators[route](items):
+                print(result.report())
+    finally:
+        if service is not None:
+            service.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,199 +1,613 @@
 import os
 import json
-import base64
-from typing import Optional, List
-import openai
+import time
+import inspect
+from typing import Awaitable, Callable, Optional, List, Tuple, Union
+import httpx
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
+from title_optimizer import shorten_title, MAX_TITLE_LENGTH
+from template_engine import get_template_engine
+from tracing import span, get_trace_tags
+from usage_tracker import get_usage_tracker, estimate_image_tokens, describe_detail
+from streaming_json import StreamingJSONFields
+from listing_retrieval import find_examples, format_examples_for_prompt
+from price_engine import adjust_start_price
+from resource_manager import encode_image_base64, image_buffers
+from image_selection import select_image_details, IMAGE_SELECTION
+
+# 用途ごとに使うモデル（商品説明の生成のみ大きい画像対応モデルを使い、それ以外は安いモデルに振り分ける）
+MODEL_ROUTES = {
+    'category': os.getenv('OPENAI_MODEL_CATEGORY', 'gpt-4o-mini'),
+    'title_repair': os.getenv('OPENAI_MODEL_TITLE_REPAIR', 'gpt-4o-mini'),
+    'hashtags': os.getenv('OPENAI_MODEL_HASHTAGS', 'gpt-4o-mini'),
+    'listing': os.getenv('OPENAI_MODEL_LISTING', 'gpt-4o')
+}
+
+# 商品種類の判定に送る画像の解像度（種類の判定には低解像度で十分）
+CATEGORY_DETAIL = os.getenv('OPENAI_DETAIL_CATEGORY', 'low')
+
+# 商品種類の判定方法（heuristic: 特徴テキストのキーワードで判定し、判定できない場合のみモデルを使う / model: 常にモデルを使う）
+CATEGORY_CLASSIFIER = os.getenv('CATEGORY_CLASSIFIER', 'heuristic')
+
+# ハッシュタグの数
+HASHTAG_COUNT = 10
+
+# OpenAI APIのタイムアウト（秒）。接続は短く、応答の読み込みは画像付きの生成に合わせて長めにする
+OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', '10'))
+OPENAI_READ_TIMEOUT = float(os.getenv('OPENAI_READ_TIMEOUT', '120'))
+
+# HTTP接続プール（同時に開く接続の上限と、再利用のために保持する接続数）
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '20'))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('OPENAI_MAX_KEEPALIVE_CONNECTIONS', '10'))
+
+# 接続エラー・429・5xxの場合の再試行回数
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '2'))
+
+# 先行通知（商品名と出品価格）を受け取る関数。非同期版ではコルーチン関数も指定できる
+PreviewCallback = Callable[[dict], Union[None, Awaitable[None]]]
+
+def _http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS)
+
+def _usage_to_dict(usage) -> dict:
+    """レスポンスの利用量（オブジェクト）を辞書にする"""
+    if usage is None:
+        return {}
+    return {
+        'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+        'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0
+    }
 
 class ChatGPTHandler:
+    """OpenAI APIで商品情報を生成する
+
+    同期版（generate_product_info など）と非同期版（agenerate_product_info など）があり、どちらも
+    接続プールを持つクライアントを使い回す。非同期版は1つのイベントループ内で複数の商品の判定・生成を
+    スレッドなしで同時に実行でき、タスクをキャンセルすると実行中のHTTPリクエストも中断される。
+    """
+
     def __init__(self):
         load_dotenv()
         api_key = os.getenv('OPENAI_API_KEY')
         if not api_key:
             raise ValueError("OPENAI_API_KEY is not set.")
-        openai.api_key = api_key
+        self._api_key = api_key
+        self.client = OpenAI(
+            api_key=api_key,
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=httpx.Client(limits=_http_limits(), timeout=_http_timeout())
+        )
+        self._async_client: Optional[AsyncOpenAI] = None
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """非同期クライアント（初回の利用時に作成。接続プールはイベントループごとのため、同じループ内で使う）"""
+        if self._async_client is None:
+            self._async_client = AsyncOpenAI(
+                api_key=self._api_key,
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=httpx.AsyncClient(limits=_http_limits(), timeout=_http_timeout())
+            )
+        return self._async_client
+
+    def close(self):
+        """同期クライアントの接続を閉じる"""
+        self.client.close()
+
+    async def aclose(self):
+        """非同期クライアントの接続を閉じる"""
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
 
     def _encode_image_to_base64(self, image_path: str) -> str:
-        """画像をbase64エンコードする"""
+        """画像をbase64エンコードする（1回の生成の中では同じ画像を1回だけエンコードする）"""
         try:
-            with open(image_path, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
+            return encode_image_base64(image_path)
         except Exception as e:
             print(f"画像エンコードエラー ({image_path}): {str(e)}")
             return ""
 
-    def _determine_product_type(self, image_paths: List[str]) -> str:
-        """画像から商品の種類（トップスかパンツかスカートか）を判定する"""
-        try:
-            # 画像をbase64エンコード
-            encoded_images = []
-            for image_path in image_paths:
-                encoded_image = self._encode_image_to_base64(image_path)
-                if encoded_image:
-                    encoded_images.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{encoded_image}"
-                        }
-                    })
+    def _encode_images(self, image_paths: List[str], detail: Union[str, List[str]] = 'auto') -> List[dict]:
+        """画像をbase64エンコードしてChat Completions APIの画像パーツにする
+
+        detail は画像ごとに指定することもできる（'none' の画像は送らない）。
+        """
+        details = detail if isinstance(detail, list) else [detail] * len(image_paths)
+        encoded_images = []
+        for image_path, image_detail in zip(image_paths, details):
+            if image_detail == 'none':
+                continue
+            encoded_image = self._encode_image_to_base64(image_path)
+            if encoded_image:
+                encoded_images.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{encoded_image}",
+                        "detail": image_detail
+                    }
+                })
+        return encoded_images
+
+    def _create_chat_completion(self, purpose: str, model: str, messages: List[dict], max_tokens: int,
+                                temperature: float, image_paths: List[str], detail: Union[str, List[str]] = 'auto',
+                                category: str = '') -> str:
+        """Chat Completions APIを呼び出して応答の本文を返し、トークン数と費用を記録する"""
+        with span('openai.chat_completion', purpose=purpose, model=model, detail=describe_detail(detail)):
+            response = self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature
+            )
 
-            if not encoded_images:
-                return "tops"  # デフォルトはトップス
+        self._record_usage(purpose, model, _usage_to_dict(response.usage), image_paths, detail, category)
+        return response.choices[0].message.content or ''
+
+    async def _acreate_chat_completion(self, purpose: str, model: str, messages: List[dict], max_tokens: int,
+                                       temperature: float, image_paths: List[str], detail: Union[str, List[str]] = 'auto',
+                                       category: str = '') -> str:
+        """_create_chat_completion の非同期版"""
+        with span('openai.chat_completion', purpose=purpose, model=model, detail=describe_detail(detail), mode='async'):
+            response = await self.async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature
+            )
 
-            prompt = """
-この画像は古着の商品です。以下の3つのカテゴリーのうち、どれに該当するか判定してください：
+        self._record_usage(purpose, model, _usage_to_dict(response.usage), image_paths, detail, category)
+        return response.choices[0].message.content or ''
+
+    def _stream_chat_completion(self, purpose: str, model: str, messages: List[dict], max_tokens: int,
+                                temperature: float, image_paths: List[str], on_delta: Callable[[str], None],
+                                detail: Union[str, List[str]] = 'auto', category: str = '') -> str:
+        """Chat Completions APIをストリーミングで呼び出し、届いた文字列を順に on_delta に渡して全文を返す"""
+        parts: List[str] = []
+        usage = None
+        started = time.perf_counter()
+        with span('openai.chat_completion', purpose=purpose, model=model, detail=describe_detail(detail), stream=True) as tags:
+            stream = self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            with stream:
+                for chunk in stream:
+                    # 利用量は最後のチャンク（choicesが空）で届く
+                    usage = chunk.usage or usage
+                    for choice in chunk.choices:
+                        delta = choice.delta.content if choice.delta else None
+                        if delta:
+                            if not parts:
+                                tags['first_token_sec'] = round(time.perf_counter() - started, 3)
+                            parts.append(delta)
+                            on_delta(delta)
+
+        self._record_usage(purpose, model, _usage_to_dict(usage), image_paths, detail, category)
+        return ''.join(parts)
+
+    async def _astream_chat_completion(self, purpose: str, model: str, messages: List[dict], max_tokens: int,
+                                       temperature: float, image_paths: List[str],
+                                       on_delta: Callable[[str], Optional[Awaitable[None]]],
+                                       detail: Union[str, List[str]] = 'auto', category: str = '') -> str:
+        """_stream_chat_completion の非同期版（on_delta はコルーチン関数でもよい）"""
+        parts: List[str] = []
+        usage = None
+        started = time.perf_counter()
+        with span('openai.chat_completion', purpose=purpose, model=model, detail=describe_detail(detail),
+                  stream=True, mode='async') as tags:
+            stream = await self.async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            async with stream:
+                async for chunk in stream:
+                    usage = chunk.usage or usage
+                    for choice in chunk.choices:
+                        delta = choice.delta.content if choice.delta else None
+                        if delta:
+                            if not parts:
+                                tags['first_token_sec'] = round(time.perf_counter() - started, 3)
+                            parts.append(delta)
+                            result = on_delta(delta)
+                            if inspect.isawaitable(result):
+                                await result
+
+        self._record_usage(purpose, model, _usage_to_dict(usage), image_paths, detail, category)
+        return ''.join(parts)
+
+    def _record_usage(self, purpose: str, model: str, usage: dict, image_paths: List[str],
+                      detail: Union[str, List[str]] = 'auto', category: str = '', batch: bool = False):
+        """呼び出しのトークン数と費用を記録する"""
+        # 利用量の記録に失敗しても商品情報の生成は継続
+        try:
+            cost = get_usage_tracker().record(
+                purpose, model,
+                prompt_tokens=usage.get('prompt_tokens', 0),
+                completion_tokens=usage.get('completion_tokens', 0),
+                management_number=get_trace_tags().get('management_number', ''),
+                category=category,
+                detail=describe_detail(detail),
+                image_tokens=estimate_image_tokens(image_paths, detail),
+                image_count=len(image_paths) - (detail.count('none') if isinstance(detail, list) else 0),
+                batch=batch
+            )
+            print(f"OpenAI利用量 ({purpose}): 入力 {usage.get('prompt_tokens', 0)} / 出力 {usage.get('completion_tokens', 0)} トークン (${cost:.4f})")
+        except Exception as e:
+            print(f"利用量記録エラー: {e}")
 
-1. tops（トップス）: Tシャツ、シャツ、ジャケット、セーター、カーディガンなど、上半身に着る服
-2. pants（パンツ）: ジーンズ、スラックス、ショートパンツ、トレーナーなど、下半身に着る服
-3. skirt（スカート）: ミニスカート、ロングスカート、プリーツスカート、タイトスカートなど、女性用の下半身に着る服
+    def _classify_by_keywords(self, user_features_text: str) -> Optional[str]:
+        """特徴テキストに種類を表すキーワードがあればモデルを呼び出さずに判定する"""
+        if CATEGORY_CLASSIFIER != 'heuristic' or not user_features_text:
+            return None
+        with span('category.heuristic'):
+            category = get_template_engine().classify_text(user_features_text)
+        if category:
+            print(f"商品種類をキーワードから判定: {category}")
+        return category
+
+    def _build_category_messages(self, encoded_images: List[dict]) -> List[dict]:
+        """商品種類の判定に使うメッセージを作成する"""
+        # カテゴリーはテンプレートのデータファイル（templates/categories.json）から作成
+        engine = get_template_engine()
+        category_names = "」「".join(engine.categories)
+        prompt = f"""
+この画像は古着の商品です。以下の{len(engine.categories)}つのカテゴリーのうち、どれに該当するか判定してください：
+
+{engine.build_category_choices()}
 
 画像を詳しく分析して、最も適切なカテゴリーを選択してください。
-必ず「tops」「pants」「skirt」のいずれかで回答してください。
+必ず「{category_names}」のいずれかで回答してください。
 """
 
-            messages = [
-                {
-                    "role": "system", 
-                    "content": "あなたは古着の商品分類の専門AIです。画像から商品の種類を正確に判定してください。"
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        }
-                    ] + encoded_images
-                }
-            ]
-
-            response = openai.ChatCompletion.create(
-                model="gpt-4o",
-                messages=messages,
-                max_tokens=50,
-                temperature=0.1
-            )
+        return [
+            {
+                "role": "system",
+                "content": "あなたは古着の商品分類の専門AIです。画像から商品の種類を正確に判定してください。"
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": prompt
+                    }
+                ] + encoded_images
+            }
+        ]
+
+    def _determine_product_type(self, image_paths: List[str], user_features_text: str = '') -> str:
+        """画像から商品の種類（templates/categories.json のカテゴリー）を判定する"""
+        try:
+            category = self._classify_by_keywords(user_features_text)
+            if category:
+                return category
 
-            content = response.choices[0].message.content.strip().lower()
-            
-            if "skirt" in content or "スカート" in content:
-                return "skirt"
-            elif "pants" in content or "パンツ" in content or "ジーンズ" in content or "スラックス" in content:
-                return "pants"
-            else:
-                return "tops"
+            # 予算を超えている場合は安いモデル・低解像度の画像に切り替える
+            model, detail = get_usage_tracker().choose_model_and_detail(MODEL_ROUTES['category'], CATEGORY_DETAIL)
+
+            # 画像をbase64エンコード
+            encoded_images = self._encode_images(image_paths, detail)
+
+            if not encoded_images:
+                return "tops"  # デフォルトはトップス
+
+            content = self._create_chat_completion(
+                'category', model, self._build_category_messages(encoded_images), max_tokens=50,
+                temperature=0.1, image_paths=image_paths, detail=detail
+            )
+            return get_template_engine().parse_category(content.strip().lower())
 
         except Exception as e:
             print(f"商品種類判定エラー: {e}")
             return "tops"  # エラーの場合はデフォルトでトップス
 
-    def _generate_template(self, result: dict, product_type: str) -> str:
-        """商品種類に応じてテンプレートを生成する"""
-        if product_type == "skirt":
-            # スカート用テンプレート
-            template = f"""【商品について】
-{result.get('description', '商品の説明が生成されませんでした')}
-
-【実寸】
-ウエスト：cm
-総丈：cm
-※採寸は素人寸法なので、ご理解の程よろしくお願い致します（2〜4センチ誤差がある場合があります）。
-
-【状態について】
-特に目立った傷や汚れのないお品物です。古着故、多少の使用感はございますが、普段古着を着られる方でしたら、気にならずお使い頂ける一枚かと思います。
-※商品名に書いている年代とは違う場合もあります、ご理解の上ご購入ください。
-※多少の汚れ・破れがあっても、目立っていなければ、目立った傷汚れなしとして、販売します。目立った傷汚れ等なしと選択していても、古着ですので価値観によっては「傷・汚れ」と思われてしまう場合がございます。
-気になるところがある際は、具体的にコメントをお願いいたします。
-また、写真写りやシワ等も写真の撮り方で実物と少々違う場合がありますので、ご了承ください。
-
-★上記、ご理解の上でご購入よろしくお願いいたします★
-
-{result.get('hashtags', '')}
-
-#古着屋883　←他の商品もご覧くださいね‼️
-
-最後までお読みいただきありがとうございました！
-気持ちの良いお取引をどうぞよろしくお願い致します。"""
-        elif product_type == "pants":
-            # パンツ用テンプレート
-            template = f"""【商品について】
-{result.get('description', '商品の説明が生成されませんでした')}
-
-【実寸】
-ウエスト：cm
-股下：cm
-裾幅：cm
-股上：cm
-※採寸は素人寸法なので、ご理解の程よろしくお願い致します（2〜4センチ誤差がある場合があります）。
-
-【状態について】
-特に目立った傷や汚れのないお品物です。古着故、多少の使用感はございますが、普段古着を着られる方でしたら、気にならずお使い頂ける一枚かと思います。
-※商品名に書いている年代とは違う場合もあります、ご理解の上ご購入ください。
-※多少の汚れ・破れがあっても、目立っていなければ、目立った傷汚れなしとして、販売します。目立った傷汚れ等なしと選択していても、古着ですので価値観によっては「傷・汚れ」と思われてしまう場合がございます。
-気になるところがある際は、具体的にコメントをお願いいたします。
-また、写真写りやシワ等も写真の撮り方で実物と少々違う場合がありますので、ご了承ください。
-
-★上記、ご理解の上でご購入よろしくお願いいたします★
-
-{result.get('hashtags', '')}
-
-#古着屋883　←他の商品もご覧くださいね‼️
-
-最後までお読みいただきありがとうございました！
-気持ちの良いお取引をどうぞよろしくお願い致します。"""
-        else:
-            # トップス用テンプレート
-            template = f"""【商品について】
-{result.get('description', '商品の説明が生成されませんでした')}
-
-【実寸】
-着丈：cm
-身幅：cm
-肩幅：cm
-袖丈：cm
-※採寸は素人寸法なので、ご理解の程よろしくお願い致します（2〜4センチ誤差がある場合があります）。
+    async def _adetermine_product_type(self, image_paths: List[str], user_features_text: str = '') -> str:
+        """_determine_product_type の非同期版"""
+        try:
+            category = self._classify_by_keywords(user_features_text)
+            if category:
+                return category
 
-【状態について】
-特に目立った傷や汚れのないお品物です。古着故、多少の使用感はございますが、普段古着を着られる方でしたら、気にならずお使い頂ける一枚かと思います。
-※商品名に書いている年代とは違う場合もあります、ご理解の上ご購入ください。
-※多少の汚れ・破れがあっても、目立っていなければ、目立った傷汚れなしとして、販売します。目立った傷汚れ等なしと選択していても、古着ですので価値観によっては「傷・汚れ」と思われてしまう場合がございます。
-気になるところがある際は、具体的にコメントをお願いいたします。
-また、写真写りやシワ等も写真の撮り方で実物と少々違う場合がありますので、ご了承ください。
+            model, detail = get_usage_tracker().choose_model_and_detail(MODEL_ROUTES['category'], CATEGORY_DETAIL)
+            encoded_images = self._encode_images(image_paths, detail)
+            if not encoded_images:
+                return "tops"
 
-★上記、ご理解の上でご購入よろしくお願いいたします★
+            content = await self._acreate_chat_completion(
+                'category', model, self._build_category_messages(encoded_images), max_tokens=50,
+                temperature=0.1, image_paths=image_paths, detail=detail
+            )
+            return get_template_engine().parse_category(content.strip().lower())
 
-{result.get('hashtags', '')}
+        except Exception as e:
+            print(f"商品種類判定エラー: {e}")
+            return "tops"
 
-#古着屋883　←他の商品もご覧くださいね‼️
+    def _build_title_repair_messages(self, title: str) -> List[dict]:
+        """商品名の修正に使うメッセージを作成する"""
+        prompt = f"""
+以下の古着の商品名を{MAX_TITLE_LENGTH}文字以内に短くしてください。
+アイテム名と色は必ず残し、見た目・素材・柄の順に省略してください。新しい要素は追加しないでください。
+短くした商品名のみを出力してください。
 
-最後までお読みいただきありがとうございました！
-気持ちの良いお取引をどうぞよろしくお願い致します。"""
-        
-        return template
+商品名: {title}
+"""
+        return [
+            {"role": "system", "content": "あなたは古着の商品名を編集する専門AIです。"},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _accept_repaired_title(self, content: str) -> str:
+        """修正した商品名が34文字以内であれば返す（それ以外は空文字）"""
+        repaired = content.strip().strip('「」"')
+        return repaired if 0 < len(repaired) <= MAX_TITLE_LENGTH else ""
+
+    def _repair_title(self, title: str) -> str:
+        """商品名を安いモデルで34文字以内に作り直す（作り直せない場合は空文字）"""
+        try:
+            model, _ = get_usage_tracker().choose_model_and_detail(MODEL_ROUTES['title_repair'])
+            content = self._create_chat_completion(
+                'title_repair', model, self._build_title_repair_messages(title), max_tokens=100,
+                temperature=0.0, image_paths=[]
+            )
+        except Exception as e:
+            print(f"商品名修正エラー: {e}")
+            return ""
+        return self._accept_repaired_title(content)
 
-    def generate_product_info(self, image_paths: List[str], user_features_text: str) -> Optional[dict]:
+    async def _arepair_title(self, title: str) -> str:
+        """_repair_title の非同期版"""
         try:
-            if not image_paths or not user_features_text:
-                raise ValueError("画像とユーザー特徴の両方が必要です。")
+            model, _ = get_usage_tracker().choose_model_and_detail(MODEL_ROUTES['title_repair'])
+            content = await self._acreate_chat_completion(
+                'title_repair', model, self._build_title_repair_messages(title), max_tokens=100,
+                temperature=0.0, image_paths=[]
+            )
+        except Exception as e:
+            print(f"商品名修正エラー: {e}")
+            return ""
+        return self._accept_repaired_title(content)
+
+    def _split_hashtags(self, text: str) -> List[str]:
+        """#で始まる語を重複なしで取り出す"""
+        return list(dict.fromkeys(tag for tag in text.split() if tag.startswith("#")))
+
+    def _build_hashtag_messages(self, result: dict, hashtags: List[str]) -> List[dict]:
+        """ハッシュタグの補完に使うメッセージを作成する"""
+        prompt = f"""
+以下の古着の商品に付けるハッシュタグを、ちょうど{HASHTAG_COUNT}個にしてください。
+今あるハッシュタグはそのまま残し、足りない分を商品名と説明に含まれる内容のみから追加してください。
+「#タグ1 #タグ2 ...」のように、#を付けてスペース区切りで出力してください。ハッシュタグ以外は出力しないでください。
+
+商品名: {result.get("title", "")}
+説明: {result.get("description", "")}
+今あるハッシュタグ: {" ".join(hashtags)}
+"""
+        return [
+            {"role": "system", "content": "あなたは古着販売のハッシュタグを作成する専門AIです。"},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _accept_hashtags(self, content: str) -> str:
+        """補完したハッシュタグが10個以上あれば先頭から10個を返す（足りない場合はエラー）"""
+        fixed = self._split_hashtags(content)
+        if len(fixed) < HASHTAG_COUNT:
+            raise ValueError("Exactly 10 hashtags required")
+        return " ".join(fixed[:HASHTAG_COUNT])
+
+    def _fix_hashtags(self, result: dict) -> str:
+        """ハッシュタグをちょうど10個にする（多い場合は先頭から10個、少ない場合は安いモデルで補う）"""
+        hashtags = self._split_hashtags(result.get("hashtags", ""))
+        if len(hashtags) >= HASHTAG_COUNT:
+            return " ".join(hashtags[:HASHTAG_COUNT])
+
+        model, _ = get_usage_tracker().choose_model_and_detail(MODEL_ROUTES['hashtags'])
+        content = self._create_chat_completion(
+            'hashtags', model, self._build_hashtag_messages(result, hashtags), max_tokens=200,
+            temperature=0.2, image_paths=[]
+        )
+        return self._accept_hashtags(content)
+
+    async def _afix_hashtags(self, result: dict) -> str:
+        """_fix_hashtags の非同期版"""
+        hashtags = self._split_hashtags(result.get("hashtags", ""))
+        if len(hashtags) >= HASHTAG_COUNT:
+            return " ".join(hashtags[:HASHTAG_COUNT])
+
+        model, _ = get_usage_tracker().choose_model_and_detail(MODEL_ROUTES['hashtags'])
+        content = await self._acreate_chat_completion(
+            'hashtags', model, self._build_hashtag_messages(result, hashtags), max_tokens=200,
+            temperature=0.2, image_paths=[]
+        )
+        return self._accept_hashtags(content)
+
+    def _decode_listing_response(self, content: str) -> Tuple[dict, str]:
+        """商品情報生成の応答（JSON）を解析し、ローカルで短縮した商品名を入れた結果と元の商品名を返す"""
+        # 応答からJSON部分を抽出
+        content = content.strip()
+        if content.startswith('```json'):
+            content = content[7:]
+        if content.endswith('```'):
+            content = content[:-3]
+        content = content.strip()
+
+        # JSONの解析を試行
+        try:
+            result = json.loads(content)
+        except json.JSONDecodeError as e:
+            print(f"JSON解析エラー: {e}")
+            print(f"応答内容: {content}")
+            # 応答がJSONでない場合、再試行を促す
+            raise ValueError("ChatGPTの応答が正しいJSON形式ではありませんでした。再試行してください。")
+
+        if not isinstance(result.get("start_price"), (int, float)):
+            raise ValueError("start_price must be a number")
+
+        # 商品名の文字数チェックと自動短縮
+        title = result.get("title", "")
+        if len(title) > MAX_TITLE_LENGTH:
+            print(f"タイトル文字数オーバー: '{title}' ({len(title)}文字)")
+            result['title'] = self._shorten_title(title)
+        return result, title
+
+    def _finish_listing(self, result: dict, original_title: str, product_type: str) -> dict:
+        """商品名の短縮結果を表示し、商品種類に応じたテンプレートを付ける"""
+        title = result['title']
+        if title != original_title:
+            if len(title) <= MAX_TITLE_LENGTH:
+                print(f"自動短縮: '{title}' ({len(title)}文字)")
+            else:
+                # エラーを発生させずに、短縮版を使用（手動調整のため）
+                print(f"短縮後も文字数オーバー: '{title}' ({len(title)}文字) - 手動調整が必要")
+
+        # 出品価格を過去の販売実績で調整して価格帯にそろえる
+        result['start_price'] = adjust_start_price(title, product_type, result['start_price'])
+
+        # 商品種類に応じたテンプレートを生成
+        result['category'] = product_type
+        result['template'] = self._generate_template(result, product_type)
+        return result
+
+    def _needs_hashtag_fix(self, result: dict) -> bool:
+        if result.get("hashtags", "").count("#") == HASHTAG_COUNT:
+            return False
+        print(f"ハッシュタグの数が{HASHTAG_COUNT}個ではありません: '{result.get('hashtags', '')}'")
+        return True
+
+    def _parse_listing_response(self, content: str, product_type: str) -> dict:
+        """商品情報生成の応答（JSON）を解析し、商品名・ハッシュタグを整えてテンプレートを付ける"""
+        result, original_title = self._decode_listing_response(content)
+        if len(result['title']) > MAX_TITLE_LENGTH:
+            # ローカルで短縮できない場合のみ安いモデルで作り直す
+            result['title'] = self._repair_title(original_title) or result['title']
+        if self._needs_hashtag_fix(result):
+            result['hashtags'] = self._fix_hashtags(result)
+        return self._finish_listing(result, original_title, product_type)
+
+    async def _aparse_listing_response(self, content: str, product_type: str) -> dict:
+        """_parse_listing_response の非同期版"""
+        result, original_title = self._decode_listing_response(content)
+        if len(result['title']) > MAX_TITLE_LENGTH:
+            result['title'] = await self._arepair_title(original_title) or result['title']
+        if self._needs_hashtag_fix(result):
+            result['hashtags'] = await self._afix_hashtags(result)
+        return self._finish_listing(result, original_title, product_type)
+
+    def _make_preview_feeder(self, product_type: str = '') -> Callable[[str], Optional[dict]]:
+        """ストリーミングの文字列を読み込み、商品名と出品価格が確定した最初の1回だけ先行通知の内容を返す関数を作る"""
+        parser = StreamingJSONFields()
+        notified = False
+
+        def feed(delta: str) -> Optional[dict]:
+            nonlocal notified
+            parser.feed(delta)
+            if notified or 'title' not in parser.fields or 'start_price' not in parser.fields:
+                return None
+            notified = True
+            return self._build_preview(parser.fields, product_type)
+
+        return feed
+
+    def _complete_listing(self, model: str, messages: List[dict], image_paths: List[str],
+                          detail: Union[str, List[str]], product_type: str,
+                          on_preview: Optional[PreviewCallback] = None) -> dict:
+        """商品情報を生成する
+
+        on_preview を指定した場合はストリーミングで受け取り、商品名と出品価格が確定した時点で
+        （説明文・ハッシュタグの生成を待たずに）{'title', 'start_price'} を渡す。
+        """
+        if on_preview is None:
+            content = self._create_chat_completion(
+                'listing', model, messages, max_tokens=1000, temperature=0.2,
+                image_paths=image_paths, detail=detail, category=product_type
+            )
+            return self._parse_listing_response(content, product_type)
 
-            # 商品種類を判定
-            product_type = self._determine_product_type(image_paths)
+        feed = self._make_preview_feeder(product_type)
 
-            # 画像をbase64エンコード
-            encoded_images = []
-            for image_path in image_paths:
-                encoded_image = self._encode_image_to_base64(image_path)
-                if encoded_image:
-                    encoded_images.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{encoded_image}"
-                        }
-                    })
+        def on_delta(delta: str):
+            preview = feed(delta)
+            if preview is None:
+                return
+            # 先行通知に失敗しても生成は継続
+            try:
+                with span('listing.preview'):
+                    on_preview(preview)
+            except Exception as e:
+                print(f"先行通知エラー: {e}")
+
+        content = self._stream_chat_completion(
+            'listing', model, messages, max_tokens=1000, temperature=0.2,
+            image_paths=image_paths, on_delta=on_delta, detail=detail, category=product_type
+        )
+        return self._parse_listing_response(content, product_type)
+
+    async def _acomplete_listing(self, model: str, messages: List[dict], image_paths: List[str],
+                                 detail: Union[str, List[str]], product_type: str,
+                                 on_preview: Optional[PreviewCallback] = None) -> dict:
+        """_complete_listing の非同期版（on_preview はコルーチン関数でもよい）"""
+        if on_preview is None:
+            content = await self._acreate_chat_completion(
+                'listing', model, messages, max_tokens=1000, temperature=0.2,
+                image_paths=image_paths, detail=detail, category=product_type
+            )
+            return await self._aparse_listing_response(content, product_type)
 
-            if not encoded_images:
-                raise ValueError("画像のエンコードに失敗しました。")
+        feed = self._make_preview_feeder(product_type)
+
+        async def on_delta(delta: str):
+            preview = feed(delta)
+            if preview is None:
+                return
+            try:
+                with span('listing.preview'):
+                    result = on_preview(preview)
+                    if inspect.isawaitable(result):
+                        await result
+            except Exception as e:
+                print(f"先行通知エラー: {e}")
+
+        content = await self._astream_chat_completion(
+            'listing', model, messages, max_tokens=1000, temperature=0.2,
+            image_paths=image_paths, on_delta=on_delta, detail=detail, category=product_type
+        )
+        return await self._aparse_listing_response(content, product_type)
+
+    def _build_preview(self, fields: dict, product_type: str = '') -> Optional[dict]:
+        """先行通知する商品名と出品価格（商品名はローカルの短縮のみ行い、出品価格は販売実績で調整する）"""
+        title = fields.get('title')
+        start_price = fields.get('start_price')
+        if not isinstance(title, str) or not title or not isinstance(start_price, (int, float)):
+            return None
+        if len(title) > MAX_TITLE_LENGTH:
+            title = self._shorten_title(title)
+        return {'title': title, 'start_price': adjust_start_price(title, product_type, start_price)}
 
+    def _generate_template(self, result: dict, product_type: str) -> str:
+        """商品種類に応じてテンプレートを生成する（templates/ のデータファイルを使用）"""
+        return get_template_engine().render(product_type, {
+            'description': result.get('description', '商品の説明が生成されませんでした'),
+            'hashtags': result.get('hashtags', '')
+        })
+
+    def _build_listing_messages(self, encoded_images: List[dict], user_features_text: str = '',
+                                examples: Optional[List[dict]] = None) -> List[dict]:
+        """商品情報の生成に使うメッセージを作成する（特徴テキストがない場合は画像のみ用のプロンプト）"""
+        if user_features_text:
             prompt = f"""
 あなたは古着販売の専門AIです。
 
@@ -292,12 +706,13 @@ class ChatGPTHandler:
 
 {{
   "title": "商品名（34文字以内、上記の形式で作成）",
+  "start_price": 数値のみ（円マークなし、以下の価格帯から最も適正な価格を選択：1980, 2980, 3980, 4980, 5980, 6980, 7980, 8980, 9980...）,
   "description": "商品の特徴が伝わる自然な日本語（敬体）で1〜2文にまとめてください。",
-  "hashtags": "#タグ1 #タグ2 #タグ3 #タグ4 #タグ5 #タグ6 #タグ7 #タグ8 #タグ9 #タグ10",
-  "start_price": 数値のみ（円マークなし、以下の価格帯から最も適正な価格を選択：1980, 2980, 3980, 4980, 5980, 6980, 7980, 8980, 9980...）
+  "hashtags": "#タグ1 #タグ2 #タグ3 #タグ4 #タグ5 #タグ6 #タグ7 #タグ8 #タグ9 #タグ10"
 }}
 
 【その他の制約】
+- 項目は必ず title → start_price → description → hashtags の順に出力してください。
 - ハッシュタグは必ず10個、#を含み、スペース区切りで出力してください。
 - タイトルは34文字以内、誇張表現（レア、超人気、美品など）は使用禁止。
 - descriptionは敬体で、煽りなし・魅力的かつ正確に。
@@ -310,103 +725,8 @@ class ChatGPTHandler:
 以上の条件を守り、画像と特徴に忠実な、魅力的な単品商品情報を生成してください。
 必ずJSON形式のみで出力してください。
 """
-
-            messages = [
-                {
-                    "role": "system", 
-                    "content": "あなたは古着販売の専門AIです。単品出品のみを対象とし、画像とテキストの特徴のみに基づいて、推測や補完を一切行わず、正確な商品情報を生成してください。必ず敬体の日本語で、魅力的かつ正確な説明を作成してください。商品名は必ず34文字以内で作成してください。"
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        }
-                    ] + encoded_images
-                }
-            ]
-
-            response = openai.ChatCompletion.create(
-                model="gpt-4o",
-                messages=messages,
-                max_tokens=1000,
-                temperature=0.2
-            )
-
-            content = response.choices[0].message.content
-            
-            # 応答からJSON部分を抽出
-            content = content.strip()
-            if content.startswith('```json'):
-                content = content[7:]
-            if content.endswith('```'):
-                content = content[:-3]
-            content = content.strip()
-            
-            # JSONの解析を試行
-            try:
-                result = json.loads(content)
-            except json.JSONDecodeError as e:
-                print(f"JSON解析エラー: {e}")
-                print(f"応答内容: {content}")
-                # 応答がJSONでない場合、再試行を促す
-                raise ValueError("ChatGPTの応答が正しいJSON形式ではありませんでした。再試行してください。")
-
-            if not isinstance(result.get("start_price"), (int, float)):
-                raise ValueError("start_price must be a number")
-            
-            # 商品名の文字数チェックと自動短縮
-            title = result.get("title", "")
-            if len(title) > 34:
-                print(f"タイトル文字数オーバー: '{title}' ({len(title)}文字)")
-                # 自動短縮処理
-                shortened_title = self._shorten_title(title)
-                if len(shortened_title) <= 34:
-                    print(f"自動短縮: '{shortened_title}' ({len(shortened_title)}文字)")
-                    result['title'] = shortened_title
-                else:
-                    print(f"短縮後も文字数オーバー: '{shortened_title}' ({len(shortened_title)}文字) - 手動調整が必要")
-                    # エラーを発生させずに、短縮版を使用（手動調整のため）
-                    result['title'] = shortened_title
-            
-            if result.get("hashtags", "").count("#") != 10:
-                raise ValueError("Exactly 10 hashtags required")
-
-            # 商品種類に応じたテンプレートを生成
-            template = self._generate_template(result, product_type)
-            result['template'] = template
-
-            return result
-
-        except Exception as e:
-            print(f"[ChatGPT Error] {e}")
-            return None
-
-    def generate_product_info_from_images_only(self, image_paths: List[str]) -> Optional[dict]:
-        """画像のみから商品情報を生成する"""
-        try:
-            if not image_paths:
-                raise ValueError("画像が必要です。")
-
-            # 商品種類を判定
-            product_type = self._determine_product_type(image_paths)
-
-            # 画像をbase64エンコード
-            encoded_images = []
-            for image_path in image_paths:
-                encoded_image = self._encode_image_to_base64(image_path)
-                if encoded_image:
-                    encoded_images.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{encoded_image}"
-                        }
-                    })
-
-            if not encoded_images:
-                raise ValueError("画像のエンコードに失敗しました。")
-
+            system_prompt = "あなたは古着販売の専門AIです。単品出品のみを対象とし、画像とテキストの特徴のみに基づいて、推測や補完を一切行わず、正確な商品情報を生成してください。必ず敬体の日本語で、魅力的かつ正確な説明を作成してください。商品名は必ず34文字以内で作成してください。"
+        else:
             prompt = f"""
 あなたは古着販売の専門AIです。
 
@@ -504,12 +824,13 @@ class ChatGPTHandler:
 
 {{
   "title": "商品名（34文字以内、上記の形式で作成）",
+  "start_price": 数値のみ（円マークなし、以下の価格帯から最も適正な価格を選択：1980, 2980, 3980, 4980, 5980, 6980, 7980, 8980, 9980...）,
   "description": "商品の特徴が伝わる自然な日本語（敬体）で1〜2文にまとめてください。",
-  "hashtags": "#タグ1 #タグ2 #タグ3 #タグ4 #タグ5 #タグ6 #タグ7 #タグ8 #タグ9 #タグ10",
-  "start_price": 数値のみ（円マークなし、以下の価格帯から最も適正な価格を選択：1980, 2980, 3980, 4980, 5980, 6980, 7980, 8980, 9980...）
+  "hashtags": "#タグ1 #タグ2 #タグ3 #タグ4 #タグ5 #タグ6 #タグ7 #タグ8 #タグ9 #タグ10"
 }}
 
 【その他の制約】
+- 項目は必ず title → start_price → description → hashtags の順に出力してください。
 - ハッシュタグは必ず10個、#を含み、スペース区切りで出力してください。
 - タイトルは34文字以内、誇張表現（レア、超人気、美品など）は使用禁止。
 - descriptionは敬体で、煽りなし・魅力的かつ正確に。
@@ -519,163 +840,179 @@ class ChatGPTHandler:
 以上の条件を守り、画像のみに忠実な、魅力的な単品商品情報を生成してください。
 必ずJSON形式のみで出力してください。
 """
+            system_prompt = "あなたは古着販売の専門AIです。単品出品のみを対象とし、画像のみに基づいて、推測や補完を一切行わず、正確な商品情報を生成してください。必ず敬体の日本語で、魅力的かつ正確な説明を作成してください。商品名は必ず34文字以内で作成してください。"
+
+        if examples:
+            prompt = self._build_listing_prompt_with_examples(examples, user_features_text)
+
+        return [
+            {
+                "role": "system",
+                "content": system_prompt
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": prompt
+                    }
+                ] + encoded_images
+            }
+        ]
+
+    def _build_listing_prompt_with_examples(self, examples: List[dict], user_features_text: str = '') -> str:
+        """過去の出品例を入れた短いプロンプトを作成する（見た目の表現一覧・商品名例の代わりに出品例を使う）"""
+        source = "画像とテキスト" if user_features_text else "画像"
+        prompt = f"""
+あなたは古着販売の専門AIです。単品出品のみを対象とします（まとめ売りやセット販売は扱いません）。
+
+【ルール】
+- 入力された{source}に含まれない要素（色、構成アイテム、素材、使用状態など）を想像で補完しない。
+- 色や状態（新品、美品など）を画像で確認できない場合は記載しない。素材はタグ画像で明確に読み取れる場合のみ出力。
+- 商品名は「ブランド　アイテム名　色　生地　柄　サイズ　見た目」の形式で、必ず{MAX_TITLE_LENGTH}文字以内。
+  色はカタカナ、サイズは「L」「34」のようにシンプルに表記し、ブランド・サイズが分からない場合は省略。
+  文字数を超える場合は 見た目 → 素材 → 柄 の順に省略。
+- 誇張表現（レア、超人気、美品など）は使用禁止。descriptionは敬体で、煽りなし・正確に1〜2文。
+- ハッシュタグは必ず{HASHTAG_COUNT}個、#を含み、スペース区切り。
+
+【似た商品の過去の出品例】
+商品名の書き方と価格帯をそろえるための参考です。内容をそのまま写さず、この商品の{source}に合わせてください。
+{format_examples_for_prompt(examples)}
+
+【出力形式】
+必ず以下のJSON形式のみを、title → start_price → description → hashtags の順に出力してください。
 
-            messages = [
-                {
-                    "role": "system", 
-                    "content": "あなたは古着販売の専門AIです。単品出品のみを対象とし、画像のみに基づいて、推測や補完を一切行わず、正確な商品情報を生成してください。必ず敬体の日本語で、魅力的かつ正確な説明を作成してください。商品名は必ず34文字以内で作成してください。"
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        }
-                    ] + encoded_images
-                }
-            ]
-
-            response = openai.ChatCompletion.create(
-                model="gpt-4o",
-                messages=messages,
-                max_tokens=1000,
-                temperature=0.2
-            )
+{{
+  "title": "商品名（{MAX_TITLE_LENGTH}文字以内）",
+  "start_price": 数値のみ（円マークなし、1980, 2980, 3980, 4980, 5980, 6980, 7980, 8980, 9980... から選択）,
+  "description": "商品の特徴が伝わる自然な日本語（敬体）で1〜2文",
+  "hashtags": "#タグ1 #タグ2 #タグ3 #タグ4 #タグ5 #タグ6 #タグ7 #タグ8 #タグ9 #タグ10"
+}}
+"""
+        if user_features_text:
+            prompt += f"""
+【入力情報】
+ユーザーが入力した特徴: {user_features_text}
+"""
+        return prompt
 
-            content = response.choices[0].message.content
-            
-            # 応答からJSON部分を抽出
-            content = content.strip()
-            if content.startswith('```json'):
-                content = content[7:]
-            if content.endswith('```'):
-                content = content[:-3]
-            content = content.strip()
-            
-            # JSONの解析を試行
-            try:
-                result = json.loads(content)
-            except json.JSONDecodeError as e:
-                print(f"JSON解析エラー: {e}")
-                print(f"応答内容: {content}")
-                # 応答がJSONでない場合、再試行を促す
-                raise ValueError("ChatGPTの応答が正しいJSON形式ではありませんでした。再試行してください。")
-
-            if not isinstance(result.get("start_price"), (int, float)):
-                raise ValueError("start_price must be a number")
-            
-            # 商品名の文字数チェックと自動短縮
-            title = result.get("title", "")
-            if len(title) > 34:
-                print(f"タイトル文字数オーバー: '{title}' ({len(title)}文字)")
-                # 自動短縮処理
-                shortened_title = self._shorten_title(title)
-                if len(shortened_title) <= 34:
-                    print(f"自動短縮: '{shortened_title}' ({len(shortened_title)}文字)")
-                    result['title'] = shortened_title
-                else:
-                    print(f"短縮後も文字数オーバー: '{shortened_title}' ({len(shortened_title)}文字) - 手動調整が必要")
-                    # エラーを発生させずに、短縮版を使用（手動調整のため）
-                    result['title'] = shortened_title
-            
-            if result.get("hashtags", "").count("#") != 10:
-                raise ValueError("Exactly 10 hashtags required")
-
-            # 商品種類に応じたテンプレートを生成
-            template = self._generate_template(result, product_type)
-            result['template'] = template
-
-            return result
+    def _prepare_listing(self, image_paths: List[str], user_features_text: str,
+                         product_type: str = '') -> Tuple[str, Union[str, List[str]], List[dict]]:
+        """商品情報の生成に使うモデル・画像の解像度（画像を選ぶ場合は画像ごと）・メッセージを決める"""
+        # 予算を超えている場合は安いモデル・低解像度の画像に切り替える
+        model, detail = get_usage_tracker().choose_model_and_detail(MODEL_ROUTES['listing'])
+
+        # 商品全体の写真とタグの写真のみ高解像度で送り、残りは低解像度で送る（上限を超えた画像は送らない）
+        if IMAGE_SELECTION:
+            detail = select_image_details(image_paths, detail)
+
+        # 画像をbase64エンコード
+        encoded_images = self._encode_images(image_paths, detail)
+
+        if not encoded_images:
+            raise ValueError("画像のエンコードに失敗しました。")
+
+        # 似た商品の過去の出品例があれば、短いプロンプトに出品例を入れる
+        with span('listing.retrieval') as tags:
+            examples = find_examples(image_paths, user_features_text, product_type)
+            tags['examples'] = len(examples)
+
+        return model, detail, self._build_listing_messages(encoded_images, user_features_text, examples)
+
+    def generate_product_info(self, image_paths: List[str], user_features_text: str,
+                              on_preview: Optional[PreviewCallback] = None) -> Optional[dict]:
+        try:
+            if not image_paths or not user_features_text:
+                raise ValueError("画像とユーザー特徴の両方が必要です。")
+
+            # 同じ画像のbase64は商品種類の判定と商品情報の生成で共有し、生成が終わったら解放する
+            with image_buffers():
+                # 商品種類を判定
+                product_type = self._determine_product_type(image_paths, user_features_text)
+                model, detail, messages = self._prepare_listing(image_paths, user_features_text, product_type)
+                return self._complete_listing(model, messages, image_paths, detail, product_type, on_preview)
+
+        except Exception as e:
+            print(f"[ChatGPT Error] {e}")
+            return None
+
+    def generate_product_info_from_images_only(self, image_paths: List[str],
+                                               on_preview: Optional[PreviewCallback] = None) -> Optional[dict]:
+        """画像のみから商品情報を生成する"""
+        try:
+            if not image_paths:
+                raise ValueError("画像が必要です。")
+
+            # 同じ画像のbase64は商品種類の判定と商品情報の生成で共有し、生成が終わったら解放する
+            with image_buffers():
+                # 商品種類を判定
+                product_type = self._determine_product_type(image_paths)
+                model, detail, messages = self._prepare_listing(image_paths, '', product_type)
+                return self._complete_listing(model, messages, image_paths, detail, product_type, on_preview)
+
+        except Exception as e:
+            print(f"[ChatGPT Error] {e}")
+            return None
+
+    async def agenerate_product_info(self, image_paths: List[str], user_features_text: str,
+                                     on_preview: Optional[PreviewCallback] = None) -> Optional[dict]:
+        """generate_product_info の非同期版"""
+        try:
+            if not image_paths or not user_features_text:
+                raise ValueError("画像とユーザー特徴の両方が必要です。")
+
+            with image_buffers():
+                product_type = await self._adetermine_product_type(image_paths, user_features_text)
+                model, detail, messages = self._prepare_listing(image_paths, user_features_text, product_type)
+                return await self._acomplete_listing(model, messages, image_paths, detail, product_type, on_preview)
 
         except Exception as e:
             print(f"[ChatGPT Error] {e}")
             return None
 
+    async def agenerate_product_info_from_images_only(self, image_paths: List[str],
+                                                      on_preview: Optional[PreviewCallback] = None) -> Optional[dict]:
+        """generate_product_info_from_images_only の非同期版"""
+        try:
+            if not image_paths:
+                raise ValueError("画像が必要です。")
+
+            with image_buffers():
+                product_type = await self._adetermine_product_type(image_paths)
+                model, detail, messages = self._prepare_listing(image_paths, '', product_type)
+                return await self._acomplete_listing(model, messages, image_paths, detail, product_type, on_preview)
+
+        except Exception as e:
+            print(f"[ChatGPT Error] {e}")
+            return None
+
+    def build_listing_batch_request(self, custom_id: str, image_paths: List[str],
+                                    user_features_text: str = '') -> Tuple[dict, dict]:
+        """商品情報の生成をBatch APIの入力（JSONLの1行）にし、(入力, 結果の解析に使う情報) を返す
+
+        商品種類の判定は通常どおり（キーワードまたは安いモデル）行い、商品情報の生成のみをバッチに入れる。
+        """
+        if not image_paths:
+            raise ValueError("画像が必要です。")
+        with image_buffers():
+            product_type = self._determine_product_type(image_paths, user_features_text)
+            model, detail, messages = self._prepare_listing(image_paths, user_features_text, product_type)
+        request = {
+            'custom_id': custom_id,
+            'method': 'POST',
+            'url': '/v1/chat/completions',
+            'body': {'model': model, 'messages': messages, 'max_tokens': 1000, 'temperature': 0.2}
+        }
+        return request, {'model': model, 'detail': detail, 'product_type': product_type}
+
+    def parse_listing_batch_result(self, body: dict, image_paths: List[str], context: dict) -> dict:
+        """Batch APIの結果（Chat Completions APIの応答）から商品情報を作る（費用はBatch APIの料金で記録）"""
+        self._record_usage('listing', context['model'], body.get('usage') or {}, image_paths,
+                           context['detail'], context['product_type'], batch=True)
+        content = body['choices'][0]['message'].get('content') or ''
+        return self._parse_listing_response(content, context['product_type'])
+
     def _shorten_title(self, title: str) -> str:
         """商品名を34文字以内に自動短縮する"""
-        if len(title) <= 34:
-            return title
-        
-        # 商品名を要素に分解
-        elements = title.split('　')
-        
-        # 優先順位に従って削除する要素を決定
-        # 1. アイテム名（必須）- 削除しない
-        # 2. ブランド（分かる場合のみ）- 削除可能
-        # 3. 色（必須）- 削除しない
-        # 4. サイズ（分かる場合のみ）- 削除可能
-        # 5. 柄（可能な限り含める）- 削除可能
-        # 6. 素材（可能な限り含める）- 削除可能
-        # 7. 見た目（余裕があれば含める）- 削除可能
-        
-        # 削除候補の要素を特定
-        removable_elements = []
-        
-        for i, element in enumerate(elements):
-            # サイズの判定（L, XL, M, S, 数字など）
-            if element in ['L', 'XL', 'M', 'S', 'LL', 'XS', 'XXL'] or element.isdigit():
-                removable_elements.append((i, element, 'size'))
-            # 見た目の判定（多様な表現に対応）
-            elif (element.endswith('感') or element.endswith('風') or 'スタイル' in element or
-                  element in ['ストリート', 'アメカジ', 'ミリタリー', 'Y2K', 'カジュアル', 'フォーマル', 'スポーツ',
-                             '和柄', '総柄', 'チェック柄', 'ストライプ', '無地', 'グラフィック', 'パッチワーク',
-                             'イタリア風', 'フレンチ', 'レトロ', 'ヴィンテージ', 'モダン', 'クラシック',
-                             'デニム風', 'レザー風', 'シルク風', 'コットン風']):
-                removable_elements.append((i, element, 'style'))
-            # 柄の判定（ストライプ、チェック、無地など）
-            elif element in ['ストライプ', 'チェック', '無地', '迷彩柄', 'ドット']:
-                removable_elements.append((i, element, 'pattern'))
-            # 素材の判定（綿、デニム、レーヨンなど）
-            elif element in ['綿', 'デニム', 'レーヨン', 'ポリエステル', 'ウール']:
-                removable_elements.append((i, element, 'material'))
-        
-        # 優先順位の低い要素から削除
-        removable_elements.sort(key=lambda x: {
-            'style': 1,      # 見た目（最優先で削除）
-            'pattern': 2,    # 柄
-            'material': 3,   # 素材
-            'size': 4        # サイズ（最後に削除）
-        }[x[2]])
-        
-        # 要素を削除して34文字以内に収める
-        elements_to_remove = []
-        for index, element, element_type in removable_elements:
-            elements_to_remove.append(index)
-        
-        # インデックスを逆順で削除
-        for index in sorted(elements_to_remove, reverse=True):
-            del elements[index]
-            
-            # 削除後の文字数をチェック
-            shortened = '　'.join(elements)
-            if len(shortened) <= 34:
-                return shortened
-        
-        # それでも34文字を超える場合は、ブランド名を削除
-        if len(elements) > 1:
-            # 最初の要素（ブランド名）を削除
-            elements = elements[1:]
-            shortened = '　'.join(elements)
-            if len(shortened) <= 34:
-                return shortened
-        
-        # さらに削除が必要な場合、見た目要素を削除
-        for i, element in enumerate(elements):
-            if (element.endswith('感') or element.endswith('風') or 'スタイル' in element or
-                element in ['ストリート', 'アメカジ', 'ミリタリー', 'Y2K', 'カジュアル', 'フォーマル', 'スポーツ',
-                           '和柄', '総柄', 'チェック柄', 'ストライプ', '無地', 'グラフィック', 'パッチワーク',
-                           'イタリア風', 'フレンチ', 'レトロ', 'ヴィンテージ', 'モダン', 'クラシック',
-                           'デニム風', 'レザー風', 'シルク風', 'コットン風']):
-                del elements[i]
-                shortened = '　'.join(elements)
-                if len(shortened) <= 34:
-                    return shortened
-                break
-        
-        # 最後の手段：アイテム名と色のみ残す
-        if len(elements) >= 2:
-            return f"{elements[0]}　{elements[1]}"
-        else:
-            return elements[0] if elements else title[:34]
-
+        return shorten_title(title, MAX_TITLE_LENGTH)
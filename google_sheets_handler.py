@@ -3,13 +3,47 @@ import base64
 from datetime import datetime
 from typing import List, Dict
 from google.oauth2.service_account import Credentials
+from google.auth.credentials import AnonymousCredentials
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
+from googleapiclient.http import MediaIoBaseUpload, HttpRequest
 import io
+import re
+import zlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 from supabase_client import upload_image_to_supabase
+from local_store import load_json_state, save_json_state
+from sheet_write_buffer import SheetWriteBuffer, journal_storage_error
+from item_index import get_item_index, extract_management_number
+from image_hash import get_image_hash_index
+from profit_calculator import (
+    PROFIT_FORMULA_MODE, build_profit_formula, build_profit_array_formula, compute_profit
+)
+from tracing import span, register_metrics_provider
+from spreadsheet_router import get_spreadsheet_router, spreadsheet_for
+from sheets_quota import get_sheets_quota
 
-# スプレッドシートの設定
-SPREADSHEET_ID = '1r9gAZZlWw40bURXOE2-BJB9OAZPEoPuN8-GZ7iD0yBA'  # あなたのスプレッドシートID
+# 売れた商品の色付け状態を記録するローカルファイル（差分更新用）
+SOLD_STATE_FILE = 'sold_state.json'
+_sold_state_lock = threading.Lock()
+
+# 売れた商品の色付け方式
+# conditional: シートごとに1つの条件付き書式ルールで色付け（販売ごとのAPI呼び出し不要）
+# row: 従来どおり売れた行ごとに背景色を設定
+SOLD_HIGHLIGHT_MODE = os.getenv('SOLD_HIGHLIGHT_MODE', 'conditional')
+
+# 売れた商品の判定式（B〜F列がすべて入力されている行）
+SOLD_CONDITION_FORMULA = '=AND($B2<>"",$C2<>"",$D2<>"",$E2<>"",$F2<>"")'
+
+# 行追加をローカルのジャーナルに記録してからまとめて反映するか（ライトビハインド）
+WRITE_BEHIND = os.getenv('SHEETS_WRITE_BEHIND', '0') == '1'
+
+# #更新 で並列に処理するシート数（APIの呼び出し回数は SHEETS_REQUESTS_PER_MINUTE で制限される）
+REFRESH_CONCURRENCY = int(os.getenv('SHEETS_REFRESH_CONCURRENCY', '4'))
+
+# Google Sheets APIの接続先（ベンチマーク用のローカルサーバーに向ける場合のみ設定）
+SHEETS_API_ENDPOINT = os.getenv('GOOGLE_SHEETS_API_ENDPOINT')
 
 # Google Sheets APIのスコープ
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
@@ -31,10 +65,27 @@ def get_credentials() -> Credentials:
         )
     return creds
 
+class TracedHttpRequest(HttpRequest):
+    """API呼び出しごとの所要時間を記録するリクエスト（例：sheets.spreadsheets.values.get）
+
+    呼び出し回数が1分あたりの上限を超える場合は、上限内に収まるまで待ってから呼び出す。
+    """
+
+    def execute(self, *args, **kwargs):
+        get_sheets_quota(self.methodId).acquire()
+        with span(self.methodId or 'sheets.request'):
+            return super().execute(*args, **kwargs)
+
 def get_sheet_service():
     """Google Sheets APIの service.spreadsheets() を返す"""
+    if SHEETS_API_ENDPOINT:
+        # ローカルの代替サーバーに接続する場合は認証なしで接続
+        service = build('sheets', 'v4', credentials=AnonymousCredentials(),
+                        client_options={'api_endpoint': SHEETS_API_ENDPOINT},
+                        requestBuilder=TracedHttpRequest)
+        return service.spreadsheets()
     creds = get_credentials()
-    service = build('sheets', 'v4', credentials=creds)
+    service = build('sheets', 'v4', credentials=creds, requestBuilder=TracedHttpRequest)
     return service.spreadsheets()
 
 def get_drive_service():
@@ -55,10 +106,9 @@ def insert_image_to_sheet(sheet, sheet_name: str, row_number: int, image_url: st
     """
     try:
         # IMAGE関数を使用して画像を表示（アスペクト比保持・セル内中央）
-        image_formula = f'=IMAGE("{image_url}", 1)'
-        body = {'values': [[image_formula]]}
+        body = {'values': [[build_image_formula(image_url)]]}
         sheet.values().update(
-            spreadsheetId=SPREADSHEET_ID,
+            spreadsheetId=spreadsheet_for(sheet_name),
             range=f'{sheet_name}!A{row_number}',
             valueInputOption='USER_ENTERED',
             body=body
@@ -69,13 +119,18 @@ def insert_image_to_sheet(sheet, sheet_name: str, row_number: int, image_url: st
         print(f"画像挿入エラー: {e}")
         return False
 
+def build_image_formula(image_url: str) -> str:
+    """画像表示用のIMAGE関数を返す"""
+    return f'=IMAGE("{image_url}", 1)'
+
 def get_or_create_sheet(sheet, management_number: str) -> str:
     """管理番号の先頭4桁をシート名として取得し、存在しない場合は作成"""
     sheet_name = management_number[:4]  # 先頭4桁を取得
     
     try:
-        # 既存のシート一覧を取得
-        spreadsheet = sheet.get(spreadsheetId=SPREADSHEET_ID).execute()
+        # 保存先のスプレッドシートのシート一覧を取得（シート名のみ）
+        spreadsheet_id = spreadsheet_for(sheet_name)
+        spreadsheet = sheet.get(spreadsheetId=spreadsheet_id, fields='sheets(properties(title))').execute()
         existing_sheets = [worksheet['properties']['title'] for worksheet in spreadsheet['sheets']]
         
         # シートが存在しない場合は作成
@@ -89,7 +144,8 @@ def get_or_create_sheet(sheet, management_number: str) -> str:
             }
             
             body = {'requests': [request]}
-            sheet.batchUpdate(spreadsheetId=SPREADSHEET_ID, body=body).execute()
+            sheet.batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
+            get_spreadsheet_router().register_sheet(sheet_name, spreadsheet_id)
             print(f"新しいシート '{sheet_name}' を作成しました")
             
             # 少し待機してからヘッダー行を追加（シート作成の完了を待つ）
@@ -121,7 +177,7 @@ def check_and_setup_headers(sheet, sheet_name: str):
     try:
         # 1行目を取得してヘッダーが存在するかチェック
         result = sheet.values().get(
-            spreadsheetId=SPREADSHEET_ID,
+            spreadsheetId=spreadsheet_for(sheet_name),
             range=f'{sheet_name}!A1:F1'
         ).execute()
         
@@ -137,56 +193,74 @@ def check_and_setup_headers(sheet, sheet_name: str):
     except Exception as e:
         print(f"ヘッダーチェックエラー: {e}")
 
-def setup_profit_formulas_for_existing_sheet(sheet, sheet_name: str):
-    """既存のシートの利益計算式を設定（必要な行のみ）"""
+def setup_profit_formulas_for_existing_sheet(sheet, sheet_name: str) -> bool:
+    """既存のシートの利益列を PROFIT_FORMULA_MODE の方式に移行する（行数に関係なく数回のAPI呼び出しで行う）
+
+    row: 全行の計算式を1回の更新で設定し直す
+    array: 行ごとの計算式を消去し、ヘッダーにARRAYFORMULAを設定する
+    local: 販売価格からローカルで計算した利益を列全体に1回で書き込む
+    """
     try:
-        # データ行を取得
-        result = sheet.values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range=f'{sheet_name}!A:F'
-        ).execute()
+        if PROFIT_FORMULA_MODE == 'array':
+            sheet.values().clear(spreadsheetId=spreadsheet_for(sheet_name), range=f'{sheet_name}!F2:F').execute()
+            sheet.values().update(
+                spreadsheetId=spreadsheet_for(sheet_name),
+                range=f'{sheet_name}!F1',
+                valueInputOption='USER_ENTERED',
+                body={'values': [[build_profit_array_formula()]]}
+            ).execute()
+            print(f"シート '{sheet_name}' の利益列をARRAYFORMULAに移行しました")
+            return True
 
-        values = result.get('values', [])
-        if len(values) > 1:  # ヘッダー行以外にデータがある場合
-            setup_count = 0
-            for i in range(1, len(values)):
-                row_number = i + 1
-                # F列（利益列）の値をチェック
-                profit_value = values[i][5] if len(values[i]) > 5 else ""
-                
-                # 数式でない場合のみ設定（空文字、数値、文字列は数式でない）
-                is_formula = (profit_value and 
-                            (profit_value.startswith('=') or 
-                             profit_value.startswith('IF(') or
-                             'E' + str(row_number) in profit_value))
-                
-                # デバッグ情報（最初の数行のみ表示）
-                if i <= 3:
-                    print(f"行 {row_number}: F列の値 = '{profit_value}', 数式判定 = {is_formula}")
-                
-                if not is_formula:
-                    setup_profit_formula(sheet, sheet_name, row_number)
-                    setup_count += 1
-            
-            if setup_count > 0:
-                print(f"シート '{sheet_name}' で {setup_count} 行の利益計算式を設定しました")
-            else:
-                print(f"シート '{sheet_name}' の利益計算式は既に設定済みです")
-            
-            # 既存データをチェックして売れた商品に色を設定
-            setup_on_edit_trigger(sheet, sheet_name)
+        last_row = _last_data_row(sheet, sheet_name)
+        if last_row < 2:
+            return True
+
+        if PROFIT_FORMULA_MODE == 'local':
+            # 販売価格（E列）を数値のまま取得
+            result = sheet.values().get(
+                spreadsheetId=spreadsheet_for(sheet_name),
+                range=f'{sheet_name}!E2:E',
+                valueRenderOption='UNFORMATTED_VALUE'
+            ).execute()
+            sale_prices = [row[0] if row else '' for row in result.get('values', [])]
+            sale_prices = (sale_prices + [''] * (last_row - 1))[:last_row - 1]
+            values = [['' if np.isnan(profit) else round(float(profit))]
+                      for profit in compute_profit(sale_prices)]
+            input_option = 'RAW'
+        else:
+            values = [[build_profit_formula(row_number)] for row_number in range(2, last_row + 1)]
+            input_option = 'USER_ENTERED'
+
+        sheet.values().update(
+            spreadsheetId=spreadsheet_for(sheet_name),
+            range=f'{sheet_name}!F2:F{last_row}',
+            valueInputOption=input_option,
+            body={'values': values}
+        ).execute()
+        print(f"シート '{sheet_name}' の {last_row - 1} 行の利益を設定しました")
+        return True
     except Exception as e:
         print(f"既存シートの利益計算式設定エラー: {e}")
+        return False
+
+def _last_data_row(sheet, sheet_name: str) -> int:
+    """商品名（B列）が入力されている最後の行の行番号"""
+    result = sheet.values().get(spreadsheetId=spreadsheet_for(sheet_name), range=f'{sheet_name}!B:B').execute()
+    return len(result.get('values', []))
 
 def setup_sheet_headers(sheet, sheet_name: str):
     """シートのヘッダー行を設定"""
     try:
         headers = ['画像', '商品名', '登録日', '販売日', '販売価格', '利益']
+        if PROFIT_FORMULA_MODE == 'array':
+            # 利益列は見出しを含めてヘッダーの計算式で表示する
+            headers[5] = build_profit_array_formula()
         body = {'values': [headers]}
         sheet.values().update(
-            spreadsheetId=SPREADSHEET_ID,
+            spreadsheetId=spreadsheet_for(sheet_name),
             range=f'{sheet_name}!A1:F1',
-            valueInputOption='RAW',
+            valueInputOption='USER_ENTERED' if PROFIT_FORMULA_MODE == 'array' else 'RAW',
             body=body
         ).execute()
         
@@ -299,7 +373,7 @@ def setup_sheet_formatting(sheet, sheet_name: str):
         ]
         
         body = {'requests': requests}
-        sheet.batchUpdate(spreadsheetId=SPREADSHEET_ID, body=body).execute()
+        sheet.batchUpdate(spreadsheetId=spreadsheet_for(sheet_name), body=body).execute()
         
         print(f"シート '{sheet_name}' の基本フォーマットを設定しました")
         
@@ -319,6 +393,13 @@ def setup_sheet_formatting(sheet, sheet_name: str):
         except Exception as price_error:
             print(f"販売価格検証設定エラー: {price_error}")
         
+        # 売れた商品の色付けを条件付き書式で設定
+        if SOLD_HIGHLIGHT_MODE == 'conditional':
+            try:
+                setup_sold_conditional_format(sheet, sheet_name)
+            except Exception as rule_error:
+                print(f"条件付き書式設定エラー: {rule_error}")
+        
         print(f"シート '{sheet_name}' のフォーマットを設定しました")
     except Exception as e:
         print(f"フォーマット設定エラー: {e}")
@@ -360,7 +441,7 @@ def setup_date_validation(sheet, sheet_name: str):
         }
         
         body = {'requests': [request]}
-        sheet.batchUpdate(spreadsheetId=SPREADSHEET_ID, body=body).execute()
+        sheet.batchUpdate(spreadsheetId=spreadsheet_for(sheet_name), body=body).execute()
         
         print(f"シート '{sheet_name}' の販売日列にカレンダー設定を追加しました")
     except Exception as e:
@@ -396,7 +477,7 @@ def setup_sale_price_validation(sheet, sheet_name: str):
         }
         
         body = {'requests': [request]}
-        sheet.batchUpdate(spreadsheetId=SPREADSHEET_ID, body=body).execute()
+        sheet.batchUpdate(spreadsheetId=spreadsheet_for(sheet_name), body=body).execute()
         
         print(f"シート '{sheet_name}' の販売価格列に数値検証を追加しました")
     except Exception as e:
@@ -405,10 +486,13 @@ def setup_sale_price_validation(sheet, sheet_name: str):
 
 def setup_on_edit_trigger(sheet, sheet_name: str):
     """販売日と販売価格が入力された時に自動的に色を変更するトリガーを設定"""
+    # 条件付き書式の場合はシート側で自動的に色が変わるため、行ごとの設定は不要
+    if SOLD_HIGHLIGHT_MODE == 'conditional':
+        return
     try:
         # 既存のデータをチェックして、売れた商品に色を設定
         result = sheet.values().get(
-            spreadsheetId=SPREADSHEET_ID,
+            spreadsheetId=spreadsheet_for(sheet_name),
             range=f'{sheet_name}!A:F'
         ).execute()
         
@@ -427,41 +511,125 @@ def setup_on_edit_trigger(sheet, sheet_name: str):
     except Exception as e:
         print(f"トリガー設定エラー: {e}")
 
-def refresh_sold_items_formatting(sheet, sheet_name: str):
-    """シート全体の売れた商品の色を更新（手動実行用）"""
+def refresh_sold_items_formatting(sheet, sheet_name: str, incremental: bool = True):
+    """シートの売れた商品の色を更新（手動実行用）
+
+    incremental=True の場合は前回の状態と比較し、販売日・販売価格・利益列（D〜F列）が
+    変化した行だけを判定・色付けする。incremental=False の場合は全行を再判定する。
+    """
     try:
-        # シート全体のデータを取得
+        # シート全体のデータを1回で取得（行ごとの取得はしない）
         result = sheet.values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range=f'{sheet_name}!A:F'
+            spreadsheetId=spreadsheet_for(sheet_name),
+            range=f'{sheet_name}!B:F'
         ).execute()
-        
+
         values = result.get('values', [])
-        updated_count = 0
-        
-        if len(values) > 1:  # ヘッダー行以外にデータがある場合
-            for i in range(1, len(values)):
-                row_number = i + 1
-                if check_and_format_sold_item(sheet, sheet_name, row_number):
-                    updated_count += 1
-        
+        data_rows = values[1:]  # ヘッダー行を除く
+
+        state = load_json_state(SOLD_STATE_FILE, {})
+        sheet_state = state.get(sheet_name, {}) if incremental else {}
+
+        # D〜F列全体のチェックサムが前回と同じなら変化なし
+        range_checksum = _sold_columns_checksum(data_rows)
+        if incremental and sheet_state.get('range_checksum') == range_checksum:
+            print(f"シート '{sheet_name}' に変更はありません（スキップ）")
+            return 0
+
+        row_checksums = sheet_state.get('row_checksums', {})
+        formatted_rows = set(sheet_state.get('formatted_rows', []))
+        new_row_checksums = {}
+        rows_to_format = []
+
+        for i, row in enumerate(data_rows):
+            row_number = i + 2
+            checksum = _sold_columns_checksum([row])
+            new_row_checksums[str(row_number)] = checksum
+            # 前回から変化のない行は判定しない
+            if row_checksums.get(str(row_number)) == checksum:
+                continue
+            if row_number not in formatted_rows and is_sold_row(row):
+                rows_to_format.append(row_number)
+
+        if rows_to_format and not setup_sold_items_formatting_bulk(sheet, sheet_name, rows_to_format):
+            return 0
+
+        formatted_rows.update(rows_to_format)
+        # 他のシートを並列に処理している場合に備え、保存直前に読み直してこのシートの状態だけを更新する
+        with _sold_state_lock:
+            state = load_json_state(SOLD_STATE_FILE, {})
+            state[sheet_name] = {
+                'range_checksum': range_checksum,
+                'row_checksums': new_row_checksums,
+                'formatted_rows': sorted(formatted_rows)
+            }
+            save_json_state(SOLD_STATE_FILE, state)
+
+        updated_count = len(rows_to_format)
         print(f"シート '{sheet_name}' で {updated_count} 件の売れた商品の色を更新しました")
         return updated_count
     except Exception as e:
         print(f"売れた商品の色更新エラー: {e}")
         return 0
 
+def refresh_all_sheets(incremental: bool = True, on_progress=None) -> Dict[str, int]:
+    """#更新 用：すべてのシートの売れた商品の色付け（ローカル計算の方式では利益列も）を並列に更新する
+
+    シートは REFRESH_CONCURRENCY 件ずつ並列に処理する。サービスはスレッド間で共有できないため、
+    スレッドごとに作成する。シートの処理が終わるたびに on_progress(完了数, シート数) を呼ぶ。
+    修復件数の合計・シート数・失敗したシート数を返す。
+    """
+    local = threading.local()
+
+    def service():
+        if not hasattr(local, 'sheet'):
+            local.sheet = get_sheet_service()
+        return local.sheet
+
+    def refresh(sheet_name: str) -> int:
+        with span('sheets.refresh_sheet', sheet=sheet_name):
+            # ローカル計算の方式では、販売価格の入力後の利益をここで書き込む
+            # （売れた行の判定には利益列が必要なため、色の更新より先に書き込む）
+            if PROFIT_FORMULA_MODE == 'local':
+                setup_profit_formulas_for_existing_sheet(service(), sheet_name)
+            return repair_sold_highlighting(service(), sheet_name, incremental=incremental)
+
+    sheet_names = get_spreadsheet_router().list_sheet_names()
+    result = {'updated': 0, 'sheets': len(sheet_names), 'failed': 0}
+    if not sheet_names:
+        return result
+
+    with span('sheets.refresh_all', sheets=len(sheet_names)):
+        with ThreadPoolExecutor(max_workers=min(REFRESH_CONCURRENCY, len(sheet_names))) as executor:
+            futures = {executor.submit(refresh, sheet_name): sheet_name for sheet_name in sheet_names}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    result['updated'] += future.result()
+                except Exception as e:
+                    print(f"シート '{futures[future]}' の更新エラー: {e}")
+                    result['failed'] += 1
+                if on_progress:
+                    on_progress(done, len(sheet_names))
+    return result
+
+def _sold_columns_checksum(rows: List[List[str]]) -> int:
+    """B〜F列の行データのうち、販売日・販売価格・利益（D〜F列）のチェックサムを計算"""
+    checksum = 0
+    for row in rows:
+        sold_columns = '\t'.join(row[2:5]) + '\n'
+        checksum = zlib.crc32(sold_columns.encode('utf-8'), checksum)
+    return checksum
+
+def is_sold_row(row: List[str]) -> bool:
+    """B〜F列の行データから、商品名・登録日・販売日・販売価格・利益がすべて入力されているか判定"""
+    return len(row) >= 5 and all(row[:5])
+
 def setup_profit_formula(sheet, sheet_name: str, row_number: int):
     """利益の自動計算式を設定"""
     try:
-        # 利益 = 販売価格 - 500 - (販売価格 * 0.1)
-        # つまり: 販売価格 * 0.9 - 500
-        # 販売価格が入力されている場合のみ計算し、空の場合は空文字を表示
-        formula = f'=IF(AND(E{row_number}<>"",ISNUMBER(E{row_number})),E{row_number}*0.9-500,"")'
-        
-        body = {'values': [[formula]]}
+        body = {'values': [[build_profit_formula(row_number)]]}
         sheet.values().update(
-            spreadsheetId=SPREADSHEET_ID,
+            spreadsheetId=spreadsheet_for(sheet_name),
             range=f'{sheet_name}!F{row_number}',
             valueInputOption='USER_ENTERED',
             body=body
@@ -505,34 +673,182 @@ def setup_sold_item_formatting(sheet, sheet_name: str, row_number: int):
         ]
         
         body = {'requests': requests}
-        sheet.batchUpdate(spreadsheetId=SPREADSHEET_ID, body=body).execute()
+        sheet.batchUpdate(spreadsheetId=spreadsheet_for(sheet_name), body=body).execute()
         
         print(f"行 {row_number} の商品が売れたことを示す色を設定しました")
     except Exception as e:
         print(f"売却商品の色設定エラー: {e}")
 
+def setup_sold_items_formatting_bulk(sheet, sheet_name: str, row_numbers: List[int]) -> bool:
+    """複数の売れた商品の行の色を1回のbatchUpdateでまとめて変更（B列からF列まで）"""
+    try:
+        sheet_id = get_sheet_id(sheet, sheet_name)
+        if sheet_id == 0:
+            print("シートIDが取得できませんでした")
+            return False
+
+        requests = [
+            {
+                'repeatCell': {
+                    'range': {
+                        'sheetId': sheet_id,
+                        'startRowIndex': row_number - 1,  # 0ベース
+                        'endRowIndex': row_number,
+                        'startColumnIndex': 1,  # B列（0ベース）
+                        'endColumnIndex': 6     # F列まで（0ベース）
+                    },
+                    'cell': {
+                        'userEnteredFormat': {
+                            'backgroundColor': {
+                                'red': 0.9,
+                                'green': 1.0,
+                                'blue': 0.9
+                            }
+                        }
+                    },
+                    'fields': 'userEnteredFormat.backgroundColor'
+                }
+            }
+            for row_number in row_numbers
+        ]
+
+        body = {'requests': requests}
+        sheet.batchUpdate(spreadsheetId=spreadsheet_for(sheet_name), body=body).execute()
+
+        print(f"シート '{sheet_name}' の {len(row_numbers)} 行に売れたことを示す色を設定しました")
+        return True
+    except Exception as e:
+        print(f"売却商品の一括色設定エラー: {e}")
+        return False
+
+def _sold_item_rule_range(sheet_id: int) -> dict:
+    """売れた商品の色付け対象範囲（2行目以降のB列からF列まで）"""
+    return {
+        'sheetId': sheet_id,
+        'startRowIndex': 1,     # ヘッダー行を除く
+        'startColumnIndex': 1,  # B列（0ベース）
+        'endColumnIndex': 6     # F列まで（0ベース）
+    }
+
+def has_sold_conditional_format(sheet, sheet_name: str) -> bool:
+    """売れた商品の条件付き書式ルールがシートに設定済みかチェック"""
+    spreadsheet = sheet.get(
+        spreadsheetId=spreadsheet_for(sheet_name),
+        fields='sheets(properties(title),conditionalFormats(booleanRule(condition)))'
+    ).execute()
+    for worksheet in spreadsheet.get('sheets', []):
+        if worksheet['properties']['title'] != sheet_name:
+            continue
+        for rule in worksheet.get('conditionalFormats', []):
+            condition = rule.get('booleanRule', {}).get('condition', {})
+            formulas = [value.get('userEnteredValue') for value in condition.get('values', [])]
+            if condition.get('type') == 'CUSTOM_FORMULA' and SOLD_CONDITION_FORMULA in formulas:
+                return True
+    return False
+
+def setup_sold_conditional_format(sheet, sheet_name: str) -> bool:
+    """売れた商品の色付けをシート単位の条件付き書式ルールで設定（設定済みの場合は何もしない）
+
+    新しくルールを追加した場合はTrueを返す。
+    """
+    try:
+        if has_sold_conditional_format(sheet, sheet_name):
+            return False
+
+        sheet_id = get_sheet_id(sheet, sheet_name)
+        if sheet_id == 0:
+            print(f"シート '{sheet_name}' のシートIDが取得できませんでした")
+            return False
+
+        request = {
+            'addConditionalFormatRule': {
+                'index': 0,
+                'rule': {
+                    'ranges': [_sold_item_rule_range(sheet_id)],
+                    'booleanRule': {
+                        'condition': {
+                            'type': 'CUSTOM_FORMULA',
+                            'values': [{'userEnteredValue': SOLD_CONDITION_FORMULA}]
+                        },
+                        'format': {
+                            'backgroundColor': {
+                                'red': 0.9,
+                                'green': 1.0,
+                                'blue': 0.9
+                            }
+                        }
+                    }
+                }
+            }
+        }
+
+        body = {'requests': [request]}
+        sheet.batchUpdate(spreadsheetId=spreadsheet_for(sheet_name), body=body).execute()
+
+        print(f"シート '{sheet_name}' に売れた商品の条件付き書式を設定しました")
+        return True
+    except Exception as e:
+        print(f"条件付き書式設定エラー: {e}")
+        return False
+
+def migrate_sold_formatting_to_conditional(sheet, sheet_name: str) -> bool:
+    """行ごとに設定した売れた商品の背景色を消去し、条件付き書式ルールに移行する"""
+    try:
+        sheet_id = get_sheet_id(sheet, sheet_name)
+        if sheet_id == 0:
+            print(f"シート '{sheet_name}' のシートIDが取得できませんでした")
+            return False
+
+        # B〜F列の背景色を一括で消去
+        request = {
+            'repeatCell': {
+                'range': _sold_item_rule_range(sheet_id),
+                'cell': {
+                    'userEnteredFormat': {}
+                },
+                'fields': 'userEnteredFormat.backgroundColor'
+            }
+        }
+        body = {'requests': [request]}
+        sheet.batchUpdate(spreadsheetId=spreadsheet_for(sheet_name), body=body).execute()
+
+        # 差分更新用の状態は不要になるため削除
+        with _sold_state_lock:
+            state = load_json_state(SOLD_STATE_FILE, {})
+            if state.pop(sheet_name, None) is not None:
+                save_json_state(SOLD_STATE_FILE, state)
+
+        setup_sold_conditional_format(sheet, sheet_name)
+        print(f"シート '{sheet_name}' の売れた商品の色を条件付き書式に移行しました")
+        return True
+    except Exception as e:
+        print(f"条件付き書式への移行エラー: {e}")
+        return False
+
+def repair_sold_highlighting(sheet, sheet_name: str, incremental: bool = True) -> int:
+    """#更新 用：売れた商品の色付けを修復し、修復件数を返す
+
+    条件付き書式の場合はルールの有無のみ確認し、ルールを追加したシート数を返す。
+    行ごとの色付けの場合は色を設定した行数を返す。
+    """
+    if SOLD_HIGHLIGHT_MODE == 'conditional':
+        return 1 if setup_sold_conditional_format(sheet, sheet_name) else 0
+    return refresh_sold_items_formatting(sheet, sheet_name, incremental=incremental)
+
 def check_and_format_sold_item(sheet, sheet_name: str, row_number: int):
     """商品の項目がすべて入力されているかチェックし、売れた場合は色を変更"""
     try:
         # 指定行のデータを取得
         result = sheet.values().get(
-            spreadsheetId=SPREADSHEET_ID,
+            spreadsheetId=spreadsheet_for(sheet_name),
             range=f'{sheet_name}!B{row_number}:F{row_number}'
         ).execute()
         
         values = result.get('values', [[]])
-        if values and len(values[0]) >= 5:
-            # B列（商品名）、C列（登録日）、D列（販売日）、E列（販売価格）、F列（利益）がすべて入力されているかチェック
-            product_name = values[0][0] if len(values[0]) > 0 else ""
-            registration_date = values[0][1] if len(values[0]) > 1 else ""
-            sale_date = values[0][2] if len(values[0]) > 2 else ""
-            sale_price = values[0][3] if len(values[0]) > 3 else ""
-            profit = values[0][4] if len(values[0]) > 4 else ""
-            
-            # すべての項目が入力されている場合のみ色をつける
-            if product_name and registration_date and sale_date and sale_price and profit:
-                setup_sold_item_formatting(sheet, sheet_name, row_number)
-                return True
+        # B列（商品名）、C列（登録日）、D列（販売日）、E列（販売価格）、F列（利益）がすべて入力されている場合のみ色をつける
+        if values and is_sold_row(values[0]):
+            setup_sold_item_formatting(sheet, sheet_name, row_number)
+            return True
         
         return False
     except Exception as e:
@@ -542,7 +858,10 @@ def check_and_format_sold_item(sheet, sheet_name: str, row_number: int):
 def get_sheet_id(sheet, sheet_name: str) -> int:
     """シート名からシートIDを取得"""
     try:
-        spreadsheet = sheet.get(spreadsheetId=SPREADSHEET_ID).execute()
+        spreadsheet = sheet.get(
+            spreadsheetId=spreadsheet_for(sheet_name),
+            fields='sheets(properties(title,sheetId))'
+        ).execute()
         for worksheet in spreadsheet['sheets']:
             if worksheet['properties']['title'] == sheet_name:
                 return worksheet['properties']['sheetId']
@@ -551,14 +870,58 @@ def get_sheet_id(sheet, sheet_name: str) -> int:
         print(f"シートID取得エラー: {e}")
         return 0
 
+def _build_row_values(title: str, registration_date: str) -> List[str]:
+    """新しい列構成で追加する行のデータを作成（画像列は空にする）"""
+    return [
+        '',  # A列：画像（後で挿入）
+        title,  # B列：商品名
+        registration_date,  # C列：登録日
+        '',  # D列：販売日（手動入力）
+        '',  # E列：販売価格（手動入力）
+        ''   # F列：利益（自動計算）
+    ]
+
+def _index_appended_item(management_number: str, sheet_name: str, row_number, product_info: Dict, image_url: str):
+    """追加した商品をローカルの索引に登録（エラーが発生しても継続）"""
+    try:
+        start_price = product_info.get('start_price')
+        get_item_index().upsert({
+            'management_number': management_number,
+            'title': product_info.get('title', ''),
+            'sheet_name': sheet_name,
+            'row_number': row_number,
+            'image_url': image_url,
+            'price': int(start_price) if isinstance(start_price, (int, float)) else None,
+            'sold': False
+        })
+    except Exception as e:
+        print(f"索引登録エラー: {e}")
+
+def _index_appended_image(management_number: str, image_paths: List[str]):
+    """追加した商品の1枚目の画像のハッシュを重複チェック用に登録（エラーが発生しても継続）"""
+    if not image_paths:
+        return
+    try:
+        get_image_hash_index().add_image(management_number, image_paths[0])
+    except Exception as e:
+        print(f"画像ハッシュ登録エラー: {e}")
+
+def _parse_row_number(updated_range: str, default: int = 2) -> int:
+    """追加結果の範囲から先頭の行番号を抽出（例：'0627!A2:F2' から 2 を取得）"""
+    if updated_range:
+        row_match = updated_range.split('!')[1].split(':')[0]
+        if row_match and row_match[0].isalpha():
+            return int(''.join(filter(str.isdigit, row_match)))
+    return default
+
 def append_row_to_sheet(sheet, image_paths: List[str], product_info: Dict[str, str], management_number: str) -> bool:
     """
     スプレッドシートに1行を追加（新しい列構成）
+
+    ライトビハインド（SHEETS_WRITE_BEHIND=1）の場合は、ローカルのジャーナルに記録した時点で
+    Trueを返し、スプレッドシートへの反映は後でシートごとにまとめて行う。
     """
     try:
-        # 管理番号の先頭4桁をシート名として取得/作成
-        sheet_name = get_or_create_sheet(sheet, management_number)
-        
         # 登録日を取得（販売日と同じ形式で統一）
         registration_date = datetime.now().strftime('%Y/%m/%d')
         
@@ -571,21 +934,28 @@ def append_row_to_sheet(sheet, image_paths: List[str], product_info: Dict[str, s
             except Exception as img_error:
                 print(f"画像アップロードエラー: {img_error}")
                 print("画像アップロードに失敗しましたが、商品データの保存は継続します")
+
+        if WRITE_BEHIND:
+            # シートへの反映はまとめて行うため、ここではジャーナルへの記録のみ
+            get_write_buffer().enqueue(management_number[:4], management_number, {
+                'management_number': management_number,
+                'title': product_info.get('title', ''),
+                'registration_date': registration_date,
+                'image_url': image_url
+            })
+            _index_appended_item(management_number, management_number[:4], None, product_info, image_url)
+            _index_appended_image(management_number, image_paths)
+            return True
+
+        # 管理番号の先頭4桁をシート名として取得/作成
+        sheet_name = get_or_create_sheet(sheet, management_number)
         
-        # 新しい列構成でデータを準備（画像列は空にする）
-        row_data = [
-            '',  # A列：画像（後で挿入）
-            product_info.get('title', ''),  # B列：商品名
-            registration_date,  # C列：登録日
-            '',  # D列：販売日（手動入力）
-            '',  # E列：販売価格（手動入力）
-            ''   # F列：利益（自動計算）
-        ]
+        row_data = _build_row_values(product_info.get('title', ''), registration_date)
 
         # データを追加
         body = {'values': [row_data]}
         result = sheet.values().append(
-            spreadsheetId=SPREADSHEET_ID,
+            spreadsheetId=spreadsheet_for(sheet_name),
             range=f'{sheet_name}!A:F',
             valueInputOption='RAW',
             insertDataOption='INSERT_ROWS',
@@ -593,20 +963,15 @@ def append_row_to_sheet(sheet, image_paths: List[str], product_info: Dict[str, s
         ).execute()
 
         # 追加された行番号を取得して利益計算式を設定
-        updated_range = result.get('updates', {}).get('updatedRange', '')
-        row_number = 2  # デフォルト値
-        if updated_range:
-            # 範囲から行番号を抽出（例：'0627!A2:F2' から 2 を取得）
-            row_match = updated_range.split('!')[1].split(':')[0]
-            if row_match and row_match[0].isalpha():
-                row_number = int(''.join(filter(str.isdigit, row_match)))
+        row_number = _parse_row_number(result.get('updates', {}).get('updatedRange', ''))
         
-        # 利益の自動計算式を設定（エラーが発生しても継続）
-        try:
-            setup_profit_formula(sheet, sheet_name, row_number)
-        except Exception as formula_error:
-            print(f"利益計算式設定エラー: {formula_error}")
-            print("利益計算式の設定に失敗しましたが、商品データの保存は完了しました")
+        # 利益の自動計算式を設定（行ごとの方式のみ、エラーが発生しても継続）
+        if PROFIT_FORMULA_MODE == 'row':
+            try:
+                setup_profit_formula(sheet, sheet_name, row_number)
+            except Exception as formula_error:
+                print(f"利益計算式設定エラー: {formula_error}")
+                print("利益計算式の設定に失敗しましたが、商品データの保存は完了しました")
         
         # 画像を挿入（エラーが発生しても継続）
         if image_url:
@@ -617,10 +982,14 @@ def append_row_to_sheet(sheet, image_paths: List[str], product_info: Dict[str, s
                 print("画像挿入に失敗しましたが、商品データの保存は完了しました")
 
         # 新しく追加された商品が売れた商品かチェック（エラーが発生しても継続）
-        try:
-            check_and_format_sold_item(sheet, sheet_name, row_number)
-        except Exception as check_error:
-            print(f"売却商品チェックエラー: {check_error}")
+        if SOLD_HIGHLIGHT_MODE != 'conditional':
+            try:
+                check_and_format_sold_item(sheet, sheet_name, row_number)
+            except Exception as check_error:
+                print(f"売却商品チェックエラー: {check_error}")
+
+        _index_appended_item(management_number, sheet_name, row_number, product_info, image_url)
+        _index_appended_image(management_number, image_paths)
 
         print(f"データをシート '{sheet_name}' に保存しました")
         return True
@@ -628,3 +997,183 @@ def append_row_to_sheet(sheet, image_paths: List[str], product_info: Dict[str, s
         print(f"データ追加エラー: {e}")
         print("商品データの保存に失敗しました")
         return False
+
+def append_rows_batch(sheet, sheet_name: str, rows: List[Dict[str, str]]) -> List[int]:
+    """
+    同じシートの複数行を1回のappendでまとめて追加し、利益計算式と画像を1回のbatchUpdateで設定する
+    追加した行の行番号のリストを返す
+    """
+    get_or_create_sheet(sheet, rows[0]['management_number'])
+
+    body = {'values': [_build_row_values(row['title'], row['registration_date']) for row in rows]}
+    result = sheet.values().append(
+        spreadsheetId=spreadsheet_for(sheet_name),
+        range=f'{sheet_name}!A:F',
+        valueInputOption='RAW',
+        insertDataOption='INSERT_ROWS',
+        body=body
+    ).execute()
+
+    first_row = _parse_row_number(result.get('updates', {}).get('updatedRange', ''))
+    row_numbers = list(range(first_row, first_row + len(rows)))
+
+    # 利益計算式と画像をまとめて設定（行の追加は完了しているため、失敗しても継続）
+    try:
+        data = [
+            {'range': f'{sheet_name}!F{row_number}', 'values': [[build_profit_formula(row_number)]]}
+            for row_number in row_numbers
+        ] if PROFIT_FORMULA_MODE == 'row' else []
+        data += [
+            {'range': f'{sheet_name}!A{row_number}', 'values': [[build_image_formula(row['image_url'])]]}
+            for row_number, row in zip(row_numbers, rows) if row.get('image_url')
+        ]
+        if data:
+            sheet.values().batchUpdate(
+                spreadsheetId=spreadsheet_for(sheet_name),
+                body={'valueInputOption': 'USER_ENTERED', 'data': data}
+            ).execute()
+    except Exception as e:
+        print(f"利益計算式・画像の一括設定エラー: {e}")
+        print("利益計算式・画像の設定に失敗しましたが、商品データの保存は完了しました")
+
+    # 索引に反映後の行番号を記録
+    try:
+        index = get_item_index()
+        for row_number, row in zip(row_numbers, rows):
+            index.set_row_number(row['management_number'], row_number)
+    except Exception as e:
+        print(f"索引の行番号更新エラー: {e}")
+
+    return row_numbers
+
+def _flush_buffered_rows(sheet_name: str, rows: List[Dict[str, str]]) -> List[int]:
+    """ジャーナルに記録された行をスプレッドシートに反映する（SheetWriteBufferから呼ばれる）"""
+    # バックグラウンドのスレッドから呼ばれるため、サービスはその都度作成する
+    return append_rows_batch(get_sheet_service(), sheet_name, rows)
+
+def _find_appended_rows(sheet_name: str, rows: List[Dict[str, str]]) -> List:
+    """反映中だった行ごとに、シートに追加済みなら行番号、なければNoneを返す（SheetWriteBufferから呼ばれる）
+
+    同じ管理番号で登録し直した商品を以前の行と取り違えないよう、商品名（B列）と登録日（C列）が
+    どちらも一致するシートの行を、後ろの行から順に割り当てる。
+    """
+    sheet = get_sheet_service()
+    get_or_create_sheet(sheet, rows[0]['management_number'])
+    result = sheet.values().get(spreadsheetId=spreadsheet_for(sheet_name), range=f'{sheet_name}!B:C').execute()
+    candidates: Dict[tuple, List[int]] = {}
+    for row_number, values in enumerate(result.get('values', []), start=1):
+        if len(values) >= 2:
+            candidates.setdefault((values[0], values[1]), []).append(row_number)
+
+    row_numbers = [None] * len(rows)
+    for i in reversed(range(len(rows))):
+        matches = candidates.get((rows[i].get('title', ''), rows[i].get('registration_date', '')))
+        if matches:
+            row_numbers[i] = matches.pop()
+    return row_numbers
+
+_write_buffer = None
+
+def get_write_buffer() -> SheetWriteBuffer:
+    """ライトビハインド用のバッファを返す（初回はジャーナルに残った未反映の行を再反映する）"""
+    global _write_buffer
+    if _write_buffer is None:
+        _write_buffer = SheetWriteBuffer(_flush_buffered_rows, verify_func=_find_appended_rows)
+        register_metrics_provider(
+            lambda: {f'write_buffer_{name}': value for name, value in _write_buffer.metrics().items()}
+        )
+        try:
+            _write_buffer.replay()
+        except Exception as e:
+            print(f"ジャーナルの再反映エラー: {e}")
+    return _write_buffer
+
+def disable_write_behind_without_persistent_journal() -> bool:
+    """ジャーナルの保存先が永続的でない場合はライトビハインドを無効にし、商品ごとにシートへ直接書き込む
+
+    無効にした場合はTrueを返す（Vercelのように一時ディレクトリがインスタンスの入れ替えで消える環境で呼ぶ）。
+    """
+    global WRITE_BEHIND
+    storage_error = journal_storage_error() if WRITE_BEHIND else None
+    if storage_error:
+        print(f"SHEETS_WRITE_BEHIND を無効にしました: {storage_error}")
+        WRITE_BEHIND = False
+    return bool(storage_error)
+
+def flush_write_buffer() -> int:
+    """ライトビハインドで未反映の行をすぐに反映し、反映した行数を返す"""
+    if not WRITE_BEHIND:
+        return 0
+    return get_write_buffer().flush()
+
+def fetch_all_sheet_values(sheet, columns: str = 'A:F', value_render_option: str = 'FORMATTED_VALUE') -> Dict[str, List[List[str]]]:
+    """すべてのスプレッドシートの全シートの指定列を取得し、シート名 → 行データの辞書を返す
+
+    スプレッドシートごとに1回のbatchGetでまとめて取得し、複数のスプレッドシートは並列に取得する。
+    """
+    def fetch(service, spreadsheet_id: str) -> Dict[str, List[List[str]]]:
+        spreadsheet = service.get(
+            spreadsheetId=spreadsheet_id,
+            fields='sheets(properties(title))'
+        ).execute()
+        sheet_names = [worksheet['properties']['title'] for worksheet in spreadsheet.get('sheets', [])]
+        if not sheet_names:
+            return {}
+
+        result = service.values().batchGet(
+            spreadsheetId=spreadsheet_id,
+            ranges=[f'{sheet_name}!{columns}' for sheet_name in sheet_names],
+            valueRenderOption=value_render_option,
+            dateTimeRenderOption='FORMATTED_STRING'
+        ).execute()
+
+        # batchGetの結果は指定した範囲と同じ順序で返る
+        return {
+            sheet_name: value_range.get('values', [])
+            for sheet_name, value_range in zip(sheet_names, result.get('valueRanges', []))
+        }
+
+    all_values: Dict[str, List[List[str]]] = {}
+    for spreadsheet_id, values in get_spreadsheet_router().map(fetch, sheet).items():
+        for sheet_name, rows in values.items():
+            if sheet_name in all_values:
+                print(f"シート '{sheet_name}' が複数のスプレッドシートにあります（{spreadsheet_id} の内容を使用）")
+            all_values[sheet_name] = rows
+    return all_values
+
+def _parse_image_url(cell: str) -> str:
+    """IMAGE関数の数式から画像URLを取り出す"""
+    match = re.search(r'IMAGE\("([^"]+)"', cell or '')
+    return match.group(1) if match else ""
+
+def rebuild_item_index(sheet) -> int:
+    """すべてのシートを読み込んでローカルの索引を作り直し、登録件数を返す"""
+    try:
+        # 画像URLを取り出すため、数式のまま取得する
+        all_values = fetch_all_sheet_values(sheet, 'A:F', value_render_option='FORMULA')
+
+        items = []
+        for sheet_name, values in all_values.items():
+            for i, row in enumerate(values[1:]):  # ヘッダー行を除く
+                row = row + [''] * (6 - len(row))
+                management_number = extract_management_number(str(row[1]))
+                if not management_number:
+                    continue
+                sale_date, sale_price = str(row[3]), str(row[4])
+                items.append({
+                    'management_number': management_number,
+                    'title': str(row[1]),
+                    'sheet_name': sheet_name,
+                    'row_number': i + 2,
+                    'image_url': _parse_image_url(str(row[0])),
+                    'sold': bool(sale_date and sale_price),
+                    'sale_date': sale_date or None,
+                    'sale_price': sale_price or None
+                })
+
+        count = get_item_index().replace_from_sheets(items)
+        print(f"索引を再構築しました（{count} 件）")
+        return count
+    except Exception as e:
+        print(f"索引の再構築エラー: {e}")
+        return 0
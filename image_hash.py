@@ -0,0 +1,190 @@
+import os
+import io
+import sys
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from local_store import connect_sqlite
+from tracing import span
+
+# 出品済み商品の1枚目の画像のハッシュを保存するSQLiteのファイル名
+HASH_INDEX_FILE = os.getenv('IMAGE_HASH_FILE', 'image_hashes.sqlite3')
+
+# 同じ商品とみなすハミング距離の上限（64ビット中）
+DUPLICATE_MAX_DISTANCE = int(os.getenv('DUPLICATE_MAX_DISTANCE', '6'))
+
+# 商品情報の生成前に重複をチェックするか
+DUPLICATE_CHECK = os.getenv('DUPLICATE_CHECK', '1') == '1'
+
+# dHashの1辺のサイズ（8 × 8 = 64ビット）
+HASH_SIZE = 8
+
+def dhash(image, hash_size: int = HASH_SIZE) -> int:
+    """画像の差分ハッシュ（dHash）を計算する（image はファイルパスまたはバイト列）
+
+    グレースケールで (hash_size + 1) × hash_size に縮小し、横に隣り合う画素の明るさの大小を1ビットにする。
+    JPEGは縮小した解像度で直接デコードする（draftモード）ため、元の画像サイズに関係なく高速に計算できる。
+    """
+    from PIL import Image
+    source = io.BytesIO(image) if isinstance(image, (bytes, bytearray)) else image
+    with span('image.dhash'):
+        with Image.open(source) as opened:
+            opened.draft('L', ((hash_size + 1) * 16, hash_size * 16))
+            return dhash_gray(opened.convert('L'), hash_size)
+
+def dhash_gray(gray, hash_size: int = HASH_SIZE) -> int:
+    """グレースケールに変換済みの画像（PILのImage）のdHashを計算する"""
+    from PIL import Image
+    pixels = np.asarray(gray.resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    value = 0
+    for byte in np.packbits(bits).tolist():
+        value = (value << 8) | byte
+    return value
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    """uint64の配列の各要素の立っているビット数"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+class ImageHashIndex:
+    """出品済み商品の1枚目の画像のハッシュ（管理番号 → dHash）
+
+    ハッシュはSQLiteに保存し、検索時はNumPyの配列に対してXORとビット数の集計で全件のハミング距離を一度に計算する。
+    """
+
+    def __init__(self, index_file: str = HASH_INDEX_FILE):
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(index_file)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS image_hashes (
+                management_number TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                updated_at REAL
+            )
+        """)
+        self._conn.commit()
+        self._hashes: Dict[str, int] = {
+            row['management_number']: int(row['hash'], 16)
+            for row in self._conn.execute('SELECT management_number, hash FROM image_hashes')
+        }
+        self._numbers: List[str] = []
+        self._array = np.zeros(0, dtype=np.uint64)
+        self._dirty = True
+
+    def add(self, management_number: str, hash_value: int) -> None:
+        """商品の画像のハッシュを登録・更新する"""
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO image_hashes (management_number, hash, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(management_number) DO UPDATE SET hash = excluded.hash, updated_at = excluded.updated_at
+            """, (management_number, f"{hash_value:016x}", time.time()))
+            self._conn.commit()
+            self._hashes[management_number] = hash_value
+            self._dirty = True
+
+    def add_image(self, management_number: str, image) -> int:
+        """画像のハッシュを計算して登録し、ハッシュを返す"""
+        hash_value = dhash(image)
+        self.add(management_number, hash_value)
+        return hash_value
+
+    def remove(self, management_number: str) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM image_hashes WHERE management_number = ?', (management_number,))
+            self._conn.commit()
+            self._hashes.pop(management_number, None)
+            self._dirty = True
+
+    def get(self, management_number: str) -> Optional[int]:
+        """登録されているハッシュを返す（未登録の場合はNone）"""
+        with self._lock:
+            return self._hashes.get(management_number)
+
+    def contains(self, management_number: str) -> bool:
+        with self._lock:
+            return management_number in self._hashes
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._hashes)
+
+    def _snapshot(self) -> Tuple[List[str], np.ndarray]:
+        """検索用の配列（登録・削除があった場合のみ作り直す）"""
+        with self._lock:
+            if self._dirty:
+                self._numbers = list(self._hashes)
+                self._array = np.fromiter((self._hashes[n] for n in self._numbers), dtype=np.uint64,
+                                          count=len(self._numbers))
+                self._dirty = False
+            return self._numbers, self._array
+
+    def find_similar(self, hash_value: int, max_distance: int = DUPLICATE_MAX_DISTANCE) -> List[Tuple[str, int]]:
+        """ハミング距離が max_distance 以下の商品を近い順に返す（管理番号, 距離）"""
+        numbers, array = self._snapshot()
+        if not numbers:
+            return []
+        distances = popcount(array ^ np.uint64(hash_value))
+        matches = np.nonzero(distances <= max_distance)[0]
+        return sorted(((numbers[i], int(distances[i])) for i in matches), key=lambda match: match[1])
+
+    def find_duplicate(self, image_paths: List[str], max_distance: int = DUPLICATE_MAX_DISTANCE,
+                       exclude: str = '') -> Optional[Tuple[str, int]]:
+        """送信された画像のいずれかと1枚目の画像が似ている出品済み商品を探す（最も近い1件、なければNone）
+
+        exclude は送信中の商品の管理番号（同じ管理番号で登録し直す場合に、自分自身を重複としない）。
+        """
+        best = None
+        with span('duplicate.check', images=len(image_paths), indexed=self.count()):
+            for image_path in image_paths:
+                try:
+                    matches = [match for match in self.find_similar(dhash(image_path), max_distance)
+                               if match[0] != exclude]
+                except Exception as e:
+                    print(f"画像ハッシュ計算エラー ({image_path}): {e}")
+                    continue
+                if matches and (best is None or matches[0][1] < best[1]):
+                    best = matches[0]
+        return best
+
+def backfill_from_item_index(limit: int = 0) -> int:
+    """ハッシュ未登録の出品済み商品の画像を索引の画像URLからダウンロードして登録し、登録件数を返す"""
+    import requests
+    from item_index import get_item_index
+
+    hash_index = get_image_hash_index()
+    added = 0
+    for item in get_item_index().list_items():
+        if limit and added >= limit:
+            break
+        if not item.get('image_url') or hash_index.contains(item['management_number']):
+            continue
+        try:
+            response = requests.get(item['image_url'], timeout=30)
+            response.raise_for_status()
+            hash_index.add_image(item['management_number'], response.content)
+            added += 1
+        except Exception as e:
+            print(f"画像ハッシュ登録エラー ({item['management_number']}): {e}")
+    return added
+
+_image_hash_index = None
+
+def get_image_hash_index() -> ImageHashIndex:
+    """画像ハッシュの索引を返す（初回のみ作成）"""
+    global _image_hash_index
+    if _image_hash_index is None:
+        _image_hash_index = ImageHashIndex()
+    return _image_hash_index
+
+if __name__ == "__main__":
+    # 使い方: python image_hash.py backfill [件数] / python image_hash.py check 画像...
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'backfill':
+        print(f"登録件数: {backfill_from_item_index(int(sys.argv[2]) if len(sys.argv) > 2 else 0)}")
+    elif command == 'check':
+        print(get_image_hash_index().find_duplicate(sys.argv[2:]))
+    else:
+        print("使い方: python image_hash.py backfill [件数] / python image_hash.py check 画像...")
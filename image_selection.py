@@ -0,0 +1,122 @@
+import os
+import sys
+from typing import Dict, List
+import numpy as np
+from tracing import span
+
+# 商品情報の生成に送る画像を選ぶか（正面の全体写真とタグの写真を高解像度、残りを低解像度で送り、上限を超えた画像は送らない）
+IMAGE_SELECTION = os.getenv('IMAGE_SELECTION', '0') == '1'
+
+# 高解像度で送る画像の枚数（1枚目は商品全体が最も大きく写った画像、2枚目は文字が最も多く写った画像）
+IMAGE_HIGH_DETAIL_COUNT = int(os.getenv('IMAGE_HIGH_DETAIL_COUNT', '2'))
+
+# 残りの画像のうち低解像度で送る枚数（スコアの高い順、-1ですべて送る）
+IMAGE_LOW_DETAIL_COUNT = int(os.getenv('IMAGE_LOW_DETAIL_COUNT', '4'))
+
+# スコアの計算に使う縮小画像の長辺のピクセル数
+SCORE_SIZE = 256
+
+# 文字の判定に使うブロックの1辺のピクセル数（縮小画像上）
+TEXT_BLOCK = 16
+
+# 輪郭とみなす隣り合う画素の明るさの差
+EDGE_THRESHOLD = 40
+
+# 文字の写った画像とみなす text_score の最小値
+TEXT_MIN_SCORE = 0.03
+
+# 背景（画像の外周の明るさの中央値）との差がこの値より大きい画素を商品とみなす
+FOREGROUND_THRESHOLD = 30
+
+def _load_gray(image_path: str) -> np.ndarray:
+    """画像をグレースケールで縮小して読み込む（JPEGは縮小した解像度で直接デコードする）"""
+    from PIL import Image
+    with Image.open(image_path) as opened:
+        opened.draft('L', (SCORE_SIZE, SCORE_SIZE))
+        gray = opened.convert('L')
+        gray.thumbnail((SCORE_SIZE, SCORE_SIZE))
+        return np.asarray(gray, dtype=np.float32)
+
+def text_score(pixels: np.ndarray) -> float:
+    """文字（タグ・ラベル）が写っていそうな度合い（0〜1）
+
+    画像を TEXT_BLOCK ピクセルのブロックに分け、細かい輪郭が多く（輪郭の画素が15〜60%）、
+    明暗の差が大きい（白地に黒い文字など）ブロックの割合を返す。生地の柄・織り目は明暗の差が小さいため数えない。
+    """
+    edges = np.zeros(pixels.shape, dtype=bool)
+    edges[:, 1:] |= np.abs(np.diff(pixels, axis=1)) > EDGE_THRESHOLD
+    edges[1:, :] |= np.abs(np.diff(pixels, axis=0)) > EDGE_THRESHOLD
+    rows, cols = pixels.shape[0] // TEXT_BLOCK, pixels.shape[1] // TEXT_BLOCK
+    if not rows or not cols:
+        return 0.0
+    shape = (rows, TEXT_BLOCK, cols, TEXT_BLOCK)
+    blocks = pixels[:rows * TEXT_BLOCK, :cols * TEXT_BLOCK].reshape(shape)
+    density = edges[:rows * TEXT_BLOCK, :cols * TEXT_BLOCK].reshape(shape).mean(axis=(1, 3))
+    contrast = blocks.std(axis=(1, 3))
+    return float(((density >= 0.15) & (density <= 0.6) & (contrast >= 50)).mean())
+
+def coverage_score(pixels: np.ndarray) -> float:
+    """商品全体が写っていそうな度合い（0〜1）
+
+    外周の明るさの中央値を背景とし、背景と異なる画素の割合に、その画素が画像の中央に収まっている割合を掛ける。
+    タグや生地の接写は画像全体が同じ被写体のため、背景との差が小さく低いスコアになる。
+    """
+    border = np.concatenate([pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]])
+    foreground = np.abs(pixels - np.median(border)) > FOREGROUND_THRESHOLD
+    if not foreground.any():
+        return 0.0
+    height, width = pixels.shape
+    center = foreground[height // 10:height - height // 10, width // 10:width - width // 10]
+    return float(foreground.mean() * center.sum() / foreground.sum())
+
+def score_images(image_paths: List[str]) -> List[Dict[str, float]]:
+    """画像ごとの {'text', 'coverage'} を返す（読み込めない画像は0）"""
+    scores = []
+    with span('image.selection_score', images=len(image_paths)):
+        for image_path in image_paths:
+            try:
+                pixels = _load_gray(image_path)
+                scores.append({'text': text_score(pixels), 'coverage': coverage_score(pixels)})
+            except Exception as e:
+                print(f"画像のスコア計算エラー ({image_path}): {e}")
+                scores.append({'text': 0.0, 'coverage': 0.0})
+    return scores
+
+def select_image_details(image_paths: List[str], detail: str = 'high',
+                         high_count: int = IMAGE_HIGH_DETAIL_COUNT,
+                         low_count: int = IMAGE_LOW_DETAIL_COUNT) -> List[str]:
+    """画像ごとに送る解像度（detail / 'low' / 'none'：送らない）を選ぶ（image_paths と同じ順）
+
+    商品全体が最も大きく写った画像、文字が最も多く写った画像（タグ）、残りを2つのスコアの大きい方の順に並べ、
+    先頭から high_count 枚を detail、続く low_count 枚を low、残りを none にする。
+    タグの写真は白いタグが背景と異なるため全体のスコアも高くなる。先にタグを除いてから全体の画像を選ぶ。
+    全体のスコアが最大の9割以上の画像（正面と背面など）は、先に送った画像（通常は正面）を選ぶ。
+    """
+    if len(image_paths) <= high_count:
+        return [detail] * len(image_paths)
+
+    scores = score_images(image_paths)
+    remaining = list(range(len(image_paths)))
+    tag = max(remaining, key=lambda i: (scores[i]['text'], -i))
+    has_tag = scores[tag]['text'] >= TEXT_MIN_SCORE
+    if has_tag:
+        remaining.remove(tag)
+    best_coverage = max(scores[i]['coverage'] for i in remaining)
+    front = next(i for i in remaining if scores[i]['coverage'] >= best_coverage * 0.9)
+    remaining.remove(front)
+    ranked = [front] + ([tag] if has_tag else [])
+    ranked.extend(sorted(remaining, key=lambda i: (-max(scores[i].values()), i)))
+
+    details = ['none'] * len(image_paths)
+    for rank, i in enumerate(ranked):
+        if rank < high_count:
+            details[i] = detail
+        elif low_count < 0 or rank < high_count + low_count:
+            details[i] = 'low'
+    return details
+
+if __name__ == "__main__":
+    # 使い方: python image_selection.py 画像...（各画像のスコアと選ばれた解像度を表示する）
+    paths = sys.argv[1:]
+    for path, score, selected in zip(paths, score_images(paths), select_image_details(paths)):
+        print(f"{path}: {selected}（全体 {score['coverage']:.2f} / 文字 {score['text']:.2f}）")
@@ -0,0 +1,119 @@
+import os
+import io
+import sys
+from typing import Dict, Iterable, Optional
+import numpy as np
+from image_hash import dhash_gray, popcount
+from tracing import span
+
+# 受け取った画像を保存する前に確認するか（壊れた画像・小さすぎる画像・ピンボケ・暗すぎる画像・ほぼ同じ画像を除く）
+IMAGE_VALIDATION = os.getenv('IMAGE_VALIDATION', '1') == '1'
+
+# 受け付ける画像の形式（PillowのImage.format）
+IMAGE_FORMATS = set(os.getenv('IMAGE_FORMATS', 'JPEG,PNG,WEBP').split(','))
+
+# 画像の短辺の最小ピクセル数（これより小さい画像は商品が読み取れないため除く）
+IMAGE_MIN_SIDE = int(os.getenv('IMAGE_MIN_SIDE', '200'))
+
+# 画像の最大ピクセル数（これより大きい画像はデコードせずに除く）
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', '50000000'))
+
+# 鮮明さ（sharpness を参照、くっきりした写真は50〜120程度）の最小値。これより小さい画像はピンボケとして除く（0で確認しない）
+# 無地の商品でも誤って除かないよう、大きくぼやけた写真のみを除く値にしている
+IMAGE_MIN_SHARPNESS = float(os.getenv('IMAGE_MIN_SHARPNESS', '10'))
+
+# 明るさの平均（0〜255）の最小値。これより暗い画像は除く（0で確認しない）
+IMAGE_MIN_BRIGHTNESS = float(os.getenv('IMAGE_MIN_BRIGHTNESS', '20'))
+
+# 同じ商品の保存済みの画像とのdHashのハミング距離がこの値以下なら、ほぼ同じ写真として除く（-1で確認しない）
+IMAGE_NEAR_DUPLICATE_DISTANCE = int(os.getenv('IMAGE_NEAR_DUPLICATE_DISTANCE', '3'))
+
+# 1商品あたりにモデルへ送る画像の最大枚数（超えた画像は保存しない。IMAGE_VALIDATION=0 の場合は制限しない）
+MAX_IMAGES_PER_ITEM = int(os.getenv('MAX_IMAGES_PER_ITEM', '8'))
+
+# 鮮明さ・明るさの計算に使う縮小画像の長辺のピクセル数
+ANALYSIS_SIZE = 256
+
+def sharpness(pixels: np.ndarray) -> float:
+    """グレースケール画像の鮮明さ（小さいほどぼやけている）
+
+    ラプラシアン（4近傍）の絶対値の上位0.5%の値を、明るさの幅（1〜99パーセンタイル）に対する割合（%）にする。
+    ラプラシアンの分散は無地の商品ほど小さくなるため、最も強いエッジの鋭さをコントラストで割って比べる。
+    """
+    if pixels.shape[0] < 3 or pixels.shape[1] < 3:
+        return 0.0
+    laplacian = (pixels[1:-1, :-2] + pixels[1:-1, 2:] + pixels[:-2, 1:-1] + pixels[2:, 1:-1]
+                 - 4 * pixels[1:-1, 1:-1])
+    low, high = np.percentile(pixels, [1, 99])
+    return float(np.percentile(np.abs(laplacian), 99.5)) / max(float(high - low), 1.0) * 100
+
+def inspect_image(content: bytes) -> Dict:
+    """画像の形式・サイズ・鮮明さ・明るさ・dHashを調べ、問題があれば 'reason' に理由を入れて返す
+
+    形式とサイズはヘッダーのみで確認し、問題がなければJPEGは縮小した解像度で直接デコードする（draftモード）ため、
+    元の画像を全画素デコードせずに確認できる。
+    """
+    from PIL import Image
+    result = {'reason': None, 'format': None, 'width': 0, 'height': 0,
+              'sharpness': None, 'brightness': None, 'hash': None}
+    with span('image.validate') as tags:
+        try:
+            with Image.open(io.BytesIO(content)) as opened:
+                result['format'] = opened.format
+                result['width'], result['height'] = opened.size
+                if opened.format not in IMAGE_FORMATS:
+                    result['reason'] = f"対応していない形式の画像です（{opened.format}）"
+                elif min(opened.size) < IMAGE_MIN_SIDE:
+                    result['reason'] = f"画像が小さすぎます（{opened.width}×{opened.height}）"
+                elif opened.width * opened.height > IMAGE_MAX_PIXELS:
+                    result['reason'] = f"画像が大きすぎます（{opened.width}×{opened.height}）"
+                else:
+                    opened.draft('L', (ANALYSIS_SIZE, ANALYSIS_SIZE))
+                    gray = opened.convert('L')
+                    gray.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+                    pixels = np.asarray(gray, dtype=np.float32)
+                    result['sharpness'] = round(sharpness(pixels), 1)
+                    result['brightness'] = round(float(pixels.mean()), 1)
+                    result['hash'] = dhash_gray(gray)
+                    if IMAGE_MIN_BRIGHTNESS and result['brightness'] < IMAGE_MIN_BRIGHTNESS:
+                        result['reason'] = "画像が暗すぎます"
+                    elif IMAGE_MIN_SHARPNESS and result['sharpness'] < IMAGE_MIN_SHARPNESS:
+                        result['reason'] = "画像がぼやけています"
+        except Exception as e:
+            result['reason'] = "画像を読み込めませんでした"
+            print(f"画像の確認エラー: {e}")
+        tags.update({key: value for key, value in result.items() if key != 'hash'})
+    return result
+
+def find_near_duplicate(hash_value: Optional[int], hashes: Iterable[Optional[int]]) -> Optional[int]:
+    """保存済みの画像のうち、ほぼ同じ写真（ハミング距離が IMAGE_NEAR_DUPLICATE_DISTANCE 以下）の番号を返す"""
+    known = [(i, h) for i, h in enumerate(hashes) if h is not None]
+    if hash_value is None or not known or IMAGE_NEAR_DUPLICATE_DISTANCE < 0:
+        return None
+    array = np.array([h for _, h in known], dtype=np.uint64)
+    distances = popcount(array ^ np.uint64(hash_value))
+    best = int(np.argmin(distances))
+    return known[best][0] if distances[best] <= IMAGE_NEAR_DUPLICATE_DISTANCE else None
+
+def validate_image(content: bytes, session_hashes: Iterable[Optional[int]] = ()) -> Dict:
+    """受け取った画像を保存してよいか確認する（問題があれば 'reason' に理由が入る）
+
+    session_hashes は同じ商品の保存済みの画像のdHash（ほぼ同じ写真の確認に使う）。
+    """
+    result = inspect_image(content)
+    if result['reason'] is None:
+        duplicate = find_near_duplicate(result['hash'], session_hashes)
+        if duplicate is not None:
+            result['reason'] = f"{duplicate + 1}枚目の画像とほぼ同じ写真です"
+    return result
+
+if __name__ == "__main__":
+    # 使い方: python image_validation.py 画像...（各画像の確認結果を表示する）
+    hashes = []
+    for path in sys.argv[1:]:
+        with open(path, 'rb') as f:
+            checked = validate_image(f.read(), hashes)
+        hashes.append(checked['hash'] if checked['reason'] is None else None)
+        print(f"{path}: {checked['reason'] or 'OK'} "
+              f"({checked['format']} {checked['width']}×{checked['height']}, "
+              f"鮮明さ {checked['sharpness']}, 明るさ {checked['brightness']})")
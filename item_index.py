@@ -0,0 +1,157 @@
+import os
+import re
+import time
+import threading
+from typing import Dict, List, Optional
+from local_store import connect_sqlite
+
+# 出品済み商品の索引（管理番号 → 商品情報）を保存するSQLiteのファイル名
+INDEX_FILE = os.getenv('ITEM_INDEX_FILE', 'item_index.sqlite3')
+
+# 索引に保存する項目
+ITEM_FIELDS = ['management_number', 'title', 'sheet_name', 'row_number', 'image_url',
+               'price', 'sold', 'sale_date', 'sale_price']
+
+def extract_management_number(title: str) -> str:
+    """商品名の最後6文字から管理番号を取り出す（管理番号で終わらない場合は空文字）"""
+    match = re.search(r'(\d{6})$', title.strip())
+    return match.group(1) if match else ""
+
+class ItemIndex:
+    """管理番号をキーにした出品済み商品のローカル索引（スプレッドシートを読まずに検索するため）"""
+
+    def __init__(self, index_file: str = INDEX_FILE):
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(index_file)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                management_number TEXT PRIMARY KEY,
+                title TEXT,
+                sheet_name TEXT,
+                row_number INTEGER,
+                image_url TEXT,
+                price INTEGER,
+                sold INTEGER NOT NULL DEFAULT 0,
+                sale_date TEXT,
+                sale_price TEXT,
+                updated_at REAL
+            )
+        """)
+        self._conn.commit()
+
+    def upsert(self, item: Dict) -> None:
+        """商品を1件登録・更新する"""
+        self.upsert_many([item])
+
+    def upsert_many(self, items: List[Dict]) -> None:
+        """複数の商品をまとめて登録・更新する（値がNoneの項目は既存の値を残す）"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("""
+                INSERT INTO items (management_number, title, sheet_name, row_number, image_url,
+                                   price, sold, sale_date, sale_price, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(management_number) DO UPDATE SET
+                    title = COALESCE(excluded.title, items.title),
+                    sheet_name = COALESCE(excluded.sheet_name, items.sheet_name),
+                    row_number = COALESCE(excluded.row_number, items.row_number),
+                    image_url = COALESCE(excluded.image_url, items.image_url),
+                    price = COALESCE(excluded.price, items.price),
+                    sold = excluded.sold,
+                    sale_date = COALESCE(excluded.sale_date, items.sale_date),
+                    sale_price = COALESCE(excluded.sale_price, items.sale_price),
+                    updated_at = excluded.updated_at
+            """, [
+                (item['management_number'], item.get('title'), item.get('sheet_name'),
+                 item.get('row_number'), item.get('image_url'), item.get('price'),
+                 1 if item.get('sold') else 0, item.get('sale_date'), item.get('sale_price'), now)
+                for item in items
+            ])
+            self._conn.commit()
+
+    def set_row_number(self, management_number: str, row_number: int) -> None:
+        """行番号を更新する（ライトビハインドで反映された後に呼ばれる）"""
+        with self._lock:
+            self._conn.execute(
+                'UPDATE items SET row_number = ?, updated_at = ? WHERE management_number = ?',
+                (row_number, time.time(), management_number)
+            )
+            self._conn.commit()
+
+    def replace_from_sheets(self, items: List[Dict]) -> int:
+        """スプレッドシートから読み込んだ商品で索引を作り直し、登録件数を返す
+
+        シートから消えた商品は削除する。ただし、まだシートに反映されていない商品（行番号なし）は残す。
+        """
+        self.upsert_many(items)
+        seen = {item['management_number'] for item in items}
+        with self._lock:
+            existing = self._conn.execute(
+                'SELECT management_number FROM items WHERE row_number IS NOT NULL'
+            ).fetchall()
+            stale = [(row['management_number'],) for row in existing if row['management_number'] not in seen]
+            self._conn.executemany('DELETE FROM items WHERE management_number = ?', stale)
+            self._conn.commit()
+        return len(items)
+
+    def remove_sheets(self, sheet_names: List[str]) -> int:
+        """指定したシートの商品を索引から削除し、削除件数を返す（シートをアーカイブした後に呼ばれる）"""
+        with self._lock:
+            cursor = self._conn.executemany('DELETE FROM items WHERE sheet_name = ?',
+                                            [(sheet_name,) for sheet_name in sheet_names])
+            self._conn.commit()
+        return cursor.rowcount
+
+    def lookup(self, management_number: str) -> Optional[Dict]:
+        """管理番号から商品を検索する（見つからない場合はNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM items WHERE management_number = ?', (management_number,)
+            ).fetchone()
+        if row is None:
+            return None
+        item = {field: row[field] for field in ITEM_FIELDS}
+        item['sold'] = bool(item['sold'])
+        return item
+
+    def list_items(self) -> List[Dict]:
+        """索引に登録されているすべての商品を返す"""
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM items ORDER BY management_number').fetchall()
+        items = []
+        for row in rows:
+            item = {field: row[field] for field in ITEM_FIELDS}
+            item['sold'] = bool(item['sold'])
+            items.append(item)
+        return items
+
+    def count(self) -> int:
+        """索引に登録されている商品数を返す"""
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+def format_item_for_reply(item: Dict) -> str:
+    """検索結果をLINEの返信用テキストにする"""
+    lines = [f"🔎 {item['management_number']}", f"商品名: {item.get('title') or '-'}"]
+    if item.get('row_number'):
+        lines.append(f"シート: {item.get('sheet_name')}（{item['row_number']}行目）")
+    else:
+        lines.append(f"シート: {item.get('sheet_name')}（反映待ち）")
+    if item.get('price'):
+        lines.append(f"出品価格: {item['price']}円")
+    if item.get('sold'):
+        lines.append(f"状態: 売却済み（{item.get('sale_date') or '-'} / {item.get('sale_price') or '-'}円）")
+    else:
+        lines.append("状態: 在庫あり")
+    if item.get('image_url'):
+        lines.append(f"画像: {item['image_url']}")
+    return "\n".join(lines)
+
+_item_index = None
+
+def get_item_index() -> ItemIndex:
+    """索引のインスタンスを返す（初回のみ作成）"""
+    global _item_index
+    if _item_index is None:
+        _item_index = ItemIndex()
+    return _item_index
@@ -0,0 +1,277 @@
+import os
+import sys
+import time
+import zlib
+import threading
+import unicodedata
+from typing import Dict, List, Optional
+import numpy as np
+from local_store import connect_sqlite
+from image_hash import dhash, popcount, get_image_hash_index
+
+# 生成した商品情報（過去の出品例）を保存するSQLiteのファイル名
+LISTING_INDEX_FILE = os.getenv('LISTING_INDEX_FILE', 'listing_examples.sqlite3')
+
+# 商品情報の生成時に過去の出品例をプロンプトに入れるか
+LISTING_RETRIEVAL = os.getenv('LISTING_RETRIEVAL', '1') == '1'
+
+# プロンプトに入れる出品例の数と、出品例として使う類似度の下限（0〜1）
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '3'))
+RETRIEVAL_MIN_SCORE = float(os.getenv('RETRIEVAL_MIN_SCORE', '0.35'))
+
+# 類似度の重み（特徴テキスト・1枚目の画像）と、同じカテゴリーの出品例に加える値
+TEXT_WEIGHT = 0.7
+IMAGE_WEIGHT = 0.3
+CATEGORY_BONUS = 0.1
+
+# 画像の類似度を0にするdHashのハミング距離（無関係な画像どうしは平均32ビット異なるため、
+# 距離をそのまま64で割ると類似度が0.5前後になり、テキストが一致しない出品例も下限を超えてしまう）
+IMAGE_SIMILARITY_DISTANCE = 16
+
+# 特徴テキストのベクトルの次元（文字2-gram・3-gramをハッシュで振り分ける）
+TEXT_VECTOR_DIM = 1024
+
+def _normalize_text(text: str) -> str:
+    """全角・半角と大文字・小文字をそろえ、空白を除く"""
+    return ''.join(unicodedata.normalize('NFKC', text or '').lower().split())
+
+def text_vector(text: str, dim: int = TEXT_VECTOR_DIM) -> np.ndarray:
+    """特徴テキストを文字2-gram・3-gramのハッシュで固定長のベクトルにする（長さ1に正規化）"""
+    vector = np.zeros(dim, dtype=np.float32)
+    normalized = _normalize_text(text)
+    for n in (2, 3):
+        for i in range(len(normalized) - n + 1):
+            vector[zlib.crc32(normalized[i:i + n].encode('utf-8')) % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class ListingRetrievalIndex:
+    """過去に生成した商品情報の類似検索（特徴テキスト・商品名のベクトルと1枚目の画像のdHash）
+
+    出品例はSQLiteに保存し、検索時はメモリ上の行列との内積（テキスト）と、
+    uint64配列のXOR・ビット数の集計（画像）で全件の類似度を一度に計算する。
+    """
+
+    def __init__(self, index_file: str = LISTING_INDEX_FILE):
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(index_file)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS listings (
+                management_number TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                start_price INTEGER,
+                category TEXT,
+                features TEXT,
+                image_hash TEXT,
+                created_at REAL
+            )
+        """)
+        self._conn.commit()
+        self._rows: List[Dict] = []
+        self._positions: Dict[str, int] = {}
+        self._text_matrix = np.zeros((0, TEXT_VECTOR_DIM), dtype=np.float32)
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._has_hash = np.zeros(0, dtype=bool)
+        self._categories = np.zeros(0, dtype=object)
+        self._dirty = True
+
+    def add(self, management_number: str, title: str, start_price: Optional[int], category: str = '',
+            features: str = '', image_hash: Optional[int] = None) -> None:
+        """生成した商品情報を出品例として登録・更新する"""
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO listings (management_number, title, start_price, category, features, image_hash, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(management_number) DO UPDATE SET
+                    title = excluded.title,
+                    start_price = excluded.start_price,
+                    category = COALESCE(NULLIF(excluded.category, ''), listings.category),
+                    features = COALESCE(NULLIF(excluded.features, ''), listings.features),
+                    image_hash = COALESCE(excluded.image_hash, listings.image_hash),
+                    created_at = excluded.created_at
+            """, (management_number, title, start_price, category, features,
+                  f"{image_hash:016x}" if image_hash is not None else None, time.time()))
+            self._conn.commit()
+            if not self._dirty:
+                # 読み込み済みの場合は行列全体を作り直さずに1行だけ追加・更新する
+                self._update_loaded(management_number)
+
+    def _update_loaded(self, management_number: str):
+        """読み込み済みの検索用の行列に、登録した出品例を反映する（ロックを取得した状態で呼ぶ）"""
+        row = dict(self._conn.execute(
+            'SELECT management_number, title, start_price, category, features, image_hash '
+            'FROM listings WHERE management_number = ?', (management_number,)
+        ).fetchone())
+        vector = text_vector(f"{row['features'] or ''} {row['title']}")
+        hash_value = int(row['image_hash'], 16) if row['image_hash'] else 0
+        position = self._positions.get(management_number)
+        if position is None:
+            self._positions[management_number] = len(self._rows)
+            self._rows.append(row)
+            self._text_matrix = np.vstack([self._text_matrix, vector[np.newaxis, :]])
+            self._hashes = np.append(self._hashes, np.uint64(hash_value))
+            self._has_hash = np.append(self._has_hash, bool(row['image_hash']))
+            self._categories = np.append(self._categories, np.array([row['category'] or ''], dtype=object))
+        else:
+            self._rows[position] = row
+            self._text_matrix[position] = vector
+            self._hashes[position] = hash_value
+            self._has_hash[position] = bool(row['image_hash'])
+            self._categories[position] = row['category'] or ''
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM listings').fetchone()[0]
+
+    def _load(self):
+        """検索用の行列（登録があった場合のみ作り直す）"""
+        with self._lock:
+            if not self._dirty:
+                return
+            rows = [dict(row) for row in self._conn.execute(
+                'SELECT management_number, title, start_price, category, features, image_hash FROM listings'
+            )]
+            self._rows = rows
+            self._positions = {row['management_number']: i for i, row in enumerate(rows)}
+            self._text_matrix = (np.stack([text_vector(f"{row['features'] or ''} {row['title']}") for row in rows])
+                                 if rows else np.zeros((0, TEXT_VECTOR_DIM), dtype=np.float32))
+            self._hashes = np.array([int(row['image_hash'], 16) if row['image_hash'] else 0 for row in rows],
+                                    dtype=np.uint64)
+            self._has_hash = np.array([bool(row['image_hash']) for row in rows], dtype=bool)
+            self._categories = np.array([row['category'] or '' for row in rows], dtype=object)
+            self._dirty = False
+
+    def search(self, features: str = '', image_hash: Optional[int] = None, category: str = '',
+               top_k: int = RETRIEVAL_TOP_K, min_score: float = RETRIEVAL_MIN_SCORE,
+               exclude: str = '') -> List[Dict]:
+        """特徴テキスト・画像のハッシュ・カテゴリーが似ている出品例を類似度の高い順に返す"""
+        self._load()
+        if not self._rows or (not features and image_hash is None):
+            return []
+
+        scores = np.zeros(len(self._rows), dtype=np.float32)
+        weight = 0.0
+        if features:
+            scores += TEXT_WEIGHT * (self._text_matrix @ text_vector(features))
+            weight += TEXT_WEIGHT
+        if image_hash is not None:
+            distance = popcount(self._hashes ^ np.uint64(image_hash)).astype(np.float32)
+            similarity = np.clip(1.0 - distance / IMAGE_SIMILARITY_DISTANCE, 0.0, 1.0)
+            scores += IMAGE_WEIGHT * np.where(self._has_hash, similarity, 0.0).astype(np.float32)
+            weight += IMAGE_WEIGHT
+        scores /= weight
+        if category:
+            scores += CATEGORY_BONUS * (self._categories == category)
+
+        candidates = np.argsort(-scores)[:top_k + 1]
+        results = []
+        for i in candidates:
+            row = self._rows[i]
+            if scores[i] < min_score or row['management_number'] == exclude:
+                continue
+            results.append({**row, 'score': float(scores[i])})
+        return results[:top_k]
+
+def format_examples_for_prompt(examples: List[Dict]) -> str:
+    """出品例をプロンプトに入れるテキストにする"""
+    return '\n'.join(
+        f"- 商品名: {example['title']} / 出品価格: {example['start_price']}円"
+        for example in examples
+    )
+
+def backfill_from_item_index() -> int:
+    """出品済み商品の索引（商品名・出品価格）と画像ハッシュから出品例を登録し、登録件数を返す"""
+    from item_index import get_item_index
+
+    hash_index = get_image_hash_index()
+    retrieval_index = get_listing_index()
+    added = 0
+    for item in get_item_index().list_items():
+        if not item.get('title') or not item.get('price'):
+            continue
+        # 商品名の末尾は管理番号のため除く
+        title = item['title'][:-6] if item['title'].endswith(item['management_number']) else item['title']
+        retrieval_index.add(item['management_number'], title.strip(), item['price'],
+                            image_hash=hash_index.get(item['management_number']))
+        added += 1
+    return added
+
+def benchmark_search(count: int = 5000, queries: int = 200) -> dict:
+    """ランダムな出品例で索引を作り、検索の所要時間を計測する"""
+    import random
+    import tempfile
+    rng = random.Random(0)
+    brands = ['NIKE', 'adidas', 'リーバイス', 'ラルフローレン', 'パタゴニア', 'チャンピオン', 'ユニクロ', 'ノースフェイス']
+    items = ['半袖Tシャツ', 'スウェット', 'デニムパンツ', 'ジャケット', 'ニット', 'ボタンダウンシャツ', 'スニーカー']
+    colors = ['ブラック', 'ホワイト', 'ネイビー', 'グリーン', 'レッド', 'グレー']
+
+    index = ListingRetrievalIndex(os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3'))
+    for i in range(count):
+        index.add(f"{i:06d}", f"{rng.choice(brands)}　{rng.choice(items)}　{rng.choice(colors)}",
+                  rng.choice([1980, 2980, 3980, 4980]), features=f"{rng.choice(brands)} {rng.choice(items)}",
+                  image_hash=rng.getrandbits(64))
+
+    started = time.perf_counter()
+    index._load()
+    load_sec = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(queries):
+        index.search(f"{rng.choice(brands)} {rng.choice(items)} {rng.choice(colors)}", rng.getrandbits(64))
+    elapsed = time.perf_counter() - started
+    return {'items': count, 'load_sec': load_sec, 'queries': queries,
+            'ms_per_search': elapsed / queries * 1000 if queries else 0.0}
+
+_listing_index = None
+
+def get_listing_index() -> ListingRetrievalIndex:
+    """出品例の索引を返す（初回のみ作成）"""
+    global _listing_index
+    if _listing_index is None:
+        _listing_index = ListingRetrievalIndex()
+    return _listing_index
+
+def find_examples(image_paths: List[str], features: str = '', category: str = '') -> List[Dict]:
+    """商品情報の生成に使う過去の出品例を探す（エラーの場合は空のリスト）"""
+    if not LISTING_RETRIEVAL:
+        return []
+    try:
+        image_hash = dhash(image_paths[0]) if image_paths else None
+        return get_listing_index().search(features, image_hash, category)
+    except Exception as e:
+        print(f"出品例の検索エラー: {e}")
+        return []
+
+def record_listing(management_number: str, product_info: Dict, features: str = '',
+                   image_paths: Optional[List[str]] = None) -> None:
+    """保存した商品情報を出品例として登録する（エラーが発生しても継続）"""
+    try:
+        title = product_info.get('title', '')
+        # 商品名の末尾は管理番号のため除く
+        if title.endswith(management_number):
+            title = title[:-len(management_number)].strip()
+        start_price = product_info.get('start_price')
+        # 1枚目の画像のハッシュは重複チェック用に登録済みのものを使う
+        image_hash = get_image_hash_index().get(management_number)
+        if image_hash is None and image_paths:
+            image_hash = dhash(image_paths[0])
+        get_listing_index().add(
+            management_number, title,
+            int(start_price) if isinstance(start_price, (int, float)) else None,
+            category=product_info.get('category', ''),
+            features=features,
+            image_hash=image_hash
+        )
+    except Exception as e:
+        print(f"出品例の登録エラー: {e}")
+
+if __name__ == "__main__":
+    # 使い方: python listing_retrieval.py backfill / python listing_retrieval.py benchmark [件数]
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'backfill':
+        print(f"登録件数: {backfill_from_item_index()}")
+    elif command == 'benchmark':
+        for key, value in benchmark_search(int(sys.argv[2]) if len(sys.argv) > 2 else 5000).items():
+            print(f"{key}: {value}")
+    else:
+        print("使い方: python listing_retrieval.py backfill / python listing_retrieval.py benchmark [件数]")
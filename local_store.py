@@ -0,0 +1,60 @@
+import os
+import json
+import sqlite3
+import tempfile
+from typing import Any, Optional
+
+# ローカル状態ファイルの保存先（Vercelでは/tmp以下のみ書き込み可能）
+STATE_DIR = os.getenv('LOCAL_STATE_DIR', os.path.join(tempfile.gettempdir(), 'shuppin_support'))
+
+def get_state_path(filename: str) -> str:
+    """ローカル状態ファイルのパスを返す（保存先ディレクトリがなければ作成）"""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    return os.path.join(STATE_DIR, filename)
+
+def persistent_storage_error(path: str, setting: str) -> Optional[str]:
+    """保存先（ディレクトリ）が再起動後も残らない場合にその理由を返す（永続的な場合はNone）
+
+    Vercelでは一時ディレクトリ（/tmp）のみ書き込めるが、インスタンスの入れ替えで消えるため、
+    ローカルのファイルが唯一のコピーになる処理はこの確認を通った場合のみ行う。setting は理由に表示する設定名。
+    """
+    if not path:
+        return f"保存先（{setting}）が設定されていません"
+    temp_dir = os.path.realpath(tempfile.gettempdir())
+    real_path = os.path.realpath(path)
+    if real_path == temp_dir or real_path.startswith(temp_dir + os.sep):
+        return f"保存先（{setting}: {path}）は一時ディレクトリのため、再起動で消える可能性があります"
+    return None
+
+def load_json_state(filename: str, default: Any) -> Any:
+    """JSON形式の状態ファイルを読み込む（存在しない・壊れている場合はdefaultを返す）"""
+    path = get_state_path(filename)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except Exception as e:
+        print(f"状態ファイル読み込みエラー ({path}): {e}")
+        return default
+
+def save_json_state(filename: str, data: Any) -> bool:
+    """JSON形式の状態ファイルを書き込む（一時ファイル経由で置き換えて途中書き込みを防ぐ）"""
+    path = get_state_path(filename)
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        print(f"状態ファイル書き込みエラー ({path}): {e}")
+        return False
+
+def connect_sqlite(filename: str) -> sqlite3.Connection:
+    """ローカルのSQLiteデータベースに接続する（複数スレッドから利用できるように接続）"""
+    conn = sqlite3.connect(get_state_path(filename), check_same_thread=False, timeout=30)
+    conn.row_factory = sqlite3.Row
+    # 書き込み中のクラッシュでもデータが壊れないようにWALモードを使用
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
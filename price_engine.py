@@ -0,0 +1,239 @@
+import os
+import sys
+import time
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+from sheet_snapshot import SheetSnapshot, get_sheet_snapshot, title_tokens
+from tracing import span
+
+# 過去の販売実績から出品価格を調整するか（無効の場合も価格帯へのそろえのみ行う）
+PRICE_ENGINE = os.getenv('PRICE_ENGINE', '1') == '1'
+
+# 参考にする販売実績の最小件数
+PRICE_MIN_SAMPLES = int(os.getenv('PRICE_MIN_SAMPLES', '5'))
+
+# 販売価格の中央値をどれだけ信用するか（件数 / (件数 + この値) の割合で近づける）
+PRICE_PRIOR_SAMPLES = float(os.getenv('PRICE_PRIOR_SAMPLES', '10'))
+
+# 売れ行き（登録から一定日数が過ぎた商品のうち売れた割合）で価格帯を1段上下する基準
+PRICE_LOW_SELL_THROUGH = float(os.getenv('PRICE_LOW_SELL_THROUGH', '0.3'))
+PRICE_HIGH_SELL_THROUGH = float(os.getenv('PRICE_HIGH_SELL_THROUGH', '0.8'))
+SELL_THROUGH_DAYS = int(os.getenv('SELL_THROUGH_DAYS', '30'))
+
+# 出品価格の価格帯（1980, 2980, 3980...）
+PRICE_LADDER_MIN = 1980
+PRICE_LADDER_STEP = 1000
+
+def snap_to_ladder(price: float) -> int:
+    """価格を最も近い価格帯（1980, 2980, 3980...）にそろえる"""
+    steps = round((float(price) - PRICE_LADDER_MIN) / PRICE_LADDER_STEP)
+    return PRICE_LADDER_MIN + max(0, steps) * PRICE_LADDER_STEP
+
+class PriceEngine:
+    """スプレッドシートの販売実績（販売日・販売価格）から出品価格を提案する
+
+    スナップショットの列から、カテゴリー・ブランド（商品名の先頭の語）・商品名の語ごとの
+    商品の位置の配列を作っておき、提案時は該当する配列の組み合わせだけを集計する。
+    スナップショットが古くなった場合はバックグラウンドで取り直し、提案はその間も前回の内容で行う。
+    """
+
+    def __init__(self, snapshot: Optional[SheetSnapshot] = None):
+        self._snapshot = snapshot or get_sheet_snapshot()
+        self._lock = threading.Lock()
+        self._version = -1
+        self._postings: Dict[str, np.ndarray] = {}
+        self._sale_price = np.zeros(0, dtype=np.float64)
+        self._sold = np.zeros(0, dtype=bool)
+        self._matured = np.zeros(0, dtype=bool)
+        self._refreshing = False
+        self._cache_checked = False
+
+    def _rebuild(self):
+        """スナップショットの列から集計用の配列を作り直す（スナップショットが更新された場合のみ）"""
+        if self._version == self._snapshot.version:
+            return
+        with self._lock:
+            if self._version == self._snapshot.version:
+                return
+            with span('price.rebuild') as tags:
+                columns = self._snapshot.columns
+                groups: Dict[str, List[int]] = {}
+                for i, (category, title) in enumerate(zip(columns['category'], columns['title'])):
+                    tokens = title_tokens(title)
+                    keys = {f'token:{token}' for token in tokens}
+                    if tokens:
+                        keys.add(f'brand:{tokens[0]}')
+                    if category:
+                        keys.add(f'category:{category}')
+                    for key in keys:
+                        groups.setdefault(key, []).append(i)
+                self._postings = {key: np.array(rows, dtype=np.int32) for key, rows in groups.items()}
+                self._sale_price = columns['sale_price']
+                self._sold = columns['sold']
+                # 売れ行きは登録から一定日数が過ぎた商品（または売れた商品）で計算する
+                today = int(time.time() // 86400)
+                registered = columns['registered']
+                self._matured = self._sold | ((registered >= 0) & (registered <= today - SELL_THROUGH_DAYS))
+                self._version = self._snapshot.version
+                tags['items'] = len(self._sold)
+                tags['groups'] = len(self._postings)
+
+    def _refresh_in_background(self):
+        """スナップショットを取り直す（古くなった場合のみ、同時には1つだけ）"""
+        with self._lock:
+            if self._refreshing or not self._snapshot.is_stale():
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self._snapshot.refresh()
+                self._rebuild()
+            except Exception as e:
+                print(f"販売実績の取得エラー: {e}")
+                # 失敗した場合も、次の取り直しまではTTLの間隔を空ける
+                self._snapshot.fetched_at = time.time()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _ensure_snapshot(self) -> bool:
+        """初回は前回保存したスナップショットを読み込み、古い場合は取り直しを始める（生成処理は待たせない）"""
+        if not self._snapshot.loaded and not self._cache_checked:
+            self._cache_checked = True
+            self._snapshot.load_cached()
+        self._refresh_in_background()
+        return self._snapshot.loaded
+
+    def _candidate_groups(self, tokens: List[str], category: str) -> List[tuple]:
+        """販売実績を探す商品のまとまり（具体的なものから順に、(名前, 商品の位置の配列)）"""
+        groups = []
+        brand_rows = self._postings.get(f'brand:{tokens[0]}') if tokens else None
+        category_rows = self._postings.get(f'category:{category}') if category else None
+        if brand_rows is not None and category_rows is not None:
+            groups.append((f'{tokens[0]}・{category}', np.intersect1d(brand_rows, category_rows, assume_unique=True)))
+
+        # 商品名の語が2つ以上一致する商品（一致した語が多いものを優先）
+        token_rows = [self._postings[f'token:{token}'] for token in tokens if f'token:{token}' in self._postings]
+        if len(token_rows) >= 2:
+            counts = np.bincount(np.concatenate(token_rows), minlength=len(self._sold))
+            best = int(counts.max())
+            if best >= 2:
+                groups.append((f'商品名の語{best}つ一致', np.nonzero(counts == best)[0]))
+        if brand_rows is not None:
+            groups.append((tokens[0], brand_rows))
+        if category_rows is not None:
+            groups.append((category, category_rows))
+        return groups
+
+    def suggest(self, title: str, category: str = '', suggested_price: Optional[float] = None) -> Dict:
+        """商品名・カテゴリーと提案された価格（GPTの価格）から出品価格を決める
+
+        販売実績が PRICE_MIN_SAMPLES 件以上ある最も具体的なまとまりの販売価格の中央値に、
+        件数に応じて近づけ、売れ行きが悪い（良い）場合は価格帯を1段下げる（上げる）。
+        """
+        result = {'price': snap_to_ladder(suggested_price or PRICE_LADDER_MIN),
+                  'suggested_price': suggested_price, 'basis': '', 'samples': 0,
+                  'median_price': None, 'sell_through': None}
+        if not PRICE_ENGINE or not self._ensure_snapshot():
+            return result
+        self._rebuild()
+
+        for basis, rows in self._candidate_groups(title_tokens(title), category):
+            sold_rows = rows[self._sold[rows]]
+            if len(sold_rows) < PRICE_MIN_SAMPLES:
+                continue
+            median_price = float(np.median(self._sale_price[sold_rows]))
+            matured = int(self._matured[rows].sum())
+            sell_through = len(sold_rows) / matured if matured else None
+
+            # 件数が多いほど販売価格の中央値に近づける（比率で混ぜる）
+            base = suggested_price if suggested_price else median_price
+            weight = len(sold_rows) / (len(sold_rows) + PRICE_PRIOR_SAMPLES)
+            price = snap_to_ladder(np.exp(weight * np.log(median_price) + (1 - weight) * np.log(base)))
+            if sell_through is not None and matured >= PRICE_MIN_SAMPLES:
+                if sell_through < PRICE_LOW_SELL_THROUGH:
+                    price = max(PRICE_LADDER_MIN, price - PRICE_LADDER_STEP)
+                elif sell_through > PRICE_HIGH_SELL_THROUGH:
+                    price += PRICE_LADDER_STEP
+            result.update({'price': price, 'basis': basis, 'samples': len(sold_rows),
+                           'median_price': median_price, 'sell_through': sell_through})
+            break
+        return result
+
+def benchmark_suggest(count: int = 20000, queries: int = 1000) -> dict:
+    """ランダムな販売実績でスナップショットを作り、価格提案の所要時間を計測する"""
+    import random
+    import tempfile
+    from sheet_snapshot import format_day
+    rng = random.Random(0)
+    brands = ['NIKE', 'adidas', 'リーバイス', 'ラルフローレン', 'パタゴニア', 'チャンピオン', 'ユニクロ', 'ノースフェイス']
+    items = ['半袖Tシャツ', 'スウェット', 'デニムパンツ', 'ジャケット', 'ニット', 'ボタンダウンシャツ', 'スニーカー']
+    colors = ['ブラック', 'ホワイト', 'ネイビー', 'グリーン', 'レッド', 'グレー']
+    today = int(time.time() // 86400)
+
+    sheets: Dict[str, List[List]] = {}
+    for i in range(count):
+        registered = today - rng.randint(0, 365)
+        sold = rng.random() < 0.6
+        title = f"{rng.choice(brands)}　{rng.choice(items)}　{rng.choice(colors)}　{i:06d}"
+        row = ['', title, format_day(registered),
+               format_day(registered + rng.randint(1, 60)) if sold else '',
+               rng.choice([1980, 2980, 3980, 4980, 5980]) if sold else '', '']
+        sheets.setdefault(f"{i // 500:04d}", [['画像', '商品名', '登録日', '販売日', '販売価格', '利益']]).append(row)
+
+    snapshot = SheetSnapshot(os.path.join(tempfile.mkdtemp(), 'benchmark.json'))
+    started = time.perf_counter()
+    with snapshot._lock:
+        snapshot._apply(sheets, time.time())
+    load_sec = time.perf_counter() - started
+
+    engine = PriceEngine(snapshot)
+    started = time.perf_counter()
+    engine._rebuild()
+    rebuild_sec = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(queries):
+        engine.suggest(f"{rng.choice(brands)}　{rng.choice(items)}　{rng.choice(colors)}", '', 2980)
+    elapsed = time.perf_counter() - started
+    return {'items': count, 'load_sec': load_sec, 'rebuild_sec': rebuild_sec, 'queries': queries,
+            'ms_per_suggest': elapsed / queries * 1000 if queries else 0.0}
+
+_price_engine = None
+
+def get_price_engine() -> PriceEngine:
+    """価格提案のエンジンを返す（初回のみ作成）"""
+    global _price_engine
+    if _price_engine is None:
+        _price_engine = PriceEngine()
+    return _price_engine
+
+def adjust_start_price(title: str, category: str, start_price) -> int:
+    """生成した出品価格を販売実績で調整して価格帯にそろえる（エラーの場合は価格帯へのそろえのみ）"""
+    try:
+        suggestion = get_price_engine().suggest(title, category, start_price)
+        if suggestion['basis'] and suggestion['price'] != start_price:
+            print(f"出品価格を調整: {start_price}円 → {suggestion['price']}円"
+                  f"（{suggestion['basis']}: 販売{suggestion['samples']}件・中央値{suggestion['median_price']:.0f}円）")
+        return suggestion['price']
+    except Exception as e:
+        print(f"出品価格の調整エラー: {e}")
+        return snap_to_ladder(start_price)
+
+if __name__ == "__main__":
+    # 使い方: python price_engine.py suggest 商品名 [カテゴリー] [価格] / python price_engine.py benchmark [件数]
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'suggest' and len(sys.argv) > 2:
+        snapshot = get_sheet_snapshot()
+        snapshot.load_cached()
+        snapshot.refresh()
+        print(get_price_engine().suggest(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else '',
+                                         float(sys.argv[4]) if len(sys.argv) > 4 else None))
+    elif command == 'benchmark':
+        for key, value in benchmark_suggest(int(sys.argv[2]) if len(sys.argv) > 2 else 20000).items():
+            print(f"{key}: {value}")
+    else:
+        print("使い方: python price_engine.py suggest 商品名 [カテゴリー] [価格] / python price_engine.py benchmark [件数]")
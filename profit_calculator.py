@@ -0,0 +1,41 @@
+import os
+import numpy as np
+
+# 利益列（F列）の計算方式
+# row: 従来どおり行ごとに利益の計算式を設定
+# array: ヘッダー（F1）に列全体を計算するARRAYFORMULAを1つだけ設定（行ごとの設定は不要）
+# local: 利益をローカルで計算し、列全体の値を1回で書き込む（#更新・#利益移行 のときに計算し直す）
+PROFIT_FORMULA_MODE = os.getenv('PROFIT_FORMULA_MODE', 'row')
+
+# 利益の計算に使う販売手数料の割合と、1商品あたりの固定費（送料など）
+PROFIT_FEE_RATE = float(os.getenv('PROFIT_FEE_RATE', '0.1'))
+PROFIT_FIXED_COST = float(os.getenv('PROFIT_FIXED_COST', '500'))
+
+def build_profit_formula(row_number: int) -> str:
+    """指定行の利益計算式を返す"""
+    # 利益 = 販売価格 - 固定費 - (販売価格 * 手数料率)
+    # 既定値では: 販売価格 * 0.9 - 500
+    # 販売価格が入力されている場合のみ計算し、空の場合は空文字を表示
+    return (f'=IF(AND(E{row_number}<>"",ISNUMBER(E{row_number})),'
+            f'E{row_number}*{1 - PROFIT_FEE_RATE:g}-{PROFIT_FIXED_COST:g},"")')
+
+def build_profit_array_formula() -> str:
+    """ヘッダー（F1）に設定する、見出しと2行目以降の利益をまとめて表示する計算式を返す"""
+    return (f'={{"利益";ARRAYFORMULA(IF(ISNUMBER(E2:E),'
+            f'E2:E*{1 - PROFIT_FEE_RATE:g}-{PROFIT_FIXED_COST:g},""))}}')
+
+def _to_number(value) -> float:
+    """セルの値を数値にする（数値として読めない場合はNaN）"""
+    if isinstance(value, bool):
+        return np.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(',', ''))
+    except ValueError:
+        return np.nan
+
+def compute_profit(sale_prices) -> np.ndarray:
+    """販売価格の配列から利益の配列を計算する（販売価格が数値でない要素はNaN）"""
+    prices = np.array([_to_number(price) for price in sale_prices], dtype=np.float64)
+    return prices * (1 - PROFIT_FEE_RATE) - PROFIT_FIXED_COST
@@ -0,0 +1,221 @@
+import os
+import time
+import base64
+import resource
+import tempfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+from tracing import span, register_metrics_provider
+
+# LINEから受け取った画像を一時保存するディレクトリ（放置された画像を見つけて削除するため専用にする）
+IMAGE_TEMP_DIR = os.getenv('IMAGE_TEMP_DIR', os.path.join(tempfile.gettempdir(), 'shuppin_images'))
+
+# 1ユーザーが生成前に保存できる画像の合計サイズ（MB）。base64にすると約1.33倍になる
+SESSION_MAX_IMAGE_MB = float(os.getenv('SESSION_MAX_IMAGE_MB', '30'))
+
+# 最後の操作からこの秒数が経ったセッション（生成中の商品がないもの）の画像を削除する
+SESSION_TTL = float(os.getenv('SESSION_TTL', '3600'))
+
+# 放置されたセッション・画像を確認する間隔（秒）。Webhookを受け取ったときに確認する
+REAP_INTERVAL = float(os.getenv('RESOURCE_REAP_INTERVAL', '60'))
+
+# 実行中の生成で使っている画像のbase64文字列
+_current_buffers: contextvars.ContextVar = contextvars.ContextVar('image_buffers', default=None)
+
+def _read_base64(image_path: str) -> str:
+    with span('image.base64_encode'):
+        with open(image_path, "rb") as image_file:
+            return base64.b64encode(image_file.read()).decode('utf-8')
+
+def current_rss_bytes() -> int:
+    """プロセスの現在のメモリ使用量（RSS、バイト）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+def max_rss_bytes() -> int:
+    """プロセスの起動からのメモリ使用量の最大値（RSS、バイト）"""
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, current_rss_bytes())
+
+class ImageBuffers:
+    """1回の生成（商品種類の判定と商品情報の生成）で使う画像のbase64文字列
+
+    同じ画像は1回だけエンコードして各呼び出しで共有し、生成が終わったら解放する。
+    """
+
+    def __init__(self, manager: 'ResourceManager'):
+        self._manager = manager
+        self._encoded: Dict[str, str] = {}
+        self.bytes = 0
+        self.peak_bytes = 0
+
+    def encode(self, image_path: str) -> str:
+        encoded = self._encoded.get(image_path)
+        if encoded is None:
+            encoded = self._encoded[image_path] = _read_base64(image_path)
+            self.bytes += len(encoded)
+            self.peak_bytes = max(self.peak_bytes, self.bytes)
+            self._manager._track_buffers(len(encoded))
+        return encoded
+
+    def release(self):
+        self._manager._track_buffers(-self.bytes)
+        self._encoded.clear()
+        self.bytes = 0
+
+def encode_image_base64(image_path: str) -> str:
+    """画像をbase64エンコードする（生成中の場合はその生成の中で1回だけエンコードする）"""
+    buffers = _current_buffers.get()
+    if buffers is None:
+        return _read_base64(image_path)
+    return buffers.encode(image_path)
+
+@contextmanager
+def image_buffers():
+    """ブロック内の画像のbase64文字列を共有し、終了時に解放してメモリ使用量のピークを記録する
+
+    既に共有している場合（入れ子の呼び出し）はそのまま使う。
+    """
+    if _current_buffers.get() is not None:
+        yield _current_buffers.get()
+        return
+    manager = get_resource_manager()
+    buffers = ImageBuffers(manager)
+    token = _current_buffers.set(buffers)
+    try:
+        with span('image.buffers') as tags:
+            try:
+                yield buffers
+            finally:
+                tags['peak_bytes'] = buffers.peak_bytes
+                manager._record_peak(buffers.peak_bytes)
+    finally:
+        _current_buffers.reset(token)
+        buffers.release()
+
+class ResourceManager:
+    """一時保存した画像ファイルとbase64の文字列を管理する
+
+    - 画像ファイルは専用のディレクトリに作成して記録し、生成の終了時または放置されたセッションの削除時に削除する
+    - ユーザーごとに生成前に保存できる画像の合計サイズを制限する
+    - 別のプロセス（再起動前など）が残した画像も SESSION_TTL 秒が経ったら削除する
+    """
+
+    def __init__(self, temp_dir: str = IMAGE_TEMP_DIR):
+        self._temp_dir = temp_dir
+        self._lock = threading.Lock()
+        self._files: Dict[str, int] = {}
+        self._last_reap = time.time()
+        self._buffer_bytes = 0
+        self._buffer_peak_bytes = 0
+        self._last_request_peak_bytes = 0
+        self._reaped_sessions = 0
+        self._reaped_files = 0
+
+    def create_temp_image(self, content: bytes) -> str:
+        """画像を一時ファイルに保存してパスを返す"""
+        os.makedirs(self._temp_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg', dir=self._temp_dir) as f:
+            f.write(content)
+            path = f.name
+        with self._lock:
+            self._files[path] = len(content)
+        return path
+
+    def release(self, paths: Iterable[str]):
+        """一時ファイルを削除して管理の対象から外す（別の場所に移したファイルは外すだけ）"""
+        for path in paths:
+            with self._lock:
+                self._files.pop(path, None)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def accepts_image(self, session, size: int) -> bool:
+        """ユーザーの保存済みの画像に size バイトの画像を追加しても上限以内か"""
+        with self._lock:
+            held = sum(self._files.get(path, 0) for path in session.image_paths)
+        return held + size <= SESSION_MAX_IMAGE_MB * 1024 * 1024
+
+    def maybe_reap(self) -> Optional[Dict[str, int]]:
+        """前回の確認から REAP_INTERVAL 秒が経っていれば、放置されたセッションと画像を削除する"""
+        with self._lock:
+            if time.time() - self._last_reap < REAP_INTERVAL:
+                return None
+            self._last_reap = time.time()
+        try:
+            return self.reap()
+        except Exception as e:
+            print(f"放置された画像の削除エラー: {e}")
+            return None
+
+    def reap(self, ttl: float = SESSION_TTL) -> Dict[str, int]:
+        """SESSION_TTL 秒操作のないセッションの画像と、どのセッションにも属さない古い画像を削除する"""
+        from session_store import get_session_store
+
+        with span('resource.reap') as tags:
+            sessions, paths = get_session_store().reap_idle(ttl)
+            self.release(paths)
+
+            # 記録にない（別のプロセスが残した）古い画像
+            orphans = []
+            cutoff = time.time() - ttl
+            if os.path.isdir(self._temp_dir):
+                with self._lock:
+                    known = set(self._files)
+                for name in os.listdir(self._temp_dir):
+                    path = os.path.join(self._temp_dir, name)
+                    try:
+                        if path not in known and os.path.getmtime(path) < cutoff:
+                            orphans.append(path)
+                    except OSError:
+                        continue
+            self.release(orphans)
+
+            tags['sessions'] = sessions
+            tags['files'] = len(paths) + len(orphans)
+        with self._lock:
+            self._reaped_sessions += sessions
+            self._reaped_files += len(paths) + len(orphans)
+        if sessions or paths or orphans:
+            print(f"放置されたセッション {sessions} 件・画像 {len(paths) + len(orphans)} 件を削除しました")
+        return {'sessions': sessions, 'files': len(paths) + len(orphans)}
+
+    def _track_buffers(self, delta: int):
+        with self._lock:
+            self._buffer_bytes += delta
+            self._buffer_peak_bytes = max(self._buffer_peak_bytes, self._buffer_bytes)
+
+    def _record_peak(self, peak_bytes: int):
+        with self._lock:
+            self._last_request_peak_bytes = peak_bytes
+
+    def metrics(self) -> Dict[str, float]:
+        """/metrics に出力する値（一時ファイル・base64の文字列のバイト数とメモリ使用量の最大値）"""
+        with self._lock:
+            return {
+                'temp_image_files': len(self._files),
+                'temp_image_bytes': sum(self._files.values()),
+                'image_buffer_bytes': self._buffer_bytes,
+                'image_buffer_peak_bytes': self._buffer_peak_bytes,
+                'image_buffer_last_request_peak_bytes': self._last_request_peak_bytes,
+                'reaped_sessions_total': self._reaped_sessions,
+                'reaped_files_total': self._reaped_files,
+                'process_rss_bytes': current_rss_bytes(),
+                'process_max_rss_bytes': max_rss_bytes()
+            }
+
+_resource_manager = None
+
+def get_resource_manager() -> ResourceManager:
+    """一時ファイルとメモリの管理を返す（初回のみ作成）"""
+    global _resource_manager
+    if _resource_manager is None:
+        _resource_manager = ResourceManager()
+        register_metrics_provider(_resource_manager.metrics)
+    return _resource_manager
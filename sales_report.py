@@ -0,0 +1,201 @@
+import os
+import re
+import sys
+import time
+from datetime import date
+from typing import Dict, Optional
+import numpy as np
+from sheet_snapshot import get_sheet_snapshot, format_day
+
+# 集計に使うスナップショットの許容する古さ（秒）。これより古い場合のみ集計前に取り直す
+REPORT_MAX_AGE = float(os.getenv('REPORT_MAX_AGE', '300'))
+
+# 月別の集計で表示する月数
+REPORT_MONTHS = int(os.getenv('REPORT_MONTHS', '12'))
+
+# 在庫の経過日数の区切り（日）
+STOCK_AGE_BUCKETS = (30, 90, 180)
+
+def _month_keys(days: np.ndarray) -> np.ndarray:
+    """1970/1/1からの日数の配列を年月の番号（年 × 12 + 月 - 1）の配列にする"""
+    months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    # datetime64[M] は1970年1月からの月数
+    return months + 1970 * 12
+
+def _month_label(key: int) -> str:
+    return f"{key // 12}/{key % 12 + 1:02d}"
+
+def _parse_month(text: str) -> Optional[int]:
+    """'2025-07'・'2025/7'・'7' などを年月の番号にする（月のみの場合は今年）"""
+    match = re.fullmatch(r'(?:(\d{4})[-/年])?(\d{1,2})月?', text.strip())
+    if not match:
+        return None
+    year = int(match.group(1)) if match.group(1) else date.today().year
+    month = int(match.group(2))
+    return year * 12 + month - 1 if 1 <= month <= 12 else None
+
+def _category_label(category: str) -> str:
+    from template_engine import get_template_engine
+    return get_template_engine().categories.get(category, {}).get('label', category) if category else '不明'
+
+def load_report_columns(max_age: float = REPORT_MAX_AGE) -> Dict[str, np.ndarray]:
+    """集計用の列を返す（スナップショットが max_age 秒より古い場合のみ1回のbatchGetで取り直す）"""
+    snapshot = get_sheet_snapshot()
+    if not snapshot.loaded:
+        snapshot.load_cached()
+    if not snapshot.loaded or snapshot.is_stale(max_age):
+        try:
+            snapshot.refresh()
+        except Exception as e:
+            if not snapshot.loaded:
+                raise
+            print(f"スナップショットの取得エラー（前回の内容で集計します）: {e}")
+    return snapshot.columns
+
+def summarize_sales(columns: Dict[str, np.ndarray], month: Optional[int] = None) -> Dict:
+    """指定した月（年月の番号、省略時は今月）に売れた商品の件数・売上・利益とカテゴリー別の内訳"""
+    if month is None:
+        today = date.today()
+        month = today.year * 12 + today.month - 1
+    sold = columns['sold']
+    in_month = sold & (_month_keys(np.maximum(columns['sold_on'], 0)) == month)
+    prices = columns['sale_price'][in_month]
+    profits = columns['profit'][in_month]
+    categories = columns['category'][in_month]
+
+    by_category = {}
+    for category in np.unique(categories):
+        mask = categories == category
+        by_category[category] = {
+            'count': int(mask.sum()),
+            'sales': float(prices[mask].sum()),
+            'profit': float(np.nansum(profits[mask]))
+        }
+    return {
+        'month': _month_label(month),
+        'count': int(in_month.sum()),
+        'sales': float(prices.sum()),
+        'profit': float(np.nansum(profits)),
+        'avg_price': float(prices.mean()) if len(prices) else 0.0,
+        'categories': by_category
+    }
+
+def summarize_months(columns: Dict[str, np.ndarray], months: int = REPORT_MONTHS) -> Dict:
+    """直近 months か月の月別の販売件数・売上・利益・新規登録件数"""
+    today = date.today()
+    last = today.year * 12 + today.month - 1
+    first = last - months + 1
+
+    def monthly(days: np.ndarray, mask: np.ndarray, weights: Optional[np.ndarray] = None) -> np.ndarray:
+        keys = _month_keys(np.maximum(days[mask], 0)) - first
+        valid = (keys >= 0) & (keys < months)
+        return np.bincount(keys[valid], weights=None if weights is None else weights[mask][valid], minlength=months)
+
+    sold = columns['sold']
+    counts = monthly(columns['sold_on'], sold)
+    sales = monthly(columns['sold_on'], sold, columns['sale_price'])
+    profits = monthly(columns['sold_on'], sold, np.nan_to_num(columns['profit']))
+    registered = monthly(columns['registered'], columns['registered'] >= 0)
+    return {
+        'rows': [
+            {'month': _month_label(first + i), 'count': int(counts[i]), 'sales': float(sales[i]),
+             'profit': float(profits[i]), 'registered': int(registered[i])}
+            for i in range(months)
+        ]
+    }
+
+def summarize_stock(columns: Dict[str, np.ndarray]) -> Dict:
+    """売れていない商品の件数（経過日数別・カテゴリー別）と最も古い商品"""
+    today = int(time.time() // 86400)
+    unsold = ~columns['sold']
+    registered = columns['registered'][unsold]
+    ages = np.where(registered >= 0, today - registered, -1)
+    categories = columns['category'][unsold]
+
+    buckets = []
+    lower = 0
+    for upper in STOCK_AGE_BUCKETS:
+        buckets.append((f"{lower}〜{upper}日", int(((ages >= lower) & (ages <= upper)).sum())))
+        lower = upper + 1
+    buckets.append((f"{STOCK_AGE_BUCKETS[-1]}日超", int((ages >= lower).sum())))
+    if (ages < 0).any():
+        buckets.append(("登録日不明", int((ages < 0).sum())))
+
+    names, counts = np.unique(categories, return_counts=True)
+    oldest = None
+    if len(registered) and (registered >= 0).any():
+        position = np.flatnonzero(unsold)[np.argmin(np.where(registered >= 0, registered, np.iinfo(np.int32).max))]
+        oldest = {'management_number': columns['management_number'][position],
+                  'title': columns['title'][position],
+                  'registered': format_day(columns['registered'][position])}
+    return {
+        'count': int(unsold.sum()),
+        'total': len(unsold),
+        'buckets': buckets,
+        'categories': {name: int(count) for name, count in zip(names, counts)},
+        'oldest': oldest
+    }
+
+def format_sales_report(summary: Dict) -> str:
+    """月の売上をLINEの返信・CLI表示用のテキストにする"""
+    lines = [
+        f"📈 売上（{summary['month']}）",
+        f"販売: {summary['count']}件",
+        f"売上: {summary['sales']:,.0f}円（平均 {summary['avg_price']:,.0f}円）",
+        f"利益: {summary['profit']:,.0f}円"
+    ]
+    if summary['categories']:
+        lines.append("")
+        lines.append("【カテゴリー別】")
+        for category, stats in sorted(summary['categories'].items(), key=lambda x: -x[1]['sales']):
+            lines.append(f"{_category_label(category)}: {stats['count']}件 / {stats['sales']:,.0f}円"
+                         f"（利益 {stats['profit']:,.0f}円）")
+    return "\n".join(lines)
+
+def format_monthly_report(summary: Dict) -> str:
+    """月別の集計をLINEの返信・CLI表示用のテキストにする"""
+    lines = ["📊 月別の売上（販売件数 / 売上 / 利益 / 新規登録）"]
+    for row in summary['rows']:
+        lines.append(f"{row['month']}: {row['count']}件 / {row['sales']:,.0f}円 / {row['profit']:,.0f}円"
+                     f" / 登録{row['registered']}件")
+    return "\n".join(lines)
+
+def format_stock_report(summary: Dict) -> str:
+    """在庫の集計をLINEの返信・CLI表示用のテキストにする"""
+    lines = [f"📦 在庫: {summary['count']}件（登録済み {summary['total']}件）"]
+    lines.append("")
+    lines.append("【登録からの経過日数】")
+    for label, count in summary['buckets']:
+        lines.append(f"{label}: {count}件")
+    if summary['categories']:
+        lines.append("")
+        lines.append("【カテゴリー別】")
+        for category, count in sorted(summary['categories'].items(), key=lambda x: -x[1]):
+            lines.append(f"{_category_label(category)}: {count}件")
+    if summary['oldest']:
+        oldest = summary['oldest']
+        lines.append("")
+        lines.append(f"最も古い在庫: {oldest['management_number'] or '-'} {oldest['title']}（{oldest['registered']}登録）")
+    return "\n".join(lines)
+
+def build_sales_reply(argument: str = '') -> str:
+    """#売上 コマンドの返信（引数なし: 今月、'月別': 月別の集計、'2025-07' など: 指定した月）"""
+    argument = argument.strip()
+    columns = load_report_columns()
+    if argument == '月別':
+        return format_monthly_report(summarize_months(columns))
+    if not argument:
+        return format_sales_report(summarize_sales(columns))
+    month = _parse_month(argument)
+    if month is None:
+        return "❌ 「#売上」「#売上 2025-07」「#売上 月別」の形式で指定してください。"
+    return format_sales_report(summarize_sales(columns, month))
+
+def build_stock_reply() -> str:
+    """#在庫 コマンドの返信"""
+    return format_stock_report(summarize_stock(load_report_columns()))
+
+if __name__ == "__main__":
+    # 使い方: python sales_report.py [月別 / YYYY-MM / 在庫]
+    argument = sys.argv[1] if len(sys.argv) > 1 else ''
+    print(build_stock_reply() if argument == '在庫' else build_sales_reply(argument))
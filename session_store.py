@@ -0,0 +1,171 @@
+import os
+import time
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 管理番号を送信した商品を生成待ちに入れ、バックグラウンドでまとめて生成するか
+# （続けて次の商品の画像を送信でき、結果は生成待ちがなくなった時点でプッシュでまとめて送る）
+MULTI_ITEM_SESSIONS = os.getenv('MULTI_ITEM_SESSIONS', '0') == '1'
+
+# バックグラウンドで同時に生成する商品数（全ユーザーの合計）
+SESSION_WORKERS = int(os.getenv('SESSION_WORKERS', '4'))
+
+# 商品を送信した順に並べるための通し番号
+_sequence = itertools.count()
+
+class UserSession:
+    """1ユーザー分の入力中の商品（画像・特徴テキスト）と、生成中の商品の結果"""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.lock = threading.Lock()
+        self.image_paths: List[str] = []
+        self.image_urls: List[str] = []
+        # 画像のdHash（ほぼ同じ写真の確認に使う、確認しなかった画像はNone）
+        self.image_hashes: List[Optional[int]] = []
+        self.features = ""
+        # 重複の警告を出した管理番号（同じ番号がもう一度送信されたら生成する）
+        self.pending_duplicate_number = ""
+        # #後で を送信した場合、次の商品は急がない（Batch APIで生成する）
+        self.deferred = False
+        self.in_flight = 0
+        self.results: List[Dict] = []
+        # 生成中の商品がなく、結果も送信済みの場合にセットされる
+        self.idle = threading.Event()
+        self.idle.set()
+        self.updated_at = time.time()
+
+    def add_image(self, path: str, url: str, image_hash: Optional[int] = None):
+        with self.lock:
+            self.image_paths.append(path)
+            self.image_urls.append(url)
+            self.image_hashes.append(image_hash)
+            self.updated_at = time.time()
+
+    def defer_next_item(self):
+        with self.lock:
+            self.deferred = True
+            self.updated_at = time.time()
+
+    def set_features(self, features: str):
+        with self.lock:
+            self.features = features
+            self.updated_at = time.time()
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """生成中の商品がすべて終わり、結果を送信するまで待つ（タイムアウトした場合はFalse）"""
+        return self.idle.wait(timeout)
+
+    def take_item(self, management_number: str) -> Dict:
+        """入力中の画像・特徴テキストを管理番号の商品として取り出し、次の商品の入力を始める"""
+        with self.lock:
+            item = {
+                'management_number': management_number,
+                'image_paths': self.image_paths,
+                'image_urls': self.image_urls,
+                'features': self.features,
+                'deferred': self.deferred,
+                'sequence': next(_sequence)
+            }
+            self.image_paths = []
+            self.image_urls = []
+            self.image_hashes = []
+            self.features = ""
+            self.pending_duplicate_number = ""
+            self.deferred = False
+            self.updated_at = time.time()
+            return item
+
+class SessionStore:
+    """ユーザーごとのセッションと、生成待ちの商品をバックグラウンドで生成するスレッドプール"""
+
+    def __init__(self, workers: int = SESSION_WORKERS):
+        self._workers = workers
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, UserSession] = {}
+        self._executor = None
+
+    def get(self, user_id: str) -> UserSession:
+        """ユーザーのセッションを返す（ない場合は作成）"""
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                session = self._sessions[user_id] = UserSession(user_id)
+            return session
+
+    def submit(self, session: UserSession, item: Dict, generate: Callable[[Dict], Dict],
+               on_complete: Callable[[UserSession, List[Dict]], None]) -> int:
+        """商品を生成待ちに追加し、そのユーザーの生成中の商品数を返す
+
+        generate(item) は結果（'management_number' と 'product_info' または 'error'）を返す。
+        そのユーザーの生成中の商品がなくなった時点で、on_complete(session, 送信した順の結果) を1回呼ぶ。
+        """
+        with session.lock:
+            session.in_flight += 1
+            in_flight = session.in_flight
+            session.idle.clear()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='session')
+            executor = self._executor
+        executor.submit(self._run, session, item, generate, on_complete)
+        return in_flight
+
+    def _run(self, session: UserSession, item: Dict, generate: Callable[[Dict], Dict],
+             on_complete: Callable[[UserSession, List[Dict]], None]):
+        try:
+            result = generate(item)
+        except Exception as e:
+            print(f"商品 {item['management_number']} の生成エラー: {e}")
+            result = {'management_number': item['management_number'], 'error': str(e)}
+        result['sequence'] = item['sequence']
+
+        with session.lock:
+            session.results.append(result)
+            session.in_flight -= 1
+            if session.in_flight:
+                return
+            results = sorted(session.results, key=lambda result: result['sequence'])
+            session.results = []
+        try:
+            on_complete(session, results)
+        except Exception as e:
+            print(f"生成結果の送信エラー: {e}")
+        with session.lock:
+            if not session.in_flight:
+                session.idle.set()
+
+    def in_flight(self) -> int:
+        """全ユーザーの生成中の商品数"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return sum(session.in_flight for session in sessions)
+
+    def reap_idle(self, ttl: float) -> Tuple[int, List[str]]:
+        """ttl 秒操作がなく生成中の商品もないセッションを削除し、(削除した件数, 残っていた画像のパス) を返す"""
+        cutoff = time.time() - ttl
+        reaped = 0
+        paths: List[str] = []
+        with self._lock:
+            for user_id, session in list(self._sessions.items()):
+                with session.lock:
+                    if session.in_flight or session.updated_at >= cutoff:
+                        continue
+                    paths.extend(session.image_paths)
+                    session.image_paths = []
+                    session.image_urls = []
+                    session.image_hashes = []
+                del self._sessions[user_id]
+                reaped += 1
+        return reaped, paths
+
+_session_store = None
+
+def get_session_store() -> SessionStore:
+    """ユーザーごとのセッションを返す（初回のみ作成）"""
+    global _session_store
+    if _session_store is None:
+        _session_store = SessionStore()
+    return _session_store
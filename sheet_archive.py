@@ -0,0 +1,289 @@
+import os
+import sys
+import time
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional
+from local_store import connect_sqlite, persistent_storage_error
+from tracing import span
+
+# アーカイブしたシートの行を保存するSQLiteのファイル名
+ARCHIVE_FILE = os.getenv('SHEET_ARCHIVE_FILE', 'sheet_archive.sqlite3')
+
+# アーカイブを保存する永続的なディレクトリ（再起動やVercelのインスタンスの入れ替えで消えない場所）
+# アーカイブがシートの唯一のコピーになるため、設定されていない場合はシートを削除しない
+ARCHIVE_DIR = os.getenv('SHEET_ARCHIVE_DIR', '')
+
+# アーカイブの対象にする、最後の登録・販売から経過した日数
+ARCHIVE_MIN_AGE_DAYS = int(os.getenv('ARCHIVE_MIN_AGE_DAYS', '90'))
+
+HEADER_ROW = ['画像', '商品名', '登録日', '販売日', '販売価格', '利益']
+
+class SheetArchive:
+    """スプレッドシートから削除したシートの行（画像URLを含む）を保存するローカルのアーカイブ
+
+    アーカイブした行は、売上集計（スナップショット）と #検索 から引き続き参照できる。
+    """
+
+    def __init__(self, archive_file: str = ARCHIVE_FILE, archive_dir: str = ARCHIVE_DIR):
+        self._lock = threading.Lock()
+        if archive_dir:
+            os.makedirs(archive_dir, exist_ok=True)
+            archive_file = os.path.join(archive_dir, archive_file)
+        self._conn = connect_sqlite(archive_file)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS archived_rows (
+                sheet_name TEXT NOT NULL,
+                row_number INTEGER NOT NULL,
+                management_number TEXT,
+                title TEXT,
+                registration_date TEXT,
+                sale_date TEXT,
+                sale_price,
+                profit,
+                image_url TEXT,
+                spreadsheet_id TEXT,
+                archived_at REAL,
+                PRIMARY KEY (sheet_name, row_number)
+            )
+        """)
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS archived_rows_management_number ON archived_rows (management_number)'
+        )
+        self._conn.commit()
+        self._sheet_values: Optional[Dict[str, List[List]]] = None
+
+    def add_sheet(self, sheet_name: str, rows: List[Dict], spreadsheet_id: str = '') -> int:
+        """1シート分の行をアーカイブに保存し、保存した行数を返す（同じシートの行は置き換える）"""
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute('DELETE FROM archived_rows WHERE sheet_name = ?', (sheet_name,))
+                self._conn.executemany("""
+                    INSERT INTO archived_rows (sheet_name, row_number, management_number, title, registration_date,
+                                               sale_date, sale_price, profit, image_url, spreadsheet_id, archived_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, [
+                    (sheet_name, row['row_number'], row['management_number'], row['title'],
+                     row['registration_date'], row['sale_date'], row['sale_price'], row['profit'],
+                     row['image_url'], spreadsheet_id, now)
+                    for row in rows
+                ])
+            self._sheet_values = None
+        return len(rows)
+
+    def lookup(self, management_number: str) -> Optional[Dict]:
+        """管理番号からアーカイブした商品を検索する（見つからない場合はNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM archived_rows WHERE management_number = ? ORDER BY archived_at DESC LIMIT 1',
+                (management_number,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'management_number': row['management_number'],
+            'title': row['title'],
+            'sheet_name': f"{row['sheet_name']}（アーカイブ済み）",
+            'row_number': row['row_number'],
+            'image_url': row['image_url'],
+            'price': None,
+            'sold': bool(row['sale_date'] and row['sale_price'] not in (None, '')),
+            'sale_date': row['sale_date'],
+            'sale_price': row['sale_price']
+        }
+
+    def sheet_names(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                'SELECT DISTINCT sheet_name FROM archived_rows ORDER BY sheet_name'
+            )]
+
+    def sheet_values(self) -> Dict[str, List[List]]:
+        """アーカイブしたシートをスプレッドシートと同じ形（A〜F列、ヘッダー行を含む）で返す"""
+        with self._lock:
+            if self._sheet_values is None:
+                sheets: Dict[str, List[List]] = defaultdict(lambda: [list(HEADER_ROW)])
+                for row in self._conn.execute("""
+                    SELECT sheet_name, title, registration_date, sale_date, sale_price, profit
+                    FROM archived_rows ORDER BY sheet_name, row_number
+                """):
+                    sheets[row['sheet_name']].append([
+                        '', row['title'] or '', row['registration_date'] or '', row['sale_date'] or '',
+                        '' if row['sale_price'] is None else row['sale_price'],
+                        '' if row['profit'] is None else row['profit']
+                    ])
+                self._sheet_values = dict(sheets)
+            return self._sheet_values
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM archived_rows').fetchone()[0]
+
+    def count_sheet(self, sheet_name: str) -> int:
+        """アーカイブに保存されている1シート分の行数"""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM archived_rows WHERE sheet_name = ?', (sheet_name,)
+            ).fetchone()[0]
+
+def archive_storage_error(archive_dir: str = ARCHIVE_DIR) -> Optional[str]:
+    """アーカイブの保存先が永続的でない場合にその理由を返す（シートを削除してよい場合はNone）"""
+    return persistent_storage_error(archive_dir, 'SHEET_ARCHIVE_DIR')
+
+def _data_row_count(values: List[List]) -> int:
+    """シートの値（ヘッダー行を含む）のうち、商品名が入力された行数"""
+    return sum(1 for row in values[1:] if len(row) > 1 and str(row[1]).strip())
+
+def _sheet_rows(sheet_name: str, values: List[List], image_cells: List[List]) -> List[Dict]:
+    """シートの値（A〜F列）と画像列の数式から、アーカイブに保存する行を作る"""
+    from item_index import extract_management_number
+    from google_sheets_handler import _parse_image_url
+
+    rows = []
+    for i, row in enumerate(values[1:]):  # ヘッダー行を除く
+        row = list(row) + [''] * (6 - len(row))
+        if not str(row[1]).strip():
+            continue
+        image_cell = image_cells[i + 1] if i + 1 < len(image_cells) and image_cells[i + 1] else ['']
+        rows.append({
+            'row_number': i + 2,
+            'management_number': extract_management_number(str(row[1])),
+            'title': str(row[1]),
+            'registration_date': str(row[2]),
+            'sale_date': str(row[3]),
+            'sale_price': row[4] if row[4] != '' else None,
+            'profit': row[5] if row[5] != '' else None,
+            'image_url': _parse_image_url(str(image_cell[0]))
+        })
+    return rows
+
+def is_archivable(values: List[List], today: int, min_age_days: int = ARCHIVE_MIN_AGE_DAYS) -> bool:
+    """すべての商品が売れていて、最後の登録・販売から min_age_days 日以上経ったシートか判定する"""
+    from sheet_snapshot import parse_day, parse_amount
+
+    latest = -1
+    data_rows = 0
+    for row in values[1:]:
+        row = list(row) + [''] * (6 - len(row))
+        if not str(row[1]).strip():
+            continue
+        data_rows += 1
+        registered, sold_on = parse_day(row[2]), parse_day(row[3])
+        if sold_on < 0 or row[4] == '' or parse_amount(row[4]) != parse_amount(row[4]):
+            return False
+        latest = max(latest, registered, sold_on)
+    return data_rows > 0 and latest >= 0 and today - latest >= min_age_days
+
+def find_archivable_sheets(sheet, min_age_days: int = ARCHIVE_MIN_AGE_DAYS) -> Dict[str, List[List]]:
+    """アーカイブできるシートを探し、シート名 → 値（A〜F列）を返す"""
+    from google_sheets_handler import fetch_all_sheet_values
+
+    today = int(time.time() // 86400)
+    all_values = fetch_all_sheet_values(sheet, 'A:F', value_render_option='UNFORMATTED_VALUE')
+    return {
+        sheet_name: values for sheet_name, values in all_values.items()
+        if is_archivable(values, today, min_age_days)
+    }
+
+def archive_sheets(sheet, min_age_days: int = ARCHIVE_MIN_AGE_DAYS, dry_run: bool = False) -> List[str]:
+    """すべて売れた古いシートをアーカイブに保存してからスプレッドシートから削除し、削除したシート名を返す
+
+    スプレッドシートごとに、画像列の読み込み（batchGet）・シートIDの取得・削除（batchUpdate）を1回ずつ行う。
+    スプレッドシートの最後の1シートは削除できないため残す。
+    アーカイブがシートの唯一のコピーになるため、保存先が永続的でない場合は削除せずにエラーにする。
+    アーカイブに保存された行数がシートの商品数と一致しないシートは削除しない。
+    """
+    from spreadsheet_router import get_spreadsheet_router
+    from item_index import get_item_index
+
+    router = get_spreadsheet_router()
+    candidates = find_archivable_sheets(sheet, min_age_days)
+    if dry_run or not candidates:
+        return sorted(candidates)
+    storage_error = archive_storage_error()
+    if storage_error:
+        raise RuntimeError(f"{storage_error}。シートは削除していません")
+
+    by_spreadsheet: Dict[str, List[str]] = defaultdict(list)
+    for sheet_name in sorted(candidates):
+        by_spreadsheet[router.route(sheet_name)].append(sheet_name)
+
+    archive = get_sheet_archive()
+    archived = []
+    for spreadsheet_id, sheet_names in by_spreadsheet.items():
+        with span('archive.spreadsheet', sheets=len(sheet_names)):
+            metadata = sheet.get(spreadsheetId=spreadsheet_id,
+                                 fields='sheets(properties(title,sheetId))').execute()
+            sheet_ids = {worksheet['properties']['title']: worksheet['properties']['sheetId']
+                         for worksheet in metadata.get('sheets', [])}
+            sheet_names = [sheet_name for sheet_name in sheet_names if sheet_name in sheet_ids]
+            if len(sheet_names) >= len(sheet_ids):
+                sheet_names = sheet_names[:len(sheet_ids) - 1]
+            if not sheet_names:
+                continue
+
+            # 画像URLはIMAGE関数の数式から取り出すため、画像列だけ数式のまま取得する
+            result = sheet.values().batchGet(
+                spreadsheetId=spreadsheet_id,
+                ranges=[f'{sheet_name}!A:A' for sheet_name in sheet_names],
+                valueRenderOption='FORMULA'
+            ).execute()
+            for sheet_name, value_range in zip(sheet_names, result.get('valueRanges', [])):
+                rows = _sheet_rows(sheet_name, candidates[sheet_name], value_range.get('values', []))
+                archive.add_sheet(sheet_name, rows, spreadsheet_id)
+
+            # アーカイブに全行が保存されたことを確認してから削除する
+            verified = []
+            for sheet_name in sheet_names:
+                expected = _data_row_count(candidates[sheet_name])
+                saved = archive.count_sheet(sheet_name)
+                if saved == expected:
+                    verified.append(sheet_name)
+                else:
+                    print(f"アーカイブの行数が一致しないため削除しません ({sheet_name}): シート {expected} 行 / アーカイブ {saved} 行")
+            sheet_names = verified
+            if not sheet_names:
+                continue
+            sheet.batchUpdate(spreadsheetId=spreadsheet_id, body={'requests': [
+                {'deleteSheet': {'sheetId': sheet_ids[sheet_name]}} for sheet_name in sheet_names
+            ]}).execute()
+            for sheet_name in sheet_names:
+                router.unregister_sheet(sheet_name)
+            archived.extend(sheet_names)
+
+    # 削除したシートの商品は索引から除き、検索はアーカイブから行う
+    try:
+        get_item_index().remove_sheets(archived)
+    except Exception as e:
+        print(f"索引の更新エラー: {e}")
+    print(f"{len(archived)} 件のシートをアーカイブしました: {', '.join(archived)}")
+    return archived
+
+def lookup_item(management_number: str) -> Optional[Dict]:
+    """管理番号から商品を検索する（索引にない場合はアーカイブから探す）"""
+    from item_index import get_item_index
+
+    item = get_item_index().lookup(management_number)
+    if item is None:
+        item = get_sheet_archive().lookup(management_number)
+    return item
+
+_sheet_archive = None
+
+def get_sheet_archive() -> SheetArchive:
+    """シートのアーカイブを返す（初回のみ作成）"""
+    global _sheet_archive
+    if _sheet_archive is None:
+        _sheet_archive = SheetArchive()
+    return _sheet_archive
+
+if __name__ == "__main__":
+    # 使い方: python sheet_archive.py list / python sheet_archive.py run [日数]
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else ARCHIVE_MIN_AGE_DAYS
+    if command in ('list', 'run'):
+        from google_sheets_handler import get_sheet_service
+        print(archive_sheets(get_sheet_service(), days, dry_run=command == 'list'))
+    else:
+        print("使い方: python sheet_archive.py list / python sheet_archive.py run [日数]")
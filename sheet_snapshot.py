@@ -0,0 +1,233 @@
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import threading
+import unicodedata
+from datetime import datetime, date
+from typing import Dict, List
+import numpy as np
+from local_store import load_json_state, save_json_state
+from tracing import span
+
+# スプレッドシートの全シートの内容を保存するローカルファイル（再起動後もすぐに使えるように）
+SNAPSHOT_FILE = os.getenv('SHEET_SNAPSHOT_FILE', 'sheet_snapshot.json')
+
+# スナップショットを取り直すまでの秒数
+SNAPSHOT_TTL = float(os.getenv('SHEET_SNAPSHOT_TTL', '900'))
+
+# 日付の列（登録日・販売日）で受け付ける形式
+DATE_FORMATS = ['%Y/%m/%d', '%Y-%m-%d', '%Y/%m/%d %H:%M:%S', '%Y年%m月%d日']
+
+# 列の名前（スナップショットの列 → 配列）
+COLUMNS = ['management_number', 'title', 'sheet_name', 'row_number', 'category', 'brand',
+           'registered', 'sold_on', 'sale_price', 'profit', 'sold']
+
+_EPOCH = date(1970, 1, 1)
+
+def parse_day(value) -> int:
+    """日付の文字列を1970/1/1からの日数にする（日付でない場合は-1）"""
+    text = str(value or '').strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return (datetime.strptime(text, date_format).date() - _EPOCH).days
+        except ValueError:
+            continue
+    return -1
+
+def format_day(day: int) -> str:
+    """1970/1/1からの日数を 'YYYY/MM/DD' にする"""
+    return date.fromordinal(_EPOCH.toordinal() + int(day)).strftime('%Y/%m/%d')
+
+def parse_amount(value) -> float:
+    """金額の文字列（'1,980'、'¥1,980' など）を数値にする（金額でない場合はNaN）"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = re.sub(r'[^\d.\-]', '', unicodedata.normalize('NFKC', str(value or '')))
+    try:
+        return float(text)
+    except ValueError:
+        return float('nan')
+
+def title_tokens(title: str) -> List[str]:
+    """商品名を空白で区切った語のリスト（全角・半角と大文字・小文字をそろえ、管理番号と1文字の語は除く）"""
+    words = unicodedata.normalize('NFKC', title or '').lower().split()
+    return [word for word in words if len(word) > 1 and not re.fullmatch(r'\d{6}', word)]
+
+def _rows_checksum(rows: List[List]) -> int:
+    return zlib.crc32(json.dumps(rows, ensure_ascii=False).encode('utf-8'))
+
+def _parse_sheet(sheet_name: str, rows: List[List]) -> Dict[str, list]:
+    """1シート分の行データ（A〜F列、ヘッダー行を含む）を列ごとのリストにする"""
+    from item_index import extract_management_number
+    from template_engine import get_template_engine
+    from profit_calculator import compute_profit, PROFIT_FORMULA_MODE
+
+    engine = get_template_engine()
+    parsed = {column: [] for column in COLUMNS}
+    for i, row in enumerate(rows[1:]):  # ヘッダー行を除く
+        row = [str(cell) for cell in row] + [''] * (6 - len(row))
+        title = row[1].strip()
+        if not title:
+            continue
+        management_number = extract_management_number(title)
+        base_title = title[:-6].strip() if management_number else title
+        tokens = title_tokens(base_title)
+        sale_price = parse_amount(row[4]) if row[4] else float('nan')
+        sold_on = parse_day(row[3]) if row[3] else -1
+        parsed['management_number'].append(management_number)
+        parsed['title'].append(base_title)
+        parsed['sheet_name'].append(sheet_name)
+        parsed['row_number'].append(i + 2)
+        parsed['category'].append(engine.classify_text(base_title) or '')
+        parsed['brand'].append(tokens[0] if tokens else '')
+        parsed['registered'].append(parse_day(row[2]))
+        parsed['sold_on'].append(sold_on)
+        parsed['sale_price'].append(sale_price)
+        parsed['profit'].append(parse_amount(row[5]) if row[5] else float('nan'))
+        # 販売日と販売価格が入力されている行を売れた商品とする
+        parsed['sold'].append(sold_on >= 0 and not np.isnan(sale_price))
+
+    # 利益列が空の行（ローカル計算の方式では常に）は販売価格から利益を計算する
+    profits = np.array(parsed['profit'], dtype=np.float64)
+    missing = np.isnan(profits) | (PROFIT_FORMULA_MODE == 'local')
+    parsed['profit'] = np.where(missing, compute_profit(parsed['sale_price']), profits).tolist()
+    return parsed
+
+class SheetSnapshot:
+    """スプレッドシートの全シートを列ごとのNumPy配列にまとめたスナップショット（分析用）
+
+    全シートは1回のbatchGetで取得し、シートごとのチェックサムが前回と同じシートは解析し直さない。
+    取得した内容はローカルファイルにも保存し、再起動後はAPIを呼ばずに前回の内容から使い始める。
+    """
+
+    def __init__(self, snapshot_file: str = SNAPSHOT_FILE):
+        self._snapshot_file = snapshot_file
+        self._lock = threading.Lock()
+        self._sheets: Dict[str, dict] = {}
+        self._parsed: Dict[str, Dict[str, list]] = {}
+        self._columns: Dict[str, np.ndarray] = self._build_columns([])
+        self.fetched_at = 0.0
+        self.version = 0
+        self._loaded = False
+
+    def _build_columns(self, sheet_names: List[str]) -> Dict[str, np.ndarray]:
+        def column(name: str) -> list:
+            return [value for sheet_name in sheet_names for value in self._parsed[sheet_name][name]]
+
+        return {
+            'management_number': np.array(column('management_number'), dtype=object),
+            'title': np.array(column('title'), dtype=object),
+            'sheet_name': np.array(column('sheet_name'), dtype=object),
+            'row_number': np.array(column('row_number'), dtype=np.int32),
+            'category': np.array(column('category'), dtype=object),
+            'brand': np.array(column('brand'), dtype=object),
+            'registered': np.array(column('registered'), dtype=np.int32),
+            'sold_on': np.array(column('sold_on'), dtype=np.int32),
+            'sale_price': np.array(column('sale_price'), dtype=np.float64),
+            'profit': np.array(column('profit'), dtype=np.float64),
+            'sold': np.array(column('sold'), dtype=bool)
+        }
+
+    def _apply(self, all_values: Dict[str, List[List]], fetched_at: float) -> int:
+        """取得したシートの内容を反映し、解析し直したシート数を返す（ロックを取得した状態で呼ぶ）"""
+        changed = 0
+        sheets = {}
+        for sheet_name, rows in all_values.items():
+            checksum = _rows_checksum(rows)
+            previous = self._sheets.get(sheet_name)
+            if previous is None or previous['checksum'] != checksum or sheet_name not in self._parsed:
+                self._parsed[sheet_name] = _parse_sheet(sheet_name, rows)
+                changed += 1
+            sheets[sheet_name] = {'checksum': checksum, 'rows': rows}
+        removed = set(self._sheets) - set(sheets)
+        for sheet_name in removed:
+            self._parsed.pop(sheet_name, None)
+
+        self._sheets = sheets
+        self.fetched_at = fetched_at
+        if changed or removed or not self._loaded:
+            self._columns = self._build_columns(sorted(sheets))
+            self.version += 1
+        self._loaded = True
+        return changed + len(removed)
+
+    def load_cached(self) -> bool:
+        """ローカルファイルに保存した前回のスナップショットを読み込む（ない場合はFalse）"""
+        state = load_json_state(self._snapshot_file, None)
+        if not state:
+            return False
+        with self._lock:
+            self._apply({name: sheet['rows'] for name, sheet in state.get('sheets', {}).items()},
+                        state.get('fetched_at', 0.0))
+        return True
+
+    def refresh(self, sheet=None) -> int:
+        """全シートを1回のbatchGetで取得し直し、内容が変わったシート数を返す
+
+        スプレッドシートから削除したアーカイブ済みのシートも集計に含める。
+        """
+        from google_sheets_handler import get_sheet_service, fetch_all_sheet_values
+        from sheet_archive import get_sheet_archive
+
+        with span('snapshot.refresh') as tags:
+            all_values = fetch_all_sheet_values(sheet or get_sheet_service(), 'A:F',
+                                                value_render_option='UNFORMATTED_VALUE')
+            for sheet_name, rows in get_sheet_archive().sheet_values().items():
+                all_values.setdefault(sheet_name, rows)
+            with self._lock:
+                changed = self._apply(all_values, time.time())
+                sheets = dict(self._sheets)
+                fetched_at = self.fetched_at
+            tags['sheets'] = len(all_values)
+            tags['changed'] = changed
+        if changed:
+            save_json_state(self._snapshot_file, {'fetched_at': fetched_at, 'sheets': sheets})
+        return changed
+
+    def ensure_loaded(self) -> bool:
+        """未読み込みの場合はローカルファイル、なければスプレッドシートから読み込む（読み込めた場合はTrue）"""
+        if self._loaded:
+            return True
+        if self.load_cached():
+            return True
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"スナップショットの取得エラー: {e}")
+        return self._loaded
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def is_stale(self, ttl: float = SNAPSHOT_TTL) -> bool:
+        return time.time() - self.fetched_at > ttl
+
+    @property
+    def columns(self) -> Dict[str, np.ndarray]:
+        """列の名前 → 配列（すべての配列は同じ長さで、同じ位置が同じ商品）"""
+        return self._columns
+
+    def count(self) -> int:
+        return len(self._columns['title'])
+
+_sheet_snapshot = None
+
+def get_sheet_snapshot() -> SheetSnapshot:
+    """スプレッドシートのスナップショットを返す（初回のみ作成）"""
+    global _sheet_snapshot
+    if _sheet_snapshot is None:
+        _sheet_snapshot = SheetSnapshot()
+    return _sheet_snapshot
+
+if __name__ == "__main__":
+    # 使い方: python sheet_snapshot.py refresh
+    if len(sys.argv) > 1 and sys.argv[1] == 'refresh':
+        snapshot = get_sheet_snapshot()
+        snapshot.load_cached()
+        print(f"更新したシート: {snapshot.refresh()} / 商品数: {snapshot.count()}")
+    else:
+        print("使い方: python sheet_snapshot.py refresh")
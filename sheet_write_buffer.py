@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import atexit
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+from local_store import connect_sqlite, get_state_path, persistent_storage_error
+
+# ジャーナル（未反映の行を保存するSQLite）のファイル名
+JOURNAL_FILE = os.getenv('SHEETS_JOURNAL_FILE', 'sheet_journal.sqlite3')
+
+# 定期反映の間隔（秒）と、即時反映する未反映行数のしきい値
+FLUSH_INTERVAL = float(os.getenv('SHEETS_FLUSH_INTERVAL', '30'))
+FLUSH_BATCH_SIZE = int(os.getenv('SHEETS_FLUSH_BATCH_SIZE', '20'))
+
+# 反映処理の関数：(シート名, 行データのリスト) を受け取り、書き込んだ行番号のリストを返す
+FlushFunc = Callable[[str, List[Dict]], List[int]]
+
+# 反映済みの確認の関数：(シート名, 行データのリスト) を受け取り、行ごとにシートに追加済みなら行番号、なければNoneのリストを返す
+VerifyFunc = Callable[[str, List[Dict]], List[Optional[int]]]
+
+def journal_storage_error() -> Optional[str]:
+    """ジャーナルの保存先が永続的でない場合にその理由を返す（記録した行が反映前に消える可能性がある）"""
+    return persistent_storage_error(os.path.dirname(get_state_path(JOURNAL_FILE)), 'LOCAL_STATE_DIR')
+
+class SheetWriteBuffer:
+    """スプレッドシートへの行追加をローカルのジャーナルに記録し、シートごとにまとめて反映する"""
+
+    def __init__(self, flush_func: FlushFunc, journal_file: str = JOURNAL_FILE,
+                 flush_interval: float = FLUSH_INTERVAL, batch_size: int = FLUSH_BATCH_SIZE,
+                 verify_func: Optional[VerifyFunc] = None):
+        self._flush_func = flush_func
+        self._verify_func = verify_func
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._db_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer_started = False
+        self._conn = connect_sqlite(journal_file)
+        # 行を受け付けた時点で確実にディスクへ書き込む
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pending_rows (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sheet_name TEXT NOT NULL,
+                management_number TEXT NOT NULL,
+                row_json TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                flushed_at REAL,
+                row_number INTEGER
+            )
+        """)
+        # 反映を始めた時刻（反映中にエラーや終了があった行は、追加済みか確認してから再反映する）
+        columns = [row['name'] for row in self._conn.execute('PRAGMA table_info(pending_rows)')]
+        if 'started_at' not in columns:
+            self._conn.execute('ALTER TABLE pending_rows ADD COLUMN started_at REAL')
+        self._conn.commit()
+        self._metrics = {
+            'flush_count': 0,
+            'flush_errors': 0,
+            'rows_flushed': 0,
+            'last_flush_latency': 0.0,
+            'max_flush_latency': 0.0,
+            'total_flush_latency': 0.0,
+            'last_batch_size': 0,
+            'max_batch_size': 0
+        }
+        atexit.register(self.flush)
+
+    def enqueue(self, sheet_name: str, management_number: str, row: Dict) -> None:
+        """行をジャーナルに記録する（この関数が戻った時点で行は永続化済み）"""
+        with self._db_lock:
+            self._conn.execute(
+                'INSERT INTO pending_rows (sheet_name, management_number, row_json, created_at) VALUES (?, ?, ?, ?)',
+                (sheet_name, management_number, json.dumps(row, ensure_ascii=False), time.time())
+            )
+            self._conn.commit()
+        print(f"管理番号 {management_number} の行をジャーナルに記録しました（シート '{sheet_name}'）")
+
+        self._ensure_timer()
+        if self.pending_count() >= self._batch_size:
+            # しきい値を超えた場合はバックグラウンドで反映
+            threading.Thread(target=self.flush, daemon=True).start()
+
+    def pending_count(self) -> int:
+        """未反映の行数を返す"""
+        with self._db_lock:
+            row = self._conn.execute('SELECT COUNT(*) FROM pending_rows WHERE flushed_at IS NULL').fetchone()
+        return row[0]
+
+    def _mark_flushed(self, entries: List, row_numbers: List[int]):
+        now = time.time()
+        with self._db_lock:
+            for entry, row_number in zip(entries, row_numbers):
+                self._conn.execute(
+                    'UPDATE pending_rows SET flushed_at = ?, row_number = ? WHERE id = ?',
+                    (now, row_number, entry['id'])
+                )
+            self._conn.commit()
+
+    def _resolve_in_doubt(self, sheet_name: str, entries: List) -> List:
+        """反映中だった行のうちシートに追加済みの行を反映済みにし、再反映が必要な行を返す"""
+        in_doubt = [entry for entry in entries if entry['started_at'] is not None]
+        if not in_doubt or self._verify_func is None:
+            return entries
+        row_numbers = self._verify_func(sheet_name, [json.loads(entry['row_json']) for entry in in_doubt])
+        found = [(entry, row_number) for entry, row_number in zip(in_doubt, row_numbers) if row_number is not None]
+        if found:
+            self._mark_flushed([entry for entry, _ in found], [row_number for _, row_number in found])
+            print(f"シート '{sheet_name}' に追加済みの {len(found)} 行を反映済みにしました")
+        found_ids = {entry['id'] for entry, _ in found}
+        return [entry for entry in entries if entry['id'] not in found_ids]
+
+    def flush(self) -> int:
+        """未反映の行をシートごとにまとめてスプレッドシートに反映し、反映した行数を返す
+
+        追加の前に行を反映中（started_at）として記録し、追加の完了後に反映済み（flushed_at）にする。
+        反映中のままの行（追加中のエラーや終了）は、verify_func でシートに追加済みか確認してから再反映する。
+        """
+        with self._flush_lock:
+            with self._db_lock:
+                pending = self._conn.execute(
+                    'SELECT id, sheet_name, management_number, row_json, started_at FROM pending_rows '
+                    'WHERE flushed_at IS NULL ORDER BY id'
+                ).fetchall()
+
+            if not pending:
+                return 0
+
+            rows_by_sheet = defaultdict(list)
+            for entry in pending:
+                rows_by_sheet[entry['sheet_name']].append(entry)
+
+            flushed = 0
+            for sheet_name, entries in rows_by_sheet.items():
+                try:
+                    entries = self._resolve_in_doubt(sheet_name, entries)
+                except Exception as e:
+                    # 追加済みか確認できない場合は二重に追加しないよう、次回の反映まで待つ
+                    self._metrics['flush_errors'] += 1
+                    print(f"シート '{sheet_name}' の反映済みの確認エラー: {e}")
+                    continue
+                if not entries:
+                    continue
+
+                with self._db_lock:
+                    now = time.time()
+                    for entry in entries:
+                        self._conn.execute('UPDATE pending_rows SET started_at = ? WHERE id = ?', (now, entry['id']))
+                    self._conn.commit()
+
+                rows = [json.loads(entry['row_json']) for entry in entries]
+                started = time.perf_counter()
+                try:
+                    row_numbers = self._flush_func(sheet_name, rows)
+                except Exception as e:
+                    # 反映に失敗した行はジャーナルに残し、次回の反映で追加済みか確認してから再試行する
+                    self._metrics['flush_errors'] += 1
+                    print(f"シート '{sheet_name}' への一括反映エラー: {e}")
+                    continue
+
+                self._record_flush(time.perf_counter() - started, len(entries))
+                self._mark_flushed(entries, row_numbers)
+                flushed += len(entries)
+                print(f"シート '{sheet_name}' に {len(entries)} 行をまとめて反映しました")
+
+            return flushed
+
+    def replay(self) -> int:
+        """起動時に、前回のプロセスで反映されなかった行をジャーナルから再反映する"""
+        pending = self.pending_count()
+        if pending == 0:
+            return 0
+        print(f"ジャーナルに未反映の行が {pending} 件あります。再反映します")
+        return self.flush()
+
+    def metrics(self) -> Dict[str, float]:
+        """反映レイテンシとバッチサイズの集計値を返す"""
+        metrics = dict(self._metrics)
+        flush_count = metrics['flush_count']
+        metrics['avg_flush_latency'] = metrics['total_flush_latency'] / flush_count if flush_count else 0.0
+        metrics['avg_batch_size'] = metrics['rows_flushed'] / flush_count if flush_count else 0.0
+        metrics['pending_rows'] = self.pending_count()
+        return metrics
+
+    def _record_flush(self, latency: float, batch_size: int):
+        """1回分の反映結果を集計値に加える"""
+        self._metrics['flush_count'] += 1
+        self._metrics['rows_flushed'] += batch_size
+        self._metrics['last_flush_latency'] = latency
+        self._metrics['max_flush_latency'] = max(self._metrics['max_flush_latency'], latency)
+        self._metrics['total_flush_latency'] += latency
+        self._metrics['last_batch_size'] = batch_size
+        self._metrics['max_batch_size'] = max(self._metrics['max_batch_size'], batch_size)
+
+    def _ensure_timer(self):
+        """定期反映用のバックグラウンドスレッドを起動する（初回のみ）"""
+        if self._timer_started:
+            return
+        self._timer_started = True
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _flush_loop(self):
+        """一定間隔で未反映の行を反映する"""
+        while True:
+            time.sleep(self._flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"定期反映エラー: {e}")
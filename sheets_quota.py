@@ -0,0 +1,52 @@
+import os
+import time
+import threading
+from tracing import span
+
+# Google Sheets APIを1分あたりに呼び出せる回数（サービスアカウント1つあたりの上限に合わせる、0で制限なし）
+# 上限は読み込み・書き込みで別々のため、それぞれこの回数まで呼び出す
+SHEETS_REQUESTS_PER_MINUTE = int(os.getenv('SHEETS_REQUESTS_PER_MINUTE', '60'))
+
+class QuotaLimiter:
+    """1分あたりの呼び出し回数を超えないように待機するトークンバケット（全スレッドで共有）
+
+    上限までは待たずに呼び出せ、使った分は一定の速さで回復する。
+    """
+
+    def __init__(self, per_minute: int = SHEETS_REQUESTS_PER_MINUTE):
+        self._capacity = float(per_minute)
+        self._rate = per_minute / 60.0
+        self._tokens = float(per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """呼び出しを1回分予約し、待機した秒数を返す"""
+        if self._rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            # 先に予約してからロックの外で待つ（待機中も他のスレッドは順番に予約できる）
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            with span('sheets.quota_wait'):
+                time.sleep(wait)
+        return wait
+
+def is_read_request(method_id: str) -> bool:
+    """読み込みの呼び出しか（例：sheets.spreadsheets.values.get、sheets.spreadsheets.values.batchGet）"""
+    return method_id.endswith('.get') or method_id.endswith('.batchGet')
+
+_sheets_quotas = {}
+_sheets_quotas_lock = threading.Lock()
+
+def get_sheets_quota(method_id: str = '') -> QuotaLimiter:
+    """Google Sheets APIの呼び出し回数の制限（読み込み・書き込み別）を返す（初回のみ作成）"""
+    kind = 'read' if is_read_request(method_id or '') else 'write'
+    with _sheets_quotas_lock:
+        if kind not in _sheets_quotas:
+            _sheets_quotas[kind] = QuotaLimiter()
+        return _sheets_quotas[kind]
@@ -0,0 +1,130 @@
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from tracing import span
+
+# 既定のスプレッドシートID（ルーティング表に一致しない管理番号の保存先）
+DEFAULT_SPREADSHEET_ID = os.getenv('SPREADSHEET_ID', '1r9gAZZlWw40bURXOE2-BJB9OAZPEoPuN8-GZ7iD0yBA')
+
+# 管理番号（シート名）の先頭 → スプレッドシートID のルーティング表（JSON）
+# 例: 年ごとに分ける場合 {"24": "スプレッドシートID", "25": "スプレッドシートID"}
+# 一致する先頭のうち最も長いものを使い、どれにも一致しない場合は既定のスプレッドシートに保存する
+SPREADSHEET_ROUTES = os.getenv('SPREADSHEET_ROUTES', '')
+
+# 複数のスプレッドシートを並列に読み込む数
+SHARD_CONCURRENCY = int(os.getenv('SHARD_CONCURRENCY', '4'))
+
+def _parse_routes(text: str) -> Dict[str, str]:
+    if not text:
+        return {}
+    try:
+        routes = json.loads(text)
+    except json.JSONDecodeError as e:
+        print(f"SPREADSHEET_ROUTES の形式が正しくありません: {e}")
+        return {}
+    return {str(prefix): str(spreadsheet_id) for prefix, spreadsheet_id in routes.items() if spreadsheet_id}
+
+class SpreadsheetRouter:
+    """管理番号（シート名）から保存先のスプレッドシートを決める
+
+    既にあるシートは、各スプレッドシートのシート一覧（初回のみ並列に取得）から見つかったスプレッドシートを使う。
+    ルーティング表を変更しても、作成済みのシートは元のスプレッドシートのまま読み書きされる。
+    """
+
+    def __init__(self, routes: Optional[Dict[str, str]] = None, default_id: str = DEFAULT_SPREADSHEET_ID):
+        self._default_id = default_id
+        routes = _parse_routes(SPREADSHEET_ROUTES) if routes is None else routes
+        # 長い先頭から照合する
+        self._routes = sorted(routes.items(), key=lambda route: -len(route[0]))
+        self._lock = threading.Lock()
+        self._directory: Dict[str, str] = {}
+        self._directory_loaded = False
+
+    def spreadsheet_ids(self) -> List[str]:
+        """ルーティング表に含まれるすべてのスプレッドシートID（既定のスプレッドシートを先頭に、重複なし）"""
+        ids = [self._default_id] + [spreadsheet_id for _, spreadsheet_id in self._routes]
+        return list(dict.fromkeys(ids))
+
+    def route_by_prefix(self, key: str) -> str:
+        """ルーティング表だけで保存先を決める（新しく作成するシートの保存先）"""
+        for prefix, spreadsheet_id in self._routes:
+            if key.startswith(prefix):
+                return spreadsheet_id
+        return self._default_id
+
+    def route(self, key: str) -> str:
+        """管理番号またはシート名の保存先のスプレッドシートID"""
+        sheet_name = key[:4]
+        if len(self.spreadsheet_ids()) > 1 and not self._directory_loaded:
+            try:
+                self.list_sheets()
+            except Exception as e:
+                print(f"シート一覧の取得エラー: {e}")
+        with self._lock:
+            spreadsheet_id = self._directory.get(sheet_name)
+        return spreadsheet_id or self.route_by_prefix(sheet_name)
+
+    def register_sheet(self, sheet_name: str, spreadsheet_id: str):
+        """作成したシートの保存先を記録する"""
+        with self._lock:
+            self._directory[sheet_name] = spreadsheet_id
+
+    def unregister_sheet(self, sheet_name: str):
+        """削除したシートの記録を消す"""
+        with self._lock:
+            self._directory.pop(sheet_name, None)
+
+    def map(self, func: Callable, sheet=None) -> Dict[str, object]:
+        """スプレッドシートごとに func(sheet, spreadsheet_id) を並列に実行し、スプレッドシートID → 結果を返す
+
+        スプレッドシートが1つの場合は呼び出し元のスレッドで実行する。
+        複数の場合、サービスはスレッド間で共有できないため、スプレッドシートごとに作成する。
+        """
+        from google_sheets_handler import get_sheet_service
+
+        ids = self.spreadsheet_ids()
+        if len(ids) == 1:
+            return {ids[0]: func(sheet or get_sheet_service(), ids[0])}
+
+        def run(spreadsheet_id: str):
+            with span('shard.call', spreadsheet=spreadsheet_id[-6:]):
+                return func(get_sheet_service(), spreadsheet_id)
+
+        with ThreadPoolExecutor(max_workers=min(SHARD_CONCURRENCY, len(ids))) as executor:
+            return dict(zip(ids, executor.map(run, ids)))
+
+    def list_sheets(self, sheet=None) -> Dict[str, List[str]]:
+        """すべてのスプレッドシートのシート名を並列に取得し、スプレッドシートID → シート名のリストを返す"""
+        def fetch(service, spreadsheet_id: str) -> List[str]:
+            spreadsheet = service.get(spreadsheetId=spreadsheet_id, fields='sheets(properties(title))').execute()
+            return [worksheet['properties']['title'] for worksheet in spreadsheet.get('sheets', [])]
+
+        with span('shard.list_sheets') as tags:
+            sheets = self.map(fetch, sheet)
+            tags['spreadsheets'] = len(sheets)
+        with self._lock:
+            self._directory = {
+                sheet_name: spreadsheet_id
+                for spreadsheet_id, sheet_names in sheets.items() for sheet_name in sheet_names
+            }
+            self._directory_loaded = True
+        return sheets
+
+    def list_sheet_names(self, sheet=None) -> List[str]:
+        """すべてのスプレッドシートのシート名（スプレッドシートの順）"""
+        return [sheet_name for sheet_names in self.list_sheets(sheet).values() for sheet_name in sheet_names]
+
+_spreadsheet_router = None
+
+def get_spreadsheet_router() -> SpreadsheetRouter:
+    """スプレッドシートの振り分けを返す（初回のみ作成）"""
+    global _spreadsheet_router
+    if _spreadsheet_router is None:
+        _spreadsheet_router = SpreadsheetRouter()
+    return _spreadsheet_router
+
+def spreadsheet_for(key: str) -> str:
+    """管理番号またはシート名の保存先のスプレッドシートID"""
+    return get_spreadsheet_router().route(key)
@@ -0,0 +1,84 @@
+import json
+from typing import Any, Dict, List, Optional
+
+class StreamingJSONFields:
+    """ストリーミングで少しずつ届くJSONオブジェクトから、値が確定したトップレベルのフィールドを取り出す
+
+    文字列は閉じる「"」、数値などは次の「,」か「}」が届いた時点で確定とする。
+    入れ子の値（配列・オブジェクト）は読み飛ばし、先頭の ```json などのJSON以外の文字は無視する。
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._token: List[str] = []
+        self._scalar: List[str] = []
+        self._key: Optional[str] = None
+        self._expect: Optional[str] = None  # 'key' / 'value' / None（値の読み込み済み）
+
+    def feed(self, text: str) -> Dict[str, Any]:
+        """届いた文字列を読み込み、今回新たに確定したフィールドを返す"""
+        completed: Dict[str, Any] = {}
+        for ch in text:
+            if self._in_string:
+                if self._depth == 1:
+                    self._token.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._finish_string(completed)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._token = ['"']
+            elif ch in '{[':
+                self._depth += 1
+                if self._depth == 1:
+                    self._expect = 'key'
+                elif self._depth == 2 and self._expect == 'value':
+                    # 入れ子の値は取り出さない
+                    self._expect = None
+            elif ch in '}]':
+                if self._depth == 1:
+                    self._finish_scalar(completed)
+                self._depth = max(0, self._depth - 1)
+            elif self._depth != 1:
+                continue
+            elif ch == ':':
+                self._expect = 'value'
+                self._scalar = []
+            elif ch == ',':
+                self._finish_scalar(completed)
+                self._expect = 'key'
+            elif self._expect == 'value' and not ch.isspace():
+                self._scalar.append(ch)
+        return completed
+
+    def _finish_string(self, completed: Dict[str, Any]):
+        try:
+            value = json.loads(''.join(self._token))
+        except ValueError:
+            return
+        if self._expect == 'key':
+            self._key = value
+        elif self._expect == 'value' and self._key is not None:
+            self.fields[self._key] = completed[self._key] = value
+            self._expect = None
+
+    def _finish_scalar(self, completed: Dict[str, Any]):
+        if self._expect != 'value' or not self._scalar or self._key is None:
+            return
+        try:
+            value = json.loads(''.join(self._scalar))
+        except ValueError:
+            return
+        self.fields[self._key] = completed[self._key] = value
+        self._expect = None
+        self._scalar = []
@@ -1,8 +1,12 @@
 import os
 from dotenv import load_dotenv
-from supabase import create_client, Client
 
+# tracing などのモジュールも読み込み時に環境変数を参照するため、先に .env を読み込む
 load_dotenv()
+
+from supabase import create_client, Client
+from tracing import span
+
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 BUCKET_NAME = os.getenv("SUPABASE_BUCKET_NAME", "images")
@@ -17,7 +21,8 @@ def upload_image_to_supabase(image_path: str, filename: str) -> str:
         with open(image_path, "rb") as f:
             data = f.read()
         # upsert引数を削除
-        supabase.storage.from_(BUCKET_NAME).upload(path=filename, file=data, file_options={"content-type": "image/jpeg"})
+        with span('supabase.upload', bytes=len(data)):
+            supabase.storage.from_(BUCKET_NAME).upload(path=filename, file=data, file_options={"content-type": "image/jpeg"})
         public_url = supabase.storage.from_(BUCKET_NAME).get_public_url(filename)
         return public_url
     except Exception as e:
@@ -0,0 +1,153 @@
+import os
+import re
+import sys
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+# テンプレートのデータファイルを置くディレクトリ
+TEMPLATE_DIR = os.getenv('TEMPLATE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates'))
+
+# 商品説明の末尾に入れるショップ別フッター（templates/footers/<ショップ名>.txt）
+TEMPLATE_SHOP = os.getenv('TEMPLATE_SHOP', 'default')
+
+# 判定できなかった場合のカテゴリー
+DEFAULT_CATEGORY = 'tops'
+
+# テンプレート中のプレースホルダー（例：{description}）
+PLACEHOLDER_PATTERN = re.compile(r'\{(\w+)\}')
+
+class CompiledTemplate:
+    """プレースホルダーの位置を事前に解析したテンプレート（描画は文字列の連結のみ）"""
+
+    __slots__ = ('_parts', '_slots')
+
+    def __init__(self, source: str, static_values: Dict[str, str]):
+        parts: List[str] = []
+        slots: List[Tuple[int, str]] = []
+        position = 0
+        literal = ''
+        for match in PLACEHOLDER_PATTERN.finditer(source):
+            literal += source[position:match.start()]
+            name = match.group(1)
+            if name in static_values:
+                # カテゴリーやショップごとに決まる値はコンパイル時に埋め込む
+                literal += static_values[name]
+            else:
+                parts.append(literal)
+                slots.append((len(parts), name))
+                parts.append('')
+                literal = ''
+            position = match.end()
+        parts.append(literal + source[position:])
+        self._parts = parts
+        self._slots = tuple(slots)
+
+    def render(self, values: Dict[str, str]) -> str:
+        """プレースホルダーに値を入れて文字列を返す"""
+        parts = list(self._parts)
+        for index, name in self._slots:
+            parts[index] = values.get(name, '')
+        return ''.join(parts)
+
+class TemplateEngine:
+    """カテゴリー別の商品説明テンプレートをデータファイルから読み込み、事前にコンパイルして描画する"""
+
+    def __init__(self, template_dir: str = TEMPLATE_DIR, shop: str = TEMPLATE_SHOP):
+        with open(os.path.join(template_dir, 'categories.json'), encoding='utf-8') as f:
+            self.categories: Dict[str, dict] = json.load(f)
+        with open(os.path.join(template_dir, 'listing.txt'), encoding='utf-8') as f:
+            source = f.read().rstrip('\n')
+        with open(os.path.join(template_dir, 'footers', f'{shop}.txt'), encoding='utf-8') as f:
+            footer = f.read().rstrip('\n')
+
+        # ローカル判定用のキーワード（長いものから照合する）
+        self._keywords = sorted(
+            ((keyword, category) for category, config in self.categories.items()
+             for keyword in config.get('keywords', [])),
+            key=lambda item: -len(item[0])
+        )
+
+        self._templates = {
+            category: CompiledTemplate(source, {
+                'measurements': '\n'.join(config.get('measurements', [])),
+                'footer': footer
+            })
+            for category, config in self.categories.items()
+        }
+
+    def render(self, category: str, values: Dict[str, str]) -> str:
+        """カテゴリーのテンプレートを描画する（未知のカテゴリーはデフォルトのテンプレートを使用）"""
+        template = self._templates.get(category) or self._templates[DEFAULT_CATEGORY]
+        return template.render(values)
+
+    def build_category_choices(self) -> str:
+        """商品種類の判定プロンプトに入れるカテゴリーの一覧を作成"""
+        return '\n'.join(
+            f"{i}. {category}（{config['label']}）: {config['description']}"
+            for i, (category, config) in enumerate(self.categories.items(), 1)
+        )
+
+    def parse_category(self, text: str) -> str:
+        """判定結果のテキストからカテゴリーを取り出す（見つからない場合はデフォルト）"""
+        text = text.lower()
+        for category, config in self.categories.items():
+            if category == DEFAULT_CATEGORY:
+                continue
+            if any(alias.lower() in text for alias in config.get('aliases', [category])):
+                return category
+        return DEFAULT_CATEGORY
+
+    def classify_text(self, text: str) -> Optional[str]:
+        """商品の特徴テキストのキーワードからカテゴリーを判定する（判定できない場合はNone）
+
+        長いキーワードから照合し、一致した部分は以降の照合から除く（「Tシャツ」と「シャツ」を二重に数えない）。
+        一致した文字数が最も多いカテゴリーを返し、同点の場合は判定できないものとする。
+        """
+        scores: Dict[str, int] = {}
+        for keyword, category in self._keywords:
+            if keyword in text:
+                scores[category] = scores.get(category, 0) + len(keyword) * text.count(keyword)
+                text = text.replace(keyword, ' ')
+        if not scores:
+            return None
+        ranked = sorted(scores.items(), key=lambda item: -item[1])
+        if len(ranked) > 1 and ranked[0][1] == ranked[1][1]:
+            return None
+        return ranked[0][0]
+
+_template_engine = None
+
+def get_template_engine() -> TemplateEngine:
+    """テンプレートエンジンのインスタンスを返す（初回のみデータファイルを読み込む）"""
+    global _template_engine
+    if _template_engine is None:
+        _template_engine = TemplateEngine()
+    return _template_engine
+
+def benchmark_render(count: int = 100000) -> dict:
+    """テンプレート描画のスループットを計測する（バッチ処理の見積もり用）"""
+    engine = get_template_engine()
+    categories = list(engine.categories)
+    values = {
+        'description': 'シンプルで合わせやすい一枚です。普段使いにおすすめです。',
+        'hashtags': ' '.join(f'#タグ{i}' for i in range(1, 11))
+    }
+
+    started = time.perf_counter()
+    for i in range(count):
+        engine.render(categories[i % len(categories)], values)
+    elapsed = time.perf_counter() - started
+
+    return {
+        'renders': count,
+        'elapsed_sec': elapsed,
+        'renders_per_sec': count / elapsed if elapsed else 0.0,
+        'us_per_render': elapsed / count * 1e6 if count else 0.0
+    }
+
+if __name__ == "__main__":
+    # 使い方: python template_engine.py [描画回数]
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for key, value in benchmark_render(count).items():
+        print(f"{key}: {value}")
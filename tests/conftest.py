@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# リポジトリ直下のモジュールを読み込めるようにし、ローカルの状態ファイルとトレースはテスト用の一時ディレクトリに書き出す
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LOCAL_STATE_DIR', tempfile.mkdtemp(prefix='shuppin_test_'))
+os.environ.setdefault('TRACE_LOG_FILE', '')
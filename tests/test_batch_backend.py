@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import time
+import threading
+import pytest
+from openai import OpenAI
+from batch_backend import BatchBackend, SUBMIT_STALE_SEC
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from fake_services import create_openai_service  # noqa: E402
+
+class FakeHandler:
+    """ChatGPTHandler のバッチ用のメソッドのみ（画像を使わずに入力を作る）"""
+
+    def __init__(self, url: str):
+        self.client = OpenAI(api_key='sk-test', base_url=f"{url}/v1", max_retries=0)
+
+    def build_listing_batch_request(self, custom_id, image_paths, features=''):
+        body = {'model': 'gpt-4o', 'messages': [{'role': 'user', 'content': features or custom_id}], 'max_tokens': 1000}
+        return {'custom_id': custom_id, 'method': 'POST', 'url': '/v1/chat/completions', 'body': body}, {}
+
+    def parse_listing_batch_result(self, body, image_paths, context):
+        return json.loads(body['choices'][0]['message']['content'])
+
+def make_backend(tmp_path, service):
+    notified = []
+    backend = BatchBackend(
+        FakeHandler(service.url),
+        save_listing=lambda item, product_info: {'management_number': item['management_number'],
+                                                 'product_info': product_info},
+        notify=lambda user_id, results: notified.extend(results),
+        batch_file=str(tmp_path / 'batch.sqlite3')
+    )
+    # バックグラウンドの確認スレッドは使わず、テストから直接呼び出す
+    backend.start = lambda: None
+    for i in range(3):
+        backend.enqueue({'management_number': f"12340{i}", 'image_paths': [], 'features': ''}, 'user')
+    return backend, notified
+
+@pytest.fixture
+def service_factory():
+    services = []
+
+    def start(**options):
+        services.append(create_openai_service(**options).start())
+        return services[-1]
+
+    yield start
+    for service in services:
+        service.stop()
+
+def test_concurrent_submits_create_one_batch(tmp_path, service_factory):
+    service = service_factory(batch_completion_time=3600)
+    backend, _ = make_backend(tmp_path, service)
+    barrier = threading.Barrier(2)
+    batch_ids = []
+
+    def submit():
+        barrier.wait()
+        batch_ids.append(backend.submit_pending(force=True))
+
+    threads = [threading.Thread(target=submit) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert service.calls['batches.create'] == 1
+    assert len([batch_id for batch_id in batch_ids if batch_id]) == 1
+    assert backend.status() == {'pending': 0, 'submitted': 3, 'failed': 0}
+
+def test_stale_submitting_claim_is_requeued(tmp_path, service_factory):
+    service = service_factory(batch_completion_time=3600)
+    backend, _ = make_backend(tmp_path, service)
+    # 送信の途中で終了した（submitting のまま残った）商品と、送信中の商品
+    with backend._lock:
+        backend._conn.execute("UPDATE batch_items SET status = 'submitting', batch_id = 'claim-old', updated_at = ? "
+                              "WHERE management_number != '123402'", (time.time() - SUBMIT_STALE_SEC - 1,))
+        backend._conn.execute("UPDATE batch_items SET status = 'submitting', batch_id = 'claim-new', updated_at = ? "
+                              "WHERE management_number = '123402'", (time.time(),))
+        backend._conn.commit()
+
+    assert backend.submit_pending(force=True) is not None
+    submitted = {item['management_number'] for item in backend._items("status = 'submitted'")}
+    assert submitted == {'123400', '123401'}
+    assert [item['management_number'] for item in backend._items("status = 'submitting'")] == ['123402']
+
+def test_expired_batch_requeues_items_without_output(tmp_path, service_factory):
+    service = service_factory(batch_final_status='expired', batch_output_limit=1)
+    backend, notified = make_backend(tmp_path, service)
+    backend.submit_pending(force=True)
+
+    assert backend.poll() == 1
+    assert [result['management_number'] for result in notified] == ['123400']
+    assert all('product_info' in result for result in notified)
+    assert backend.status() == {'pending': 2, 'submitted': 0, 'failed': 0}
@@ -0,0 +1,25 @@
+import random
+from listing_retrieval import ListingRetrievalIndex, RETRIEVAL_MIN_SCORE
+
+def test_random_image_hashes_score_below_min_score(tmp_path):
+    """特徴テキストのない検索で、無関係な画像（ランダムなハッシュ）の出品例は下限未満になる"""
+    rng = random.Random(0)
+    index = ListingRetrievalIndex(str(tmp_path / 'listings.sqlite3'))
+    for i in range(500):
+        index.add(f"{i:06d}", f"商品{i}", 2980, image_hash=rng.getrandbits(64))
+
+    for _ in range(50):
+        query = rng.getrandbits(64)
+        scores = [result['score'] for result in index.search(image_hash=query, min_score=0.0, top_k=500)]
+        assert all(score < RETRIEVAL_MIN_SCORE for score in scores)
+        assert index.search(image_hash=query) == []
+
+def test_same_image_hash_is_found(tmp_path):
+    """同じ画像（ハッシュの差が数ビット）の出品例は類似度が高い"""
+    index = ListingRetrievalIndex(str(tmp_path / 'listings.sqlite3'))
+    index.add('000001', 'NIKE　半袖Tシャツ', 2980, image_hash=0x0F0F0F0F0F0F0F0F)
+    index.add('000002', 'adidas　スウェット', 3980, image_hash=0xF0F0F0F0F0F0F0F0)
+
+    results = index.search(image_hash=0x0F0F0F0F0F0F0F0E)
+    assert [result['management_number'] for result in results] == ['000001']
+    assert results[0]['score'] > 0.9
@@ -0,0 +1,109 @@
+import os
+import pytest
+from sheet_write_buffer import SheetWriteBuffer
+
+class FakeSheet:
+    """行を追加するだけのシート（crash_after_append=True の場合は追加した後に例外を出す）"""
+
+    def __init__(self, rows=None):
+        self.rows = list(rows or [])
+        self.crash_after_append = False
+        self.fail_before_append = False
+
+    def append(self, sheet_name, rows):
+        if self.fail_before_append:
+            self.fail_before_append = False
+            raise ConnectionError('接続できません')
+        first = len(self.rows) + 1
+        self.rows.extend((row['title'], row['registration_date']) for row in rows)
+        if self.crash_after_append:
+            self.crash_after_append = False
+            raise TimeoutError('追加後にタイムアウト')
+        return list(range(first, first + len(rows)))
+
+    def verify(self, sheet_name, rows):
+        """商品名と登録日が一致する行を後ろから割り当てる（google_sheets_handler._find_appended_rows と同じ規則）"""
+        candidates = {}
+        for row_number, values in enumerate(self.rows, start=1):
+            candidates.setdefault(values, []).append(row_number)
+        row_numbers = [None] * len(rows)
+        for i in reversed(range(len(rows))):
+            matches = candidates.get((rows[i]['title'], rows[i]['registration_date']))
+            if matches:
+                row_numbers[i] = matches.pop()
+        return row_numbers
+
+def make_buffer(tmp_path, sheet):
+    return SheetWriteBuffer(sheet.append, str(tmp_path / 'journal.sqlite3'), flush_interval=3600, batch_size=100,
+                            verify_func=sheet.verify)
+
+def row(number, title, date='2025/07/01'):
+    return {'management_number': number, 'title': f"{title} {number}", 'registration_date': date}
+
+def test_crash_after_append_is_not_duplicated_on_replay(tmp_path):
+    sheet = FakeSheet()
+    buffer = make_buffer(tmp_path, sheet)
+    buffer.enqueue('1234', '123401', row('123401', 'NIKE　Tシャツ'))
+    buffer.enqueue('1234', '123402', row('123402', 'adidas　スウェット'))
+    sheet.crash_after_append = True
+    assert buffer.flush() == 0
+    assert len(sheet.rows) == 2
+
+    # 再起動後のジャーナルの再反映
+    replayed = make_buffer(tmp_path, sheet)
+    replayed.replay()
+    assert len(sheet.rows) == 2
+    assert replayed.pending_count() == 0
+
+def test_in_doubt_row_never_appended_is_reappended(tmp_path):
+    sheet = FakeSheet()
+    buffer = make_buffer(tmp_path, sheet)
+    buffer.enqueue('1234', '123401', row('123401', 'NIKE　Tシャツ'))
+    sheet.fail_before_append = True
+    assert buffer.flush() == 0
+    assert sheet.rows == []
+
+    replayed = make_buffer(tmp_path, sheet)
+    assert replayed.replay() == 1
+    assert sheet.rows == [('NIKE　Tシャツ 123401', '2025/07/01')]
+    assert replayed.pending_count() == 0
+
+def test_reregistered_number_is_not_matched_to_old_row(tmp_path):
+    """同じ管理番号で登録し直した商品は、以前の行があっても反映済みとせずに追加する"""
+    sheet = FakeSheet([('商品名', '登録日'), ('NIKE　Tシャツ 123401', '2025/06/01')])
+    buffer = make_buffer(tmp_path, sheet)
+    buffer.enqueue('1234', '123401', row('123401', 'NIKE　ロングTシャツ'))
+    sheet.fail_before_append = True
+    assert buffer.flush() == 0
+
+    replayed = make_buffer(tmp_path, sheet)
+    assert replayed.replay() == 1
+    assert sheet.rows[-1] == ('NIKE　ロングTシャツ 123401', '2025/07/01')
+    assert len(sheet.rows) == 3
+
+def test_find_appended_rows_matches_title_and_date(monkeypatch):
+    """シートの商品名（B列）と登録日（C列）の両方が一致する行だけを追加済みとする"""
+    # supabase_client は読み込み時に接続先を必要とする（このテストでは接続しない）
+    monkeypatch.setenv('SUPABASE_URL', os.getenv('SUPABASE_URL', 'http://127.0.0.1:1'))
+    monkeypatch.setenv('SUPABASE_KEY', os.getenv('SUPABASE_KEY', 'test'))
+    google_sheets_handler = pytest.importorskip('google_sheets_handler')
+
+    values = [['商品名', '登録日'], ['NIKE　Tシャツ 123401', '2025/06/01'], ['adidas　スウェット 123402', '2025/07/01']]
+
+    class Request:
+        def execute(self):
+            return {'values': values}
+
+    class Values:
+        def get(self, **kwargs):
+            return Request()
+
+    class Service:
+        def values(self):
+            return Values()
+
+    monkeypatch.setattr(google_sheets_handler, 'get_sheet_service', lambda: Service())
+    monkeypatch.setattr(google_sheets_handler, 'get_or_create_sheet', lambda sheet, number: number[:4])
+    monkeypatch.setattr(google_sheets_handler, 'spreadsheet_for', lambda sheet_name: 'spreadsheet')
+    rows = [row('123401', 'NIKE　ロングTシャツ'), row('123402', 'adidas　スウェット')]
+    assert google_sheets_handler._find_appended_rows('1234', rows) == [None, 3]
@@ -0,0 +1,54 @@
+import json
+import pytest
+from streaming_json import StreamingJSONFields
+
+def feed_chunks(chunks):
+    """チャンクを順に読み込み、(最終的なフィールド, チャンクごとに確定したフィールドのリスト) を返す"""
+    parser = StreamingJSONFields()
+    completed = [parser.feed(chunk) for chunk in chunks]
+    return parser.fields, completed
+
+def split_every(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7])
+def test_escapes_split_across_chunks(size):
+    title = 'NIKE "AIR" \\ ナイキ　★ 12345'
+    text = json.dumps({'title': title, 'start_price': 2980}, ensure_ascii=True)
+    assert '\\u' in text and '\\"' in text
+    fields, _ = feed_chunks(split_every(text, size))
+    assert fields == {'title': title, 'start_price': 2980}
+
+def test_nested_values_before_start_price_are_skipped():
+    text = json.dumps({
+        'title': 'ジャケット',
+        'measurements': {'着丈': 70, 'notes': ['袖口に汚れ', {'x': '"}]'}]},
+        'hashtags': ['#古着', '#ジャケット', ['入れ子']],
+        'start_price': 3980
+    }, ensure_ascii=False)
+    fields, _ = feed_chunks(split_every(text, 5))
+    assert fields == {'title': 'ジャケット', 'start_price': 3980}
+
+def test_commas_and_braces_inside_strings():
+    text = '{"title": "シャツ, 長袖, {L}", "description": "a,b:c]", "start_price": 1980}'
+    fields, _ = feed_chunks(split_every(text, 4))
+    assert fields == {'title': 'シャツ, 長袖, {L}', 'description': 'a,b:c]', 'start_price': 1980}
+
+def test_title_completes_before_start_price():
+    chunks = ['```json\n{"ti', 'tle": "デニムパンツ', '", "start_pr', 'ice": 29', '80', ', "category": "pants"}\n```']
+    _, completed = feed_chunks(chunks)
+    assert completed[:3] == [{}, {}, {'title': 'デニムパンツ'}]
+    # 数値は次の「,」が届くまで確定しない
+    assert completed[3] == {} and completed[4] == {}
+    assert completed[5] == {'start_price': 2980, 'category': 'pants'}
+
+def test_truncated_stream_keeps_only_completed_fields():
+    fields, _ = feed_chunks(['{"title": "スウェット", "start_price": 39', '80, "description": "途中で切れ'])
+    assert fields == {'title': 'スウェット', 'start_price': 3980}
+
+    fields, _ = feed_chunks(['{"title": "スウェット", "start_price": 3980'])
+    assert fields == {'title': 'スウェット'}
+
+def test_last_scalar_completes_at_closing_brace():
+    fields, _ = feed_chunks(['{"start_price": 4980', '}'])
+    assert fields == {'start_price': 4980}
@@ -0,0 +1,74 @@
+import os
+import pytest
+from title_optimizer import (
+    shorten_title, check_title_properties, classify_element, _generate_corpus, MAX_TITLE_LENGTH, SEPARATOR
+)
+
+# 実データの形式をまねて手で作成した商品名（実際に出品した商品名ではない）
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'titles.txt')
+
+# 実際の商品名のコーパス（python title_optimizer.py export で索引から書き出したファイル、未設定の場合はテストしない）
+TITLE_CORPUS = os.getenv('TITLE_CORPUS', '')
+
+def load_titles():
+    with open(FIXTURE, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+def elements(title):
+    return [element for element in title.split(SEPARATOR) if element]
+
+@pytest.mark.parametrize('title', load_titles())
+def test_fits_length_budget(title):
+    assert len(shorten_title(title)) <= MAX_TITLE_LENGTH
+
+@pytest.mark.parametrize('title', load_titles())
+def test_preserves_order(title):
+    original = elements(title)
+    position = 0
+    for element in elements(shorten_title(title)):
+        assert element in original[position:]
+        position = original.index(element, position) + 1
+
+@pytest.mark.parametrize('title', load_titles())
+def test_keeps_required_elements(title):
+    """必須要素（アイテム名・色など）がブランド以外すべて収まる場合は、すべて残す"""
+    required = [element for element in elements(title) if classify_element(element) is None]
+    if len(SEPARATOR.join(required[1:])) > MAX_TITLE_LENGTH:
+        pytest.skip('必須要素だけで上限を超える')
+    shortened = elements(shorten_title(title))
+    assert all(element in shortened for element in required[1:])
+
+@pytest.mark.parametrize('title', load_titles())
+def test_has_no_property_violations(title):
+    assert check_title_properties(title, shorten_title(title)) == []
+
+def test_title_within_budget_is_unchanged():
+    assert shorten_title('NIKE　半袖Tシャツ　ブラック　L') == 'NIKE　半袖Tシャツ　ブラック　L'
+
+def test_drops_style_before_size():
+    title = 'THE NORTH FACE　ナイロンジャケット　ネイビー　ポリエステル　無地　XL　アメカジ　ストリート'
+    assert shorten_title(title) == 'THE NORTH FACE　ナイロンジャケット　ネイビー　XL'
+
+def test_drops_brand_when_required_elements_do_not_fit():
+    title = 'UNITED ARROWS GREEN LABEL RELAXING　テーラードジャケット　チャコールグレー　ウール　M'
+    assert shorten_title(title) == 'テーラードジャケット　チャコールグレー　ウール　M'
+
+def test_last_resort_fits_budget():
+    """アイテム名と色だけでも上限を超える場合は、アイテム名を上限の文字数で切り詰める"""
+    item = 'エクストラロングダウンコートフード付き'
+    color = 'ミッドナイトブルーグリーン'
+    title = SEPARATOR.join(['BRAND', item, color, item + '２', color + '２'])
+    assert shorten_title(title) == f'{item}{SEPARATOR}{color}'
+    assert shorten_title(title, max_length=10) == item[:10]
+    assert len(shorten_title(item * 3, max_length=MAX_TITLE_LENGTH)) <= MAX_TITLE_LENGTH
+
+@pytest.mark.skipif(not TITLE_CORPUS, reason='TITLE_CORPUS が設定されていません')
+def test_exported_corpus_has_no_violations():
+    with open(TITLE_CORPUS, encoding='utf-8') as f:
+        titles = [line.strip() for line in f if line.strip()]
+    assert titles
+    assert [title for title in titles if check_title_properties(title, shorten_title(title))] == []
+
+def test_generated_corpus_has_no_violations():
+    titles = _generate_corpus(2000, seed=1)
+    assert [title for title in titles if check_title_properties(title, shorten_title(title))] == []
@@ -0,0 +1,199 @@
+import sys
+import time
+import random
+from typing import List, Optional
+
+# 商品名の要素の区切り文字（全角スペース）
+SEPARATOR = '　'
+
+# 商品名の上限文字数（管理番号6文字が後で追加されるため34文字）
+MAX_TITLE_LENGTH = 34
+
+# 要素の分類に使うキーワード（モジュール読み込み時に1回だけ作成）
+SIZE_WORDS = frozenset(['L', 'XL', 'M', 'S', 'LL', 'XS', 'XXL'])
+STYLE_WORDS = frozenset([
+    'ストリート', 'アメカジ', 'ミリタリー', 'Y2K', 'カジュアル', 'フォーマル', 'スポーツ',
+    '和柄', '総柄', 'チェック柄', 'ストライプ', '無地', 'グラフィック', 'パッチワーク',
+    'イタリア風', 'フレンチ', 'レトロ', 'ヴィンテージ', 'モダン', 'クラシック',
+    'デニム風', 'レザー風', 'シルク風', 'コットン風'
+])
+PATTERN_WORDS = frozenset(['ストライプ', 'チェック', '無地', '迷彩柄', 'ドット'])
+MATERIAL_WORDS = frozenset(['綿', 'デニム', 'レーヨン', 'ポリエステル', 'ウール'])
+
+# 文字数を超えた場合に残す優先度（大きいほど優先して残す）
+# 1. アイテム名・色など分類されない要素は必須
+# 2. サイズ → 素材 → 柄 → 見た目 の順に残す
+KEEP_PRIORITY = {
+    'size': 4,
+    'material': 3,
+    'pattern': 2,
+    'style': 1
+}
+
+def classify_element(element: str) -> Optional[str]:
+    """商品名の要素を分類する（size / style / pattern / material、必須要素はNone）"""
+    if element in SIZE_WORDS or element.isdigit():
+        return 'size'
+    if element in STYLE_WORDS or element.endswith('感') or element.endswith('風') or 'スタイル' in element:
+        return 'style'
+    if element in PATTERN_WORDS:
+        return 'pattern'
+    if element in MATERIAL_WORDS:
+        return 'material'
+    return None
+
+def _joined_length(lengths: List[int]) -> int:
+    """要素の文字数のリストから、区切り文字を含めた全体の文字数を計算"""
+    return sum(lengths) + len(SEPARATOR) * max(len(lengths) - 1, 0)
+
+def shorten_title(title: str, max_length: int = MAX_TITLE_LENGTH) -> str:
+    """商品名をmax_length文字以内に短縮する
+
+    必須要素（アイテム名・色など）を残したうえで、サイズ → 素材 → 柄 → 見た目 の優先順位で
+    収まる要素を1回の走査で選び、元の並び順のまま連結する。
+    必須要素だけで収まらない場合は先頭の要素（ブランド）を省き、それでも収まらない場合は
+    先頭2要素（アイテム名と色）、それも収まらない場合はアイテム名のみ（max_length 文字で切り詰める）を返す。
+    """
+    if len(title) <= max_length:
+        return title
+
+    elements = [element for element in title.split(SEPARATOR) if element]
+    if not elements:
+        return title[:max_length]
+
+    kinds = [classify_element(element) for element in elements]
+    required = [i for i, kind in enumerate(kinds) if kind is None]
+
+    # 必須要素だけで収まらない場合はブランド（先頭の要素）を省く
+    if len(required) > 1 and required[0] == 0 and \
+            _joined_length([len(elements[i]) for i in required]) > max_length:
+        required = required[1:]
+
+    selected = set(required)
+    length = _joined_length([len(elements[i]) for i in required])
+    if length > max_length:
+        # 最後の手段：アイテム名と色のみ残す
+        remaining = [elements[i] for i in required]
+        shortened = SEPARATOR.join(remaining[:2])
+        if len(shortened) > max_length:
+            shortened = remaining[0][:max_length]
+        return shortened
+
+    # 残す優先度の高い順（同じ優先度なら元の並び順）に、収まる要素を追加する
+    removable = sorted(
+        (i for i, kind in enumerate(kinds) if kind is not None),
+        key=lambda i: (-KEEP_PRIORITY[kinds[i]], i)
+    )
+    for i in removable:
+        added = len(elements[i]) + (len(SEPARATOR) if selected else 0)
+        if length + added <= max_length:
+            selected.add(i)
+            length += added
+
+    return SEPARATOR.join(elements[i] for i in sorted(selected))
+
+def _generate_corpus(size: int, seed: int = 0) -> List[str]:
+    """ベンチマーク用の商品名を生成する（実データがない場合に使用）"""
+    rng = random.Random(seed)
+    brands = ['NIKE', 'adidas', 'Levi\'s', 'Ralph Lauren', 'THE NORTH FACE', 'patagonia', 'Champion', '']
+    items = ['半袖Tシャツ', '長袖シャツ', 'デニムパンツ', 'スウェットトレーナー', 'プリーツスカート', 'ナイロンジャケット']
+    colors = ['ブラック', 'ホワイト', 'ネイビー', 'グリーン', 'レッド', 'ベージュ']
+    materials = sorted(MATERIAL_WORDS) + ['綿100', '']
+    patterns = sorted(PATTERN_WORDS) + ['']
+    sizes = sorted(SIZE_WORDS) + ['34', '36', '']
+    styles = sorted(STYLE_WORDS) + ['レトロ感', '']
+
+    corpus = []
+    for _ in range(size):
+        parts = [rng.choice(brands), rng.choice(items), rng.choice(colors), rng.choice(materials),
+                 rng.choice(patterns), rng.choice(sizes), rng.choice(styles), rng.choice(styles)]
+        corpus.append(SEPARATOR.join(part for part in parts if part))
+    return corpus
+
+def export_titles(path: str) -> int:
+    """出品済み商品の索引（スプレッドシートのB列）の商品名を、末尾の管理番号を除いて1行ずつ書き出し、件数を返す
+
+    書き出したファイルは `python title_optimizer.py ファイル` や tests の TITLE_CORPUS に使う実データのコーパスになる。
+    """
+    from item_index import get_item_index, extract_management_number
+
+    titles = []
+    for item in get_item_index().list_items():
+        title = (item.get('title') or '').strip()
+        number = extract_management_number(title)
+        if number:
+            title = title[:-len(number)].strip()
+        if title:
+            titles.append(title)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(f"{title}\n" for title in titles)
+    return len(titles)
+
+def check_title_properties(title: str, shortened: str, max_length: int = MAX_TITLE_LENGTH) -> List[str]:
+    """短縮結果が満たすべき性質を確認し、違反内容のリストを返す"""
+    violations = []
+    elements = [element for element in title.split(SEPARATOR) if element]
+    result = [element for element in shortened.split(SEPARATOR) if element]
+
+    if len(title) <= max_length:
+        if shortened != title:
+            violations.append('上限以内の商品名が変更された')
+        return violations
+
+    if len(shortened) > max_length:
+        violations.append(f'上限を超えている: {len(shortened)}文字')
+
+    # 元の要素を並び順を保ったまま選んでいること（1要素に切り詰めた場合は元の要素の先頭部分）
+    position = 0
+    for element in result:
+        try:
+            position = elements.index(element, position) + 1
+        except ValueError:
+            if not (len(result) == 1 and any(original.startswith(element) for original in elements)):
+                violations.append(f'元の並び順にない要素: {element}')
+            break
+
+    # 必須要素がブランド以外すべて収まる場合は、すべて残っていること
+    required = [element for element in elements if classify_element(element) is None]
+    if len(required) > 2 and len(SEPARATOR.join(required[1:])) <= max_length:
+        missing = [element for element in required[1:] if element not in result]
+        if missing:
+            violations.append(f'必須要素が削除された: {missing}')
+    return violations
+
+def benchmark(titles: List[str], repeat: int = 5) -> dict:
+    """商品名の短縮処理のスループットを計測し、性質の違反件数とあわせて返す"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for title in titles:
+            shorten_title(title)
+    elapsed = time.perf_counter() - started
+
+    violations = 0
+    for title in titles:
+        if check_title_properties(title, shorten_title(title)):
+            violations += 1
+
+    calls = len(titles) * repeat
+    return {
+        'titles': len(titles),
+        'over_limit': sum(1 for title in titles if len(title) > MAX_TITLE_LENGTH),
+        'calls': calls,
+        'elapsed_sec': elapsed,
+        'calls_per_sec': calls / elapsed if elapsed else 0.0,
+        'us_per_call': elapsed / calls * 1e6 if calls else 0.0,
+        'property_violations': violations
+    }
+
+if __name__ == "__main__":
+    # 使い方: python title_optimizer.py [商品名を1行ずつ書いたファイル] / python title_optimizer.py export ファイル
+    if len(sys.argv) > 2 and sys.argv[1] == 'export':
+        print(f"書き出した商品名: {export_titles(sys.argv[2])}件")
+        sys.exit(0)
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding='utf-8') as f:
+            corpus = [line.strip() for line in f if line.strip()]
+    else:
+        corpus = _generate_corpus(5000)
+    for key, value in benchmark(corpus).items():
+        print(f"{key}: {value}")
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+from local_store import get_state_path
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+# スパンをJSON Lines形式で書き出すファイル名（既定は空で書き出さない。例: traces.jsonl）
+TRACE_LOG_FILE = os.getenv('TRACE_LOG_FILE', '')
+
+# トレースログの最大サイズ（MB）。超えたら .1 に移して新しいファイルに書き出す（古い .1 は削除する）
+TRACE_LOG_MAX_MB = float(os.getenv('TRACE_LOG_MAX_MB', '10'))
+
+# OpenTelemetryにもスパンを送るか（opentelemetryがインストールされている場合のみ有効）
+OTEL_ENABLED = os.getenv('OTEL_TRACING', '0') == '1' and otel_trace is not None
+
+# ヒストグラムのバケット（秒）
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 管理番号・ユーザーなど、処理中のスパンすべてに付けるタグ
+_trace_tags: contextvars.ContextVar = contextvars.ContextVar('trace_tags', default={})
+
+class Histogram:
+    """処理時間の分布（Prometheus形式で出力できる累積バケット）"""
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+_histograms: Dict[str, Histogram] = {}
+_metrics_lock = threading.Lock()
+_log_lock = threading.Lock()
+_metrics_providers: List[Callable[[], Dict[str, float]]] = []
+
+def get_trace_tags() -> Dict[str, str]:
+    """現在のスパンに付くタグを返す"""
+    return dict(_trace_tags.get())
+
+@contextmanager
+def trace_context(**tags):
+    """ブロック内で記録するスパンすべてにタグ（management_number, userなど）を付ける"""
+    merged = dict(_trace_tags.get())
+    merged.update({key: value for key, value in tags.items() if value})
+    token = _trace_tags.set(merged)
+    try:
+        yield
+    finally:
+        _trace_tags.reset(token)
+
+@contextmanager
+def span(name: str, **attributes):
+    """処理時間を計測してヒストグラムとログに記録する"""
+    tags = get_trace_tags()
+    tags.update(attributes)
+    otel_span = None
+    if OTEL_ENABLED:
+        otel_span = otel_trace.get_tracer('shuppin_support').start_span(name, attributes={
+            key: str(value) for key, value in tags.items()
+        })
+    started_at = time.time()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield tags
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        record_duration(name, duration)
+        _write_span_log(name, started_at, duration, tags, error)
+        if otel_span is not None:
+            if error is not None:
+                otel_span.record_exception(error)
+            otel_span.end()
+
+def record_duration(name: str, duration: float):
+    """処理時間をヒストグラムに記録する"""
+    with _metrics_lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(duration)
+
+def _rotate_span_log(path: str):
+    """トレースログが TRACE_LOG_MAX_MB を超えていれば .1 に移す（_log_lock を取得した状態で呼ぶ）"""
+    try:
+        if os.path.getsize(path) >= TRACE_LOG_MAX_MB * 1024 * 1024:
+            os.replace(path, f"{path}.1")
+    except FileNotFoundError:
+        pass
+
+def _write_span_log(name: str, started_at: float, duration: float, tags: Dict, error):
+    """スパンをJSON Lines形式でログファイルに追記する"""
+    if not TRACE_LOG_FILE:
+        return
+    record = {'name': name, 'start': started_at, 'duration': round(duration, 6), 'tags': tags}
+    if error is not None:
+        record['error'] = str(error)
+    try:
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with _log_lock:
+            path = get_state_path(TRACE_LOG_FILE)
+            _rotate_span_log(path)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+    except Exception as e:
+        print(f"トレースログ書き込みエラー: {e}")
+
+def register_metrics_provider(provider: Callable[[], Dict[str, float]]):
+    """/metrics に出力する数値を返す関数を登録する（名前 → 値の辞書を返す関数）"""
+    _metrics_providers.append(provider)
+
+def _metric_name(name: str) -> str:
+    return ''.join(ch if ch.isalnum() else '_' for ch in name)
+
+def render_prometheus() -> str:
+    """記録したヒストグラムと登録した数値をPrometheusのテキスト形式で返す"""
+    lines = [
+        '# HELP shuppin_span_duration_seconds 処理ごとの所要時間',
+        '# TYPE shuppin_span_duration_seconds histogram'
+    ]
+    with _metrics_lock:
+        histograms = {name: (list(h.counts), h.total, h.count, h.buckets) for name, h in _histograms.items()}
+    for name, (counts, total, count, buckets) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'shuppin_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'shuppin_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {count}')
+        lines.append(f'shuppin_span_duration_seconds_sum{{span="{name}"}} {total}')
+        lines.append(f'shuppin_span_duration_seconds_count{{span="{name}"}} {count}')
+
+    for provider in _metrics_providers:
+        try:
+            values = provider()
+        except Exception as e:
+            print(f"メトリクス取得エラー: {e}")
+            continue
+        for name, value in sorted(values.items()):
+            lines.append(f'shuppin_{_metric_name(name)} {value}')
+    return '\n'.join(lines) + '\n'
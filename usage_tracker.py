@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import math
+import time
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+from local_store import connect_sqlite
+
+# 呼び出しごとのトークン数と費用を保存するSQLiteのファイル名
+USAGE_FILE = os.getenv('OPENAI_USAGE_FILE', 'openai_usage.sqlite3')
+
+# モデルごとの料金（USD / 100万トークン）。OPENAI_PRICES_JSON で上書きできる
+DEFAULT_PRICES = {
+    'gpt-4o': {'input': 2.50, 'output': 10.00},
+    'gpt-4o-mini': {'input': 0.15, 'output': 0.60}
+}
+PRICES: Dict[str, Dict[str, float]] = {**DEFAULT_PRICES, **json.loads(os.getenv('OPENAI_PRICES_JSON', '{}'))}
+
+# Batch APIで生成した場合の料金（通常の料金に対する割合）
+BATCH_PRICE_RATE = float(os.getenv('OPENAI_BATCH_PRICE_RATE', '0.5'))
+
+# 1日の予算（USD）。超えた場合は安いモデルと低解像度の画像に切り替える（0の場合は無制限）
+DAILY_BUDGET_USD = float(os.getenv('OPENAI_DAILY_BUDGET_USD', '0'))
+BUDGET_FALLBACK_MODEL = os.getenv('OPENAI_BUDGET_FALLBACK_MODEL', 'gpt-4o-mini')
+BUDGET_FALLBACK_DETAIL = os.getenv('OPENAI_BUDGET_FALLBACK_DETAIL', 'low')
+
+def estimate_image_tokens(image_paths: List[str], detail: Union[str, List[str]] = 'auto') -> int:
+    """画像の入力トークン数を見積もる（画像のヘッダーからサイズのみを読み込む）
+
+    low は1枚85トークン。high / auto は2048px四方に収めた後、短辺を768pxに縮小し、
+    512pxのタイル1枚につき170トークン + 85トークンで計算する。
+    detail は画像ごとに指定することもできる（'none' は送らなかった画像）。
+    """
+    details = detail if isinstance(detail, list) else [detail] * len(image_paths)
+
+    from PIL import Image
+    total = 0
+    for image_path, image_detail in zip(image_paths, details):
+        if image_detail == 'none':
+            continue
+        if image_detail == 'low':
+            total += 85
+            continue
+        try:
+            with Image.open(image_path) as image:
+                width, height = image.size
+        except Exception:
+            total += 85
+            continue
+        scale = min(1.0, 2048 / max(width, height))
+        width, height = width * scale, height * scale
+        scale = min(1.0, 768 / min(width, height))
+        width, height = width * scale, height * scale
+        total += 170 * math.ceil(width / 512) * math.ceil(height / 512) + 85
+    return total
+
+def describe_detail(detail: Union[str, List[str]]) -> str:
+    """画像ごとに指定した解像度を記録用の文字列にする（例：high×2 low×3 none×1）"""
+    if not isinstance(detail, list):
+        return detail
+    counts: Dict[str, int] = {}
+    for image_detail in detail:
+        counts[image_detail] = counts.get(image_detail, 0) + 1
+    return ' '.join(f"{image_detail}×{count}" for image_detail, count in counts.items())
+
+def calculate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """トークン数から費用（USD）を計算する（料金が不明なモデルは0）"""
+    price = PRICES.get(model)
+    if price is None:
+        # 日付付きのモデル名（例：gpt-4o-2024-08-06）は前方一致で料金を探す
+        matches = [name for name in PRICES if model.startswith(name)]
+        if not matches:
+            return 0.0
+        price = PRICES[max(matches, key=len)]
+    return (prompt_tokens * price['input'] + completion_tokens * price['output']) / 1_000_000
+
+class UsageTracker:
+    """OpenAIの呼び出しごとのトークン数と費用を記録し、日別・商品別・カテゴリー別に集計する"""
+
+    def __init__(self, usage_file: str = USAGE_FILE):
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(usage_file)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL,
+                day TEXT NOT NULL,
+                management_number TEXT,
+                category TEXT,
+                purpose TEXT,
+                model TEXT,
+                detail TEXT,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                image_tokens INTEGER,
+                image_count INTEGER,
+                cost_usd REAL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS usage_day ON usage(day)')
+        self._conn.commit()
+
+    def record(self, purpose: str, model: str, prompt_tokens: int, completion_tokens: int,
+               management_number: str = '', category: str = '', detail: str = 'auto',
+               image_tokens: int = 0, image_count: int = 0, batch: bool = False) -> float:
+        """1回の呼び出しを記録し、費用（USD）を返す（batch=True の場合はBatch APIの料金）"""
+        cost = calculate_cost(model, prompt_tokens, completion_tokens)
+        if batch:
+            cost *= BATCH_PRICE_RATE
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO usage (created_at, day, management_number, category, purpose, model, detail,
+                                   prompt_tokens, completion_tokens, image_tokens, image_count, cost_usd)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (time.time(), datetime.now().strftime('%Y-%m-%d'), management_number, category, purpose,
+                  model, detail, prompt_tokens, completion_tokens, image_tokens, image_count, cost))
+            self._conn.commit()
+        return cost
+
+    def daily_cost(self, day: Optional[str] = None) -> float:
+        """指定日（既定は今日）の費用の合計（USD）を返す"""
+        day = day or datetime.now().strftime('%Y-%m-%d')
+        with self._lock:
+            row = self._conn.execute('SELECT COALESCE(SUM(cost_usd), 0) FROM usage WHERE day = ?', (day,)).fetchone()
+        return row[0]
+
+    def choose_model_and_detail(self, model: str, detail: str = 'auto') -> Tuple[str, str]:
+        """1日の予算を超えている場合は安いモデルと低解像度の画像に切り替える"""
+        if DAILY_BUDGET_USD > 0 and self.daily_cost() >= DAILY_BUDGET_USD:
+            print(f"本日のOpenAI利用額が予算（${DAILY_BUDGET_USD}）を超えたため {BUDGET_FALLBACK_MODEL} に切り替えます")
+            return BUDGET_FALLBACK_MODEL, BUDGET_FALLBACK_DETAIL
+        return model, detail
+
+    def summarize(self, day: Optional[str] = None) -> Dict:
+        """指定日（既定は今日）の費用を商品別・カテゴリー別に集計する"""
+        day = day or datetime.now().strftime('%Y-%m-%d')
+        with self._lock:
+            totals = self._conn.execute("""
+                SELECT COUNT(*), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0),
+                       COALESCE(SUM(image_tokens), 0), COALESCE(SUM(cost_usd), 0)
+                FROM usage WHERE day = ?
+            """, (day,)).fetchone()
+            items = self._conn.execute("""
+                SELECT management_number, MAX(category) AS category, SUM(cost_usd) AS cost
+                FROM usage WHERE day = ? AND management_number != ''
+                GROUP BY management_number ORDER BY cost DESC
+            """, (day,)).fetchall()
+        categories: Dict[str, List[float]] = {}
+        for item in items:
+            categories.setdefault(item['category'] or '不明', []).append(item['cost'])
+        return {
+            'day': day,
+            'calls': totals[0],
+            'prompt_tokens': totals[1],
+            'completion_tokens': totals[2],
+            'image_tokens': totals[3],
+            'cost_usd': totals[4],
+            'items': [(item['management_number'], item['category'] or '不明', item['cost']) for item in items],
+            'categories': {
+                category: {'items': len(costs), 'cost_usd': sum(costs), 'avg_cost_usd': sum(costs) / len(costs)}
+                for category, costs in categories.items()
+            }
+        }
+
+def format_usage_report(summary: Dict, max_items: int = 10) -> str:
+    """集計結果をLINEの返信・CLI表示用のテキストにする"""
+    item_count = len(summary['items'])
+    lines = [
+        f"💰 OpenAI利用額（{summary['day']}）",
+        f"合計: ${summary['cost_usd']:.4f}（{summary['calls']}回）",
+        f"トークン: 入力 {summary['prompt_tokens']}（うち画像 約{summary['image_tokens']}）/ 出力 {summary['completion_tokens']}"
+    ]
+    if item_count:
+        lines.append(f"1商品あたり: ${sum(cost for _, _, cost in summary['items']) / item_count:.4f}（{item_count}商品）")
+    if summary['categories']:
+        lines.append("")
+        lines.append("【カテゴリー別】")
+        for category, stats in sorted(summary['categories'].items(), key=lambda x: -x[1]['cost_usd']):
+            lines.append(f"{category}: ${stats['cost_usd']:.4f}（{stats['items']}商品、平均 ${stats['avg_cost_usd']:.4f}）")
+    if summary['items']:
+        lines.append("")
+        lines.append("【商品別（上位）】")
+        for management_number, category, cost in summary['items'][:max_items]:
+            lines.append(f"{management_number}（{category}）: ${cost:.4f}")
+    if DAILY_BUDGET_USD > 0:
+        lines.append("")
+        lines.append(f"1日の予算: ${DAILY_BUDGET_USD:.2f}")
+    return "\n".join(lines)
+
+_usage_tracker = None
+
+def get_usage_tracker() -> UsageTracker:
+    """利用量の記録先を返す（初回のみ作成）"""
+    global _usage_tracker
+    if _usage_tracker is None:
+        _usage_tracker = UsageTracker()
+    return _usage_tracker
+
+if __name__ == "__main__":
+    # 使い方: python usage_tracker.py [YYYY-MM-DD]
+    target_day = sys.argv[1] if len(sys.argv) > 1 else None
+    print(format_usage_report(get_usage_tracker().summarize(target_day), max_items=50))